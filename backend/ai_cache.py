@@ -0,0 +1,246 @@
+"""
+AI结果缓存
+按 (用户, 动作, 模型, 提示词哈希) 缓存上游返回的结果，笔记内容未变化时重复请求直接命中缓存
+- 存储在独立的SQLite文件中，重启后仍然有效，与DATABASE_TYPE无关
+- TTL过期 + 按最近访问时间的LRU淘汰，同时限制条目数和总字节数
+- 条目数和总字节数由触发器维护在 ai_cache_totals 中（多个worker共用同一文件时也准确），
+  写入时只读这一行判断是否超限，超限时才按索引淘汰最旧的一批，不扫描全表
+- 键中包含用户ID，不同用户之间互不共享结果
+"""
+
+import hashlib
+import threading
+import time
+from typing import Optional
+
+from config import settings
+from database_async import AsyncRepository
+from database_optimized import DatabaseConnectionPool
+
+def make_cache_key(user_id: str, action: str, model: str, *inputs: Optional[str]) -> str:
+    """由用户、动作、模型和全部提示词输入计算缓存键"""
+    digest = hashlib.sha256()
+    for part in (user_id, action, model, *inputs):
+        value = (part or '').encode('utf-8')
+        # 写入长度前缀，避免不同切分方式拼接出相同的字节串
+        digest.update(len(value).to_bytes(8, 'big'))
+        digest.update(value)
+    return digest.hexdigest()
+
+class AIResultCache:
+    """SQLite持久化的AI结果缓存"""
+
+    EVICT_TARGET = 0.9  # 超限时一次淘汰到上限的90%，摊薄淘汰开销
+    EVICT_BATCH = 100  # 按字节数淘汰时每批删除的条目数
+    EXPIRE_INTERVAL = 60  # 清理过期条目的最小间隔（秒）
+
+    def __init__(self, database_path: str, ttl: float, max_entries: int, max_bytes: int,
+                 enabled: bool = True):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._pool = DatabaseConnectionPool(max_connections=4, database_path=database_path, min_idle=1)
+        self._lock = threading.Lock()
+        self._stats = {}  # action -> {'hits', 'misses', 'writes'}
+        self._evictions = 0
+        self._last_expire = 0.0
+
+        self._init_table()
+
+    def _init_table(self):
+        with self._pool.get_connection() as conn:
+            # 建表、初始化计数和建触发器在同一个事务中完成，避免其他进程在中间写入导致计数偏差
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_cache_last_accessed ON ai_cache(last_accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_cache_user ON ai_cache(user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_cache_expires ON ai_cache(expires_at)')
+
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_cache_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    entries INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO ai_cache_totals (id, entries, bytes)
+                SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM ai_cache
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS ai_cache_totals_insert AFTER INSERT ON ai_cache
+                BEGIN
+                    UPDATE ai_cache_totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 1;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS ai_cache_totals_delete AFTER DELETE ON ai_cache
+                BEGIN
+                    UPDATE ai_cache_totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 1;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS ai_cache_totals_update AFTER UPDATE OF size ON ai_cache
+                BEGIN
+                    UPDATE ai_cache_totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 1;
+                END
+            ''')
+
+    def _totals(self, conn):
+        return conn.execute('SELECT entries, bytes FROM ai_cache_totals WHERE id = 1').fetchone()
+
+    def _count(self, action: str, field: str):
+        with self._lock:
+            counters = self._stats.setdefault(action, {'hits': 0, 'misses': 0, 'writes': 0})
+            counters[field] += 1
+
+    def get(self, user_id: str, action: str, model: str, *inputs: Optional[str]) -> Optional[str]:
+        """查询缓存，未命中或已过期返回None"""
+        if not self.enabled:
+            return None
+
+        cache_key = make_cache_key(user_id, action, model, *inputs)
+        now = time.time()
+
+        with self._pool.get_connection() as conn:
+            row = conn.execute('''
+                SELECT result FROM ai_cache
+                WHERE cache_key = ? AND user_id = ? AND expires_at > ?
+            ''', (cache_key, user_id, now)).fetchone()
+
+            if row:
+                conn.execute('''
+                    UPDATE ai_cache SET last_accessed = ?, hits = hits + 1
+                    WHERE cache_key = ?
+                ''', (now, cache_key))
+
+        self._count(action, 'hits' if row else 'misses')
+        return row['result'] if row else None
+
+    def set(self, user_id: str, action: str, model: str, result: str, *inputs: Optional[str]):
+        """写入缓存并按容量淘汰最久未访问的条目"""
+        if not self.enabled or not result:
+            return
+
+        cache_key = make_cache_key(user_id, action, model, *inputs)
+        size = len(result.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+
+        with self._pool.get_connection() as conn:
+            # 用UPSERT而不是 INSERT OR REPLACE：REPLACE删除旧行时不会触发DELETE触发器
+            conn.execute('''
+                INSERT INTO ai_cache
+                    (cache_key, user_id, action, model, result, size, hits, created_at, last_accessed, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    result = excluded.result, size = excluded.size, hits = 0,
+                    created_at = excluded.created_at, last_accessed = excluded.last_accessed,
+                    expires_at = excluded.expires_at
+            ''', (cache_key, user_id, action, model, result, size, now, now, now + self.ttl))
+
+            evicted = self._evict(conn, now)
+
+        self._count(action, 'writes')
+        if evicted:
+            with self._lock:
+                self._evictions += evicted
+
+    def _evict(self, conn, now: float) -> int:
+        """
+        定期清理过期条目；条目数或字节数超过上限时，按最近访问时间淘汰到上限的 EVICT_TARGET
+        两者都走索引，删除量与淘汰的条目数成正比
+        """
+        evicted = 0
+        if now - self._last_expire >= self.EXPIRE_INTERVAL:
+            self._last_expire = now
+            evicted += conn.execute('DELETE FROM ai_cache WHERE expires_at <= ?', (now,)).rowcount
+
+        totals = self._totals(conn)
+        if totals['entries'] <= self.max_entries and totals['bytes'] <= self.max_bytes:
+            return evicted
+
+        if not evicted:
+            evicted += conn.execute('DELETE FROM ai_cache WHERE expires_at <= ?', (now,)).rowcount
+
+        target_entries = int(self.max_entries * self.EVICT_TARGET)
+        target_bytes = int(self.max_bytes * self.EVICT_TARGET)
+        while True:
+            totals = self._totals(conn)
+            excess = totals['entries'] - target_entries
+            if excess <= 0 and totals['bytes'] <= target_bytes:
+                break
+
+            deleted = conn.execute('''
+                DELETE FROM ai_cache WHERE cache_key IN (
+                    SELECT cache_key FROM ai_cache ORDER BY last_accessed LIMIT ?
+                )
+            ''', (max(excess, self.EVICT_BATCH),)).rowcount
+            if not deleted:
+                break
+            evicted += deleted
+
+        return evicted
+
+    def invalidate(self, user_id: str, action: str, model: str, *inputs: Optional[str]):
+        """删除单个缓存条目（如结果无法解析时）"""
+        cache_key = make_cache_key(user_id, action, model, *inputs)
+        with self._pool.get_connection() as conn:
+            conn.execute('DELETE FROM ai_cache WHERE cache_key = ?', (cache_key,))
+
+    def clear_user(self, user_id: str) -> int:
+        """清除某个用户的全部缓存"""
+        with self._pool.get_connection() as conn:
+            return conn.execute('DELETE FROM ai_cache WHERE user_id = ?', (user_id,)).rowcount
+
+    def get_stats(self) -> dict:
+        """命中率和容量统计"""
+        with self._pool.get_connection() as conn:
+            row = self._totals(conn)
+
+        with self._lock:
+            actions = {action: dict(counters) for action, counters in self._stats.items()}
+            evictions = self._evictions
+
+        hits = sum(counters['hits'] for counters in actions.values())
+        misses = sum(counters['misses'] for counters in actions.values())
+
+        return {
+            'enabled': self.enabled,
+            'entries': row['entries'],
+            'bytes': row['bytes'],
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0,
+            'evictions': evictions,
+            'actions': actions
+        }
+
+# 全局实例
+ai_cache = AIResultCache(
+    database_path=settings.AI_CACHE_PATH,
+    ttl=settings.AI_CACHE_TTL,
+    max_entries=settings.AI_CACHE_MAX_ENTRIES,
+    max_bytes=settings.AI_CACHE_MAX_BYTES,
+    enabled=settings.AI_CACHE_ENABLED
+)
+# 异步代理，在数据库线程池中读写缓存
+async_ai_cache = AsyncRepository(ai_cache)
@@ -1,23 +1,26 @@
+import logging
 from datetime import datetime, timedelta
 from typing import Optional, List, Callable
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from database import user_repo
+from database import async_user_repo
 from config import settings
 from models import User, TokenData
+from user_cache import user_cache
+from password_hashing import pwd_context, verify_password as verify_password_async
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
 # JWT token handling
 security = HTTPBearer()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """同步校验（脚本中使用；异步路由使用 password_hashing 中的线程池版本）"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
+    """同步计算哈希（脚本中使用，如 create_admin.py）"""
     return pwd_context.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -30,38 +33,84 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def decode_access_token(token: str) -> TokenData:
+    """校验JWT并取出声明；新签发的令牌除邮箱(sub)外还带有用户ID(uid)"""
     try:
-        payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except JWTError:
-        raise credentials_exception
-    
-    user_data = user_repo.get_user_by_email(token_data.email)
+        raise _credentials_exception()
+
+    email: str = payload.get("sub")
+    if email is None:
+        raise _credentials_exception()
+    return TokenData(email=email, user_id=payload.get("uid"))
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    token_data = decode_access_token(credentials.credentials)
+
+    # 命中缓存时不访问数据库；资料修改、管理员修改或删除用户时会使缓存失效
+    user = user_cache.get(token_data.email)
+    if user is not None:
+        return user
+
+    user_data = await async_user_repo.get_user_by_email(token_data.email)
     
     if not user_data:
-        raise credentials_exception
-    
-    return User(**user_data)
+        raise _credentials_exception()
+
+    user = User(**user_data)
+    user_cache.set(user)
+    return user
+
+async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """
+    只需要用户ID的路由使用：直接取令牌中的uid声明，不查询用户
+    令牌在有效期内始终可用（与用户缓存不同，不会因删除用户而立即失效），因此只用于按用户ID限定范围的只读接口
+    旧令牌没有uid声明时回退到 get_current_user
+    """
+    token_data = decode_access_token(credentials.credentials)
+    if token_data.user_id:
+        return token_data.user_id
+    return (await get_current_user(credentials)).id
+
+async def get_user_by_id(user_id: str) -> Optional[User]:
+    """按ID加载用户（后台任务中没有请求上下文时使用）"""
+    user = user_cache.get_by_id(user_id)
+    if user is not None:
+        return user
+
+    user_data = await async_user_repo.get_user_by_id(user_id)
+    if not user_data:
+        return None
+
+    user = User(**user_data)
+    user_cache.set(user)
+    return user
 
 async def authenticate_user(email: str, password: str) -> Optional[User]:
-    user_data = user_repo.get_user_by_email(email)
+    user_data = await async_user_repo.get_user_by_email(email)
 
     if not user_data:
         return None
 
-    if not verify_password(password, user_data["password_hash"]):
+    verified, new_hash = await verify_password_async(password, user_data["password_hash"])
+    if not verified:
         return None
 
+    if new_hash:
+        # 哈希参数已调整，按新参数保存（失败不影响本次登录）
+        try:
+            await async_user_repo.update_password_hash(user_data["id"], new_hash, user_data["password_hash"])
+        except Exception as e:
+            logger.warning(f"更新用户 {user_data['id']} 的密码哈希失败: {e}")
+
     return User(**user_data)
 
 async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
@@ -92,10 +141,15 @@ def require_permission(permission: str) -> Callable:
         @app.get("/notes", dependencies=[Depends(require_permission("notes.read"))])
         async def get_notes(): ...
     """
+    from middleware import PermissionRequirement
+
+    # 只在首次检查时编译为位掩码，之后每次检查是一次位运算
+    requirement = PermissionRequirement([permission])
+
     async def permission_checker(current_user: User = Depends(get_current_user)) -> User:
         from middleware import rbac_checker
 
-        if not rbac_checker.has_permission(current_user.id, permission):
+        if not await rbac_checker.run(rbac_checker.has_all_permissions, current_user.id, requirement):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"缺少必要权限: {permission}"
@@ -112,10 +166,14 @@ def require_any_permission(*permissions: str) -> Callable:
         @app.get("/content", dependencies=[Depends(require_any_permission("notes.read", "todos.read"))])
         async def get_content(): ...
     """
+    from middleware import PermissionRequirement
+
+    requirement = PermissionRequirement(permissions)
+
     async def permission_checker(current_user: User = Depends(get_current_user)) -> User:
         from middleware import rbac_checker
 
-        if not rbac_checker.has_any_permission(current_user.id, list(permissions)):
+        if not await rbac_checker.run(rbac_checker.has_any_permission, current_user.id, requirement):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"缺少以下任一权限: {', '.join(permissions)}"
@@ -132,10 +190,14 @@ def require_all_permissions(*permissions: str) -> Callable:
         @app.post("/admin-action", dependencies=[Depends(require_all_permissions("users.manage", "system.config"))])
         async def admin_action(): ...
     """
+    from middleware import PermissionRequirement
+
+    requirement = PermissionRequirement(permissions)
+
     async def permission_checker(current_user: User = Depends(get_current_user)) -> User:
         from middleware import rbac_checker
 
-        if not rbac_checker.has_all_permissions(current_user.id, list(permissions)):
+        if not await rbac_checker.run(rbac_checker.has_all_permissions, current_user.id, requirement):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"缺少以下所有权限: {', '.join(permissions)}"
@@ -155,7 +217,7 @@ def require_role(role_name: str) -> Callable:
     async def role_checker(current_user: User = Depends(get_current_user)) -> User:
         from middleware import rbac_checker
 
-        if not rbac_checker.has_role(current_user.id, role_name):
+        if not await rbac_checker.run(rbac_checker.has_role, current_user.id, role_name):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"需要角色: {role_name}"
@@ -175,7 +237,7 @@ def require_min_role_level(min_level: int) -> Callable:
     async def level_checker(current_user: User = Depends(get_current_user)) -> User:
         from middleware import rbac_checker
 
-        user_level = rbac_checker.get_highest_role_level(current_user.id)
+        user_level = await rbac_checker.run(rbac_checker.get_highest_role_level, current_user.id)
         if user_level < min_level:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -207,7 +269,8 @@ async def check_resource_access(
     """
     from middleware import rbac_checker
 
-    if not rbac_checker.can_access_resource(current_user.id, resource_owner_id, required_permission):
+    if not await rbac_checker.run(rbac_checker.can_access_resource, current_user.id,
+                                  resource_owner_id, required_permission):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"您没有权限访问此资源"
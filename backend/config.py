@@ -7,6 +7,81 @@ class Settings:
     # 数据库配置
     DATABASE_TYPE: str = os.getenv("DATABASE_TYPE", "supabase")  # "sqlite" 或 "supabase"
 
+    # SQLite配置
+    SQLITE_DATABASE_PATH: str = os.getenv("SQLITE_DATABASE_PATH", "notebook.db")
+    SQLITE_POOL_SIZE: int = int(os.getenv("SQLITE_POOL_SIZE", "10"))  # 连接池最大连接数
+    SQLITE_POOL_TIMEOUT: float = float(os.getenv("SQLITE_POOL_TIMEOUT", "30"))  # 获取连接的最长等待秒数
+
+    # 数据库线程池配置（异步路由中执行同步仓储调用）
+    DB_EXECUTOR_WORKERS: int = int(os.getenv("DB_EXECUTOR_WORKERS", os.getenv("SQLITE_POOL_SIZE", "10")))
+
+    # 公开分享页缓存配置
+    SHARE_VIEW_CACHE_SIZE: int = int(os.getenv("SHARE_VIEW_CACHE_SIZE", "1000"))  # 最多缓存的分享页数量
+    SHARE_VIEW_CACHE_TTL: float = float(os.getenv("SHARE_VIEW_CACHE_TTL", "60"))  # 缓存秒数，也是多worker间的最大不一致时间
+    SHARE_VIEW_FLUSH_INTERVAL: float = float(os.getenv("SHARE_VIEW_FLUSH_INTERVAL", "5"))  # 查看次数批量写入间隔（秒）
+
+    # 已认证用户缓存配置（get_current_user）
+    USER_CACHE_ENABLED: bool = os.getenv("USER_CACHE_ENABLED", "true").lower() == "true"
+    USER_CACHE_MAX_SIZE: int = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))  # 最多缓存的用户数
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "60"))  # 缓存秒数，也是多worker间角色变更、删除用户的最大生效延迟
+
+    # RBAC权限缓存配置
+    RBAC_CACHE_SIZE: int = int(os.getenv("RBAC_CACHE_SIZE", "10000"))  # 最多缓存的用户数
+    RBAC_CACHE_TTL: float = float(os.getenv("RBAC_CACHE_TTL", "300"))  # 缓存秒数（版本号未变化时的兜底过期时间）
+    RBAC_VERSION_CHECK_INTERVAL: float = float(os.getenv("RBAC_VERSION_CHECK_INTERVAL", "1"))  # 读取RBAC版本号的间隔（秒），即跨worker的最大生效延迟
+    RBAC_SWEEP_INTERVAL: float = float(os.getenv("RBAC_SWEEP_INTERVAL", "300"))  # 清理过期角色/授权的间隔（秒），0为不清理
+    RBAC_SWEEP_BATCH_SIZE: int = int(os.getenv("RBAC_SWEEP_BATCH_SIZE", "500"))  # 每批删除的行数
+
+    # AI结果缓存配置（独立的SQLite文件）
+    AI_CACHE_ENABLED: bool = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+    AI_CACHE_PATH: str = os.getenv("AI_CACHE_PATH", "ai_cache.db")
+    AI_CACHE_TTL: float = float(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))  # 缓存秒数
+    AI_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_CACHE_MAX_ENTRIES", "10000"))  # 最多缓存条目数
+    AI_CACHE_MAX_BYTES: int = int(os.getenv("AI_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))  # 结果总字节数上限
+
+    # 聊天上下文配置：每次只把最近的若干条历史消息发送给模型
+    CHAT_CONTEXT_MAX_MESSAGES: int = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "40"))  # 最多读取的历史消息数
+    CHAT_CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "4000"))  # 历史消息的估算token上限
+    CHAT_MAX_STREAMS_PER_USER: int = int(os.getenv("CHAT_MAX_STREAMS_PER_USER", "3"))  # 每个用户同时打开的流式回复数
+
+    # SSE流式输出配置
+    SSE_FLUSH_INTERVAL: float = float(os.getenv("SSE_FLUSH_INTERVAL", "0.05"))  # 合并文本片段的最长等待秒数
+    SSE_FLUSH_BYTES: int = int(os.getenv("SSE_FLUSH_BYTES", "1024"))  # 累计达到该字节数立即发出
+    SSE_HEARTBEAT_INTERVAL: float = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))  # 空闲时心跳间隔（秒）
+
+    # 导出配置
+    PDF_RENDER_WORKERS: int = int(os.getenv("PDF_RENDER_WORKERS", "0"))  # PDF渲染进程数，0表示CPU核数
+    EXPORT_CACHE_ENABLED: bool = os.getenv("EXPORT_CACHE_ENABLED", "true").lower() == "true"
+    EXPORT_CACHE_DIR: str = os.getenv("EXPORT_CACHE_DIR", "export_cache")  # 单个笔记导出结果的缓存目录
+    EXPORT_CACHE_MAX_BYTES: int = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 缓存总大小上限
+
+    # AI批量自动分类配置：多个笔记合并到一次上游请求
+    AUTO_CLASSIFY_BATCH_TOKENS: int = int(os.getenv("AUTO_CLASSIFY_BATCH_TOKENS", "6000"))  # 每次请求的估算输入token上限
+    AUTO_CLASSIFY_BATCH_NOTES: int = int(os.getenv("AUTO_CLASSIFY_BATCH_NOTES", "20"))  # 每次请求最多包含的笔记数
+    AUTO_CLASSIFY_CONCURRENCY: int = int(os.getenv("AUTO_CLASSIFY_CONCURRENCY", "4"))  # 每个任务同时进行的上游请求数
+
+    # 笔记推荐索引配置（进程内，按用户增量维护）
+    RECOMMEND_INDEX_MAX_USERS: int = int(os.getenv("RECOMMEND_INDEX_MAX_USERS", "200"))  # 同时保留模型的用户数
+    RECOMMEND_INDEX_TTL: int = int(os.getenv("RECOMMEND_INDEX_TTL", "300"))  # 模型重建间隔（秒），多进程部署时用于同步其他进程的修改
+
+    # 后台任务队列配置（独立的SQLite文件）
+    JOB_QUEUE_PATH: str = os.getenv("JOB_QUEUE_PATH", "jobs.db")
+    JOB_QUEUE_WORKERS: int = int(os.getenv("JOB_QUEUE_WORKERS", "4"))  # 每个进程的worker数
+    JOB_MAX_RUNNING_PER_USER: int = int(os.getenv("JOB_MAX_RUNNING_PER_USER", "2"))  # 每个用户同时运行的任务数
+    JOB_MAX_PENDING_PER_USER: int = int(os.getenv("JOB_MAX_PENDING_PER_USER", "20"))  # 每个用户排队和运行中的任务总数上限
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # 失败后最多执行次数（含首次）
+    JOB_RETRY_BASE_DELAY: float = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))  # 重试退避基数（秒），每次翻倍
+    JOB_RESULT_DIR: str = os.getenv("JOB_RESULT_DIR", "job_results")  # 任务生成的结果文件目录
+    JOB_RESULT_TTL: float = float(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))  # 已结束任务及结果保留秒数
+
+    # 上游HTTP客户端配置（OpenRouter、Gemini共享连接池）
+    OPENROUTER_BASE_URL: str = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    GEMINI_BASE_URL: str = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+    HTTP_POOL_MAX_CONNECTIONS: int = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))  # 每个上游的最大连接数
+    HTTP_POOL_MAX_KEEPALIVE: int = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))  # 保持的空闲连接数
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保留秒数
+
     # Supabase配置
     SUPABASE_URL: str = os.getenv("SUPABASE_URL")
     SUPABASE_ANON_KEY: str = os.getenv("SUPABASE_ANON_KEY")
@@ -17,4 +92,9 @@ class Settings:
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+    # 密码哈希配置
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt轮数，调高后旧哈希在用户登录时重新计算
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))  # 同时进行的哈希计算数，0表示CPU核数（最多4）
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))  # 排队和计算中的请求上限，超出返回503
+
 settings = Settings()
@@ -13,6 +13,19 @@ else:
     print("💾 使用 SQLite 数据库")
     from database_sqlite import *
 
+# 异步仓储：在有界线程池中执行同步仓储调用，供async路由使用
+from database_async import AsyncRepository, run_in_db_executor, shutdown_db_executor
+
+async_user_repo = AsyncRepository(user_repo)
+async_notes_repo = AsyncRepository(notes_repo)
+async_board_repo = AsyncRepository(board_repo)
+async_list_repo = AsyncRepository(list_repo)
+async_card_repo = AsyncRepository(card_repo)
+async_card_comment_repo = AsyncRepository(card_comment_repo)
+async_share_repo = AsyncRepository(share_repo)
+async_chat_repo = AsyncRepository(chat_repo)
+async_rbac_repo = AsyncRepository(rbac_repo)
+
 # 导出数据库类型信息
 DATABASE_INFO = {
     "type": settings.DATABASE_TYPE,
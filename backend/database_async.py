@@ -0,0 +1,69 @@
+"""
+异步数据访问层
+把同步的SQLite/Supabase仓储调用放到有界线程池中执行，避免阻塞事件循环
+接口与同步仓储保持一致，只需在调用前加 await
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """获取或创建数据库线程池单例"""
+    global _db_executor
+
+    if _db_executor is None:
+        # 线程数不超过SQLite连接池大小，避免线程在连接池上排队
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.DB_EXECUTOR_WORKERS,
+            thread_name_prefix="db"
+        )
+
+    return _db_executor
+
+async def run_in_db_executor(func: Callable, *args, **kwargs) -> Any:
+    """在数据库线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_db_executor(),
+        functools.partial(func, *args, **kwargs)
+    )
+
+def shutdown_db_executor(wait: bool = True):
+    """关闭数据库线程池（应用关闭时调用）"""
+    global _db_executor
+
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=wait)
+        _db_executor = None
+
+class AsyncRepository:
+    """
+    同步仓储的异步代理
+    用法:
+        notes = await async_notes_repo.get_notes_by_user(user_id)
+    """
+
+    def __init__(self, repo: Any):
+        self._repo = repo
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._repo, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await run_in_db_executor(attr, *args, **kwargs)
+
+        # 缓存包装结果，避免每次属性访问都重新构建
+        setattr(self, name, wrapper)
+        return wrapper
@@ -6,99 +6,228 @@ from typing import Optional, Any, Dict, List
 from datetime import datetime
 import logging
 import json
+import uuid
+from config import settings
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DATABASE_PATH = "notebook.db"
+DATABASE_PATH = settings.SQLITE_DATABASE_PATH
+
+class PooledConnection:
+    """
+    连接池中借出的连接代理
+    除close()外的所有属性都委托给底层sqlite3连接，close()会把连接归还连接池而不是真正关闭，
+    因此沿用 get_connection() ... conn.close() 写法的旧代码无需修改即可复用连接
+    """
+
+    def __init__(self, pool: "DatabaseConnectionPool", conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 与sqlite3.Connection一致：成功则提交，异常则回滚，但不关闭连接
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        """归还连接到连接池"""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def __del__(self):
+        # 兜底：调用方因异常提前退出而未close时，随代理对象回收归还连接
+        try:
+            self.close()
+        except Exception:
+            pass
 
 class DatabaseConnectionPool:
-    """数据库连接池管理器"""
-    
-    def __init__(self, max_connections=10, timeout=30):
+    """
+    数据库连接池管理器
+    - 每个连接创建时只设置一次PRAGMA（WAL、synchronous、缓存、mmap等）
+    - 线程本地复用：同一线程内的嵌套获取返回同一个连接，避免嵌套调用耗尽连接池
+    - 连接池耗尽时阻塞等待（而不是立即失败），并记录等待时间等指标
+    """
+
+    def __init__(self, max_connections=10, timeout=30, database_path=None, min_idle=3):
         self.max_connections = max_connections
         self.timeout = timeout
+        self.database_path = database_path or DATABASE_PATH
+        self.min_idle = min(min_idle, max_connections)
         self.connections = []
         self.used_connections = set()
         self.lock = threading.Lock()
-        
+        self._available = threading.Condition(self.lock)
+        self._local = threading.local()
+
+        # 指标统计
+        self._created_count = 0
+        self._acquire_count = 0
+        self._reuse_count = 0
+        self._wait_count = 0
+        self._timeout_count = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
         # 预创建连接
         self._create_initial_connections()
-    
+
     def _create_initial_connections(self):
         """创建初始连接"""
-        for _ in range(min(3, self.max_connections)):
+        for _ in range(self.min_idle):
             conn = self._create_connection()
             if conn:
                 self.connections.append(conn)
-    
+
     def _create_connection(self):
         """创建单个数据库连接"""
         try:
             conn = sqlite3.connect(
-                DATABASE_PATH,
+                self.database_path,
                 timeout=self.timeout,
-                check_same_thread=False,
-                isolation_level=None  # 启用自动提交
+                check_same_thread=False  # 连接会在线程间借还，由连接池保证同一时刻只有一个线程使用
             )
-            
+
             # 启用WAL模式以提高并发性能
             conn.execute("PRAGMA journal_mode = WAL")
-            
+
             # 优化性能设置
             conn.execute("PRAGMA synchronous = NORMAL")  # 平衡安全性和性能
             conn.execute("PRAGMA cache_size = -64000")   # 64MB缓存
             conn.execute("PRAGMA temp_store = MEMORY")    # 内存临时存储
             conn.execute("PRAGMA mmap_size = 268435456")  # 256MB内存映射
-            
+
             # 启用外键约束
             conn.execute("PRAGMA foreign_keys = ON")
-            
+
             # 设置行工厂
             conn.row_factory = sqlite3.Row
-            
+
+            self._created_count += 1
             return conn
         except Exception as e:
             logger.error(f"创建数据库连接失败: {e}")
             return None
-    
-    @contextmanager
-    def get_connection(self):
-        """获取数据库连接（上下文管理器）"""
-        conn = None
-        try:
+
+    def acquire(self) -> PooledConnection:
+        """
+        借出一个连接
+        同一线程已持有连接时直接复用（引用计数+1），否则从空闲连接中取出，
+        必要时新建，连接数已达上限时等待其他线程归还
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
             with self.lock:
+                self._acquire_count += 1
+                self._reuse_count += 1
+            return PooledConnection(self, local.conn)
+
+        start_time = time.perf_counter()
+        waited = False
+        with self._available:
+            self._acquire_count += 1
+            while True:
                 if self.connections:
                     conn = self.connections.pop()
-                    self.used_connections.add(conn)
-                elif len(self.used_connections) < self.max_connections:
+                    break
+                if len(self.used_connections) < self.max_connections:
                     conn = self._create_connection()
-                    if conn:
-                        self.used_connections.add(conn)
-            
-            if not conn:
-                raise Exception("无法获取数据库连接")
-            
-            yield conn
-            
+                    if not conn:
+                        raise Exception("无法获取数据库连接")
+                    break
+
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start_time)
+                if remaining <= 0 or not self._available.wait(remaining):
+                    if self.connections or len(self.used_connections) < self.max_connections:
+                        continue
+                    self._timeout_count += 1
+                    raise Exception(f"获取数据库连接超时（{self.timeout}秒）")
+
+            self.used_connections.add(conn)
+
+            if waited:
+                wait_time = time.perf_counter() - start_time
+                self._wait_count += 1
+                self._total_wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        local.conn = conn
+        local.depth = 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接（线程内最后一次归还时才真正放回连接池）"""
+        local = self._local
+        if getattr(local, 'conn', None) is conn:
+            local.depth -= 1
+            if local.depth > 0:
+                return
+            local.conn = None
+
+        # 丢弃调用方未提交的事务，避免脏状态泄漏给下一个使用者
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._available:
+                self.used_connections.discard(conn)
+                self._available.notify()
+            return
+
+        with self._available:
+            if conn not in self.used_connections:
+                return
+            self.used_connections.discard(conn)
+            self.connections.append(conn)
+            self._available.notify()
+
+    @contextmanager
+    def get_connection(self):
+        """获取数据库连接（上下文管理器），正常退出时提交，异常时回滚"""
+        pooled = self.acquire()
+        try:
+            yield pooled
+            if pooled.in_transaction:
+                pooled.commit()
         except Exception as e:
             logger.error(f"数据库操作错误: {e}")
-            if conn:
-                try:
-                    conn.rollback()
-                except:
-                    pass
+            try:
+                pooled.rollback()
+            except Exception:
+                pass
             raise
         finally:
-            if conn:
-                with self.lock:
-                    self.used_connections.discard(conn)
-                    if len(self.connections) < 3:  # 保持最少3个空闲连接
-                        self.connections.append(conn)
-                    else:
-                        conn.close()
-    
+            pooled.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池指标"""
+        with self.lock:
+            waits = self._wait_count
+            return {
+                "max": self.max_connections,
+                "available": len(self.connections),
+                "used": len(self.used_connections),
+                "created": self._created_count,
+                "acquisitions": self._acquire_count,
+                "thread_reuses": self._reuse_count,
+                "waits": waits,
+                "timeouts": self._timeout_count,
+                "avg_wait_ms": round(self._total_wait_time / waits * 1000, 3) if waits else 0.0,
+                "max_wait_ms": round(self._max_wait_time * 1000, 3),
+            }
+
     def close_all(self):
         """关闭所有连接"""
         with self.lock:
@@ -109,56 +238,187 @@ class DatabaseConnectionPool:
                     pass
             self.connections.clear()
             self.used_connections.clear()
+        self._local = threading.local()
 
 # 全局连接池实例
-db_pool = DatabaseConnectionPool()
+db_pool = DatabaseConnectionPool(max_connections=settings.SQLITE_POOL_SIZE, timeout=settings.SQLITE_POOL_TIMEOUT)
 
 class QueryOptimizer:
     """查询优化器"""
-    
+
+    # 声明式索引集合: (索引名, 表名, 列定义)
+    # 与热点查询的 WHERE + ORDER BY 对齐，使过滤和排序都能直接走索引
+    INDEXES = [
+        # 笔记列表: WHERE user_id = ? ORDER BY updated_at DESC, id DESC（含游标分页）
+        ("idx_notes_user_updated", "notes", "user_id, updated_at DESC, id DESC"),
+        # 按文件夹过滤的笔记列表
+        ("idx_notes_user_folder_updated", "notes", "user_id, folder_id, updated_at DESC, id DESC"),
+        # 标签统计/按标签过滤: WHERE user_id = ? [AND tag IN (...)] GROUP BY tag
+        ("idx_note_tags_user_tag", "note_tags", "user_id, tag, note_id"),
+        # 分享: share_token 已有唯一索引；按用户列出分享、按分享分页加载评论
+        ("idx_note_shares_user_created", "note_shares", "user_id, created_at DESC"),
+        ("idx_share_comments_token_created", "share_comments", "share_token, created_at, id"),
+        # 看板
+        ("idx_boards_user_updated", "boards", "user_id, updated_at DESC"),
+        ("idx_lists_board_position", "lists", "board_id, position"),
+        ("idx_cards_list_position", "cards", "list_id, position"),
+        ("idx_card_comments_card_created", "card_comments", "card_id, created_at"),
+        # 聊天: 会话列表和消息历史均为 (时间, id) 游标分页
+        ("idx_chat_sessions_user_updated_id", "chat_sessions", "user_id, updated_at DESC, id DESC"),
+        ("idx_chat_messages_session_created_id", "chat_messages", "session_id, created_at, id"),
+        # RBAC: user_roles/user_permissions 的主键以user_id开头，已可按用户查找；这里补充反向查找
+        ("idx_role_permissions_permission", "role_permissions", "permission_id"),
+        # 过期授权清理: WHERE expires_at <= ?
+        ("idx_user_roles_expires", "user_roles", "expires_at"),
+        ("idx_user_permissions_expires", "user_permissions", "expires_at"),
+    ]
+
+    # 已被上面带id列的索引取代，校验时删除
+    OBSOLETE_INDEXES = [
+        "idx_chat_sessions_user_updated",
+        "idx_chat_messages_session_created",
+    ]
+
+    # 热点查询: (名称, SQL, 示例参数)，EXPLAIN QUERY PLAN 中不允许出现全表扫描或临时排序
+    HOT_QUERIES = [
+        ("notes_by_user",
+         "SELECT * FROM notes WHERE user_id = ? ORDER BY updated_at DESC",
+         ("u",)),
+        ("notes_page",
+         "SELECT * FROM notes WHERE user_id = ? AND (updated_at, id) < (?, ?) "
+         "ORDER BY updated_at DESC, id DESC LIMIT ?",
+         ("u", "2024-01-01T00:00:00Z", "n", 50)),
+        ("notes_by_folder",
+         "SELECT * FROM notes WHERE user_id = ? AND folder_id = ? ORDER BY updated_at DESC, id DESC LIMIT ?",
+         ("u", "f", 50)),
+        ("tag_stats",
+         "SELECT tag, COUNT(*) FROM note_tags WHERE user_id = ? GROUP BY tag",
+         ("u",)),
+        ("notes_by_tags",
+         "SELECT * FROM notes WHERE user_id = ? AND id IN "
+         "(SELECT note_id FROM note_tags WHERE user_id = ? AND tag IN (?, ?)) "
+         "ORDER BY updated_at DESC LIMIT ?",
+         ("u", "u", "a", "b", 50)),
+        ("share_by_token",
+         "SELECT * FROM note_shares WHERE share_token = ?",
+         ("t",)),
+        ("shares_by_user",
+         "SELECT * FROM note_shares WHERE user_id = ? ORDER BY created_at DESC",
+         ("u",)),
+        ("share_comments_page",
+         "SELECT * FROM share_comments WHERE share_token = ? AND (created_at, id) > (?, ?) "
+         "ORDER BY created_at ASC, id ASC LIMIT ?",
+         ("t", "2024-01-01T00:00:00Z", "c", 50)),
+        ("note_by_id",
+         "SELECT * FROM notes WHERE id = ? AND user_id = ?",
+         ("n", "u")),
+        ("notes_by_ids",
+         "SELECT * FROM notes WHERE id IN (?, ?, ?) AND user_id = ?",
+         ("a", "b", "c", "u")),
+        ("user_by_email",
+         "SELECT * FROM users WHERE email = ?",
+         ("a@b.c",)),
+        ("boards_by_user",
+         "SELECT * FROM boards WHERE user_id = ? ORDER BY updated_at DESC",
+         ("u",)),
+        ("lists_by_board",
+         "SELECT * FROM lists WHERE board_id = ? ORDER BY position ASC",
+         ("b",)),
+        ("cards_by_list",
+         "SELECT * FROM cards WHERE list_id = ? ORDER BY position ASC",
+         ("l",)),
+        ("board_cards",
+         "SELECT c.* FROM lists l JOIN cards c ON c.list_id = l.id WHERE l.board_id = ? "
+         "ORDER BY l.position ASC, l.rowid ASC, c.position ASC",
+         ("b",)),
+        ("comments_by_card",
+         "SELECT * FROM card_comments WHERE card_id = ? ORDER BY created_at ASC",
+         ("c",)),
+        ("chat_sessions_by_user",
+         "SELECT * FROM chat_sessions WHERE user_id = ? ORDER BY updated_at DESC",
+         ("u",)),
+        ("chat_sessions_page",
+         "SELECT * FROM chat_sessions WHERE user_id = ? AND (updated_at, id) < (?, ?) "
+         "ORDER BY updated_at DESC, id DESC LIMIT ?",
+         ("u", "2024-01-01T00:00:00Z", "s", 50)),
+        ("chat_messages_page",
+         "SELECT * FROM chat_messages WHERE session_id = ? AND (created_at, id) < (?, ?) "
+         "ORDER BY created_at DESC, id DESC LIMIT ?",
+         ("s", "2024-01-01T00:00:00Z", "m", 50)),
+        ("user_roles",
+         "SELECT r.id, r.name, r.level FROM user_roles ur JOIN roles r ON ur.role_id = r.id "
+         "WHERE ur.user_id = ?",
+         ("u",)),
+        ("user_role_permissions",
+         "SELECT rp.role_id, p.name FROM user_roles ur "
+         "JOIN role_permissions rp ON ur.role_id = rp.role_id "
+         "JOIN permissions p ON rp.permission_id = p.id WHERE ur.user_id = ?",
+         ("u",)),
+        ("user_direct_permissions",
+         "SELECT p.name, up.expires_at FROM user_permissions up JOIN permissions p ON up.permission_id = p.id "
+         "WHERE up.user_id = ?",
+         ("u",)),
+        ("expired_user_roles",
+         "SELECT rowid, expires_at FROM user_roles WHERE expires_at <= ? AND (expires_at, rowid) > (?, ?) "
+         "ORDER BY expires_at, rowid LIMIT ?",
+         ("2024-01-01T00:00:00.000000Z", "", 0, 500)),
+        ("expired_user_permissions",
+         "SELECT rowid, expires_at FROM user_permissions WHERE expires_at <= ? AND (expires_at, rowid) > (?, ?) "
+         "ORDER BY expires_at, rowid LIMIT ?",
+         ("2024-01-01T00:00:00.000000Z", "", 0, 500)),
+    ]
+
+    @staticmethod
+    def ensure_indexes(conn) -> List[str]:
+        """
+        删除已被取代的索引，创建声明的索引并校验其存在
+        返回缺失（创建失败）的索引名列表
+        """
+        for name in QueryOptimizer.OBSOLETE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+        for name, table, columns in QueryOptimizer.INDEXES:
+            try:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+            except Exception as e:
+                logger.warning(f"索引创建失败 {name}: {e}")
+
+        existing = {
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        missing = [name for name, _, _ in QueryOptimizer.INDEXES if name not in existing]
+        if missing:
+            logger.warning(f"以下索引不存在: {', '.join(missing)}")
+        return missing
+
+    @staticmethod
+    def explain(conn, sql: str, params=()) -> List[str]:
+        """返回查询计划的detail列"""
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+    @staticmethod
+    def find_plan_regressions(conn) -> Dict[str, List[str]]:
+        """
+        检查热点查询的查询计划
+        返回 {查询名称: [问题步骤]}，出现全表扫描(SCAN)或需要临时B树（排序、去重、分组，包括 RIGHT PART OF ORDER BY 的部分排序）时视为退化
+        """
+        regressions = {}
+        for name, sql, params in QueryOptimizer.HOT_QUERIES:
+            problems = [
+                detail for detail in QueryOptimizer.explain(conn, sql, params)
+                if detail.startswith("SCAN ") or "USE TEMP B-TREE" in detail
+            ]
+            if problems:
+                regressions[name] = problems
+        return regressions
+
     @staticmethod
     def add_indexes():
         """添加数据库索引以提高查询性能"""
-        indexes = [
-            # 用户表索引
-            "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
-            
-            # 笔记表索引
-            "CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at)",
-            "CREATE INDEX IF NOT EXISTS idx_notes_updated_at ON notes(updated_at)",
-            "CREATE INDEX IF NOT EXISTS idx_notes_title ON notes(title)",
-            
-            # 文件夹表索引
-            "CREATE INDEX IF NOT EXISTS idx_folders_user_id ON folders(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_folders_parent_id ON folders(parent_id)",
-            
-            # 待办事项表索引
-            "CREATE INDEX IF NOT EXISTS idx_todos_user_id ON todos(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_todos_completed ON todos(completed)",
-            "CREATE INDEX IF NOT EXISTS idx_todos_due_date ON todos(due_date)",
-            
-            # 聊天会话表索引
-            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id)",
-            
-            # 版本历史表索引
-            "CREATE INDEX IF NOT EXISTS idx_note_versions_note_id ON note_versions(note_id)",
-            "CREATE INDEX IF NOT EXISTS idx_note_versions_created_at ON note_versions(created_at)",
-            
-            # 项目管理表索引
-            "CREATE INDEX IF NOT EXISTS idx_boards_user_id ON boards(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_board_lists_board_id ON board_lists(board_id)",
-            "CREATE INDEX IF NOT EXISTS idx_board_cards_list_id ON board_cards(list_id)",
-        ]
-        
         with db_pool.get_connection() as conn:
-            for index_sql in indexes:
-                try:
-                    conn.execute(index_sql)
-                    logger.info(f"索引创建成功: {index_sql.split('ON')[1].split('(')[0]}")
-                except Exception as e:
-                    logger.warning(f"索引创建失败: {e}")
+            missing = QueryOptimizer.ensure_indexes(conn)
+            if not missing:
+                logger.info(f"索引校验完成，共 {len(QueryOptimizer.INDEXES)} 个")
     
     @staticmethod
     def analyze_database():
@@ -1,15 +1,94 @@
 import sqlite3
 import uuid
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 import json
+import logging
+from config import settings
+from database_optimized import db_pool, QueryOptimizer
+from pagination import encode_cursor, decode_cursor, make_snippet, SNIPPET_LENGTH
+from rbac_time import format_grant_expiry, parse_grant_expiry
 
-DATABASE_PATH = "notebook.db"
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = settings.SQLITE_DATABASE_PATH
+
+# 变更时需要使权限缓存失效的RBAC表
+RBAC_TABLES = ('roles', 'permissions', 'role_permissions', 'user_roles', 'user_permissions')
+
+def get_rbac_version() -> int:
+    """当前RBAC版本号"""
+    conn = get_connection()
+    try:
+        row = conn.execute('SELECT version FROM rbac_version WHERE id = 1').fetchone()
+        return row['version'] if row else 0
+    finally:
+        conn.close()
+
+def get_permission_names() -> List[str]:
+    """全部权限名（用于编译权限目录）"""
+    conn = get_connection()
+    try:
+        return [row['name'] for row in conn.execute('SELECT name FROM permissions')]
+    finally:
+        conn.close()
+
+def purge_expired_rbac_grants(now: str, batch_size: int = 500) -> int:
+    """
+    分批删除已过期的用户角色和直接授权（每批一个短事务，不长时间占用写锁）
+    now为与 expires_at 相同格式的UTC时间字符串，返回删除的行数
+    按字符串比较只用于借助索引找出候选行，每一行删除前都解析时间确认确实已过期
+    """
+    now_ts = parse_grant_expiry(now)
+    removed = 0
+    for table in ('user_roles', 'user_permissions'):
+        after = ('', 0)  # 上一批最后一行的 (expires_at, rowid)，跳过已检查过但未过期的行
+        while True:
+            conn = get_connection()
+            try:
+                rows = conn.execute(f'''
+                    SELECT rowid, expires_at FROM {table}
+                    WHERE expires_at <= ? AND (expires_at, rowid) > (?, ?)
+                    ORDER BY expires_at, rowid
+                    LIMIT ?
+                ''', (now, *after, batch_size)).fetchall()
+                expired = [row['rowid'] for row in rows if parse_grant_expiry(row['expires_at']) <= now_ts]
+                if expired:
+                    placeholders = ','.join('?' * len(expired))
+                    conn.execute(f'DELETE FROM {table} WHERE rowid IN ({placeholders})', expired)
+                    conn.commit()
+            finally:
+                conn.close()
+
+            removed += len(expired)
+            if len(rows) < batch_size:
+                break
+            after = (rows[-1]['expires_at'], rows[-1]['rowid'])
+    return removed
+
+def _normalize_rbac_expiry(cursor):
+    """
+    把旧数据中非统一格式的授权过期时间（如带时区偏移）改写为统一的UTC格式
+    过期授权的清理按字符串比较查找候选，格式不一致时比较结果与实际时间先后不符
+    无法解析的值保持不变（权限检查时视为已过期）
+    """
+    for table in ('user_roles', 'user_permissions'):
+        rows = cursor.execute(f'''
+            SELECT rowid, expires_at FROM {table}
+            WHERE expires_at IS NOT NULL
+            AND expires_at NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]Z'
+        ''').fetchall()
+        for row in rows:
+            try:
+                normalized = format_grant_expiry(row['expires_at'])
+            except ValueError:
+                logger.warning(f"无法解析的授权过期时间: {table} {row['expires_at']}")
+                continue
+            cursor.execute(f'UPDATE {table} SET expires_at = ? WHERE rowid = ?', (normalized, row['rowid']))
 
 def init_database():
     """初始化SQLite数据库和表"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # 使返回结果可以像字典一样访问
+    conn = get_connection()
     cursor = conn.cursor()
     
     # 创建用户表
@@ -54,6 +133,71 @@ def init_database():
         )
     ''')
     
+    # 为已存在的notes表添加folder_id列（如果不存在）
+    try:
+        cursor.execute("ALTER TABLE notes ADD COLUMN folder_id TEXT")
+    except sqlite3.OperationalError:
+        # 列已存在，忽略错误
+        pass
+    
+    # 创建笔记标签索引表（notes.tags 的规范化副本，由笔记仓储在同一事务内维护）
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_tags'")
+    note_tags_exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS note_tags (
+            note_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,  -- 标签在notes.tags中的顺序
+            PRIMARY KEY (note_id, tag),
+            FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # 首次创建时从已有笔记的JSON标签回填
+    if not note_tags_exists:
+        cursor.execute('''
+            INSERT OR IGNORE INTO note_tags (note_id, user_id, tag, position)
+            SELECT n.id, n.user_id, j.value, j.key
+            FROM notes n, json_each(CASE WHEN json_valid(n.tags) THEN n.tags ELSE '[]' END) j
+            WHERE j.type = 'text'
+        ''')
+
+    # 创建笔记分享表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS note_shares (
+            id TEXT PRIMARY KEY,
+            note_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            share_token TEXT UNIQUE NOT NULL,
+            permission TEXT NOT NULL DEFAULT 'view_only',
+            expires_at TEXT,
+            password TEXT,  -- 访问密码哈希
+            view_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # 创建分享评论表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS share_comments (
+            id TEXT PRIMARY KEY,
+            note_id TEXT NOT NULL,
+            share_token TEXT NOT NULL,
+            content TEXT NOT NULL,
+            author_name TEXT NOT NULL,
+            author_email TEXT,
+            user_id TEXT,  -- 登录用户评论时记录
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (share_token) REFERENCES note_shares (share_token) ON DELETE CASCADE
+        )
+    ''')
+
     # 创建聊天会话表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS chat_sessions (
@@ -157,9 +301,11 @@ def init_database():
         END
     ''')
 
-    # 创建触发器：更新笔记时同步到FTS表
+    # 创建触发器：更新笔记标题或内容时同步到FTS表
+    # 只监听title/content，标签、文件夹和时间戳变更不会重写FTS行（旧版本触发器监听所有列，需重建）
+    cursor.execute('DROP TRIGGER IF EXISTS notes_au')
     cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE ON notes BEGIN
+        CREATE TRIGGER notes_au AFTER UPDATE OF title, content ON notes BEGIN
             UPDATE notes_fts SET title = new.title, content = new.content
             WHERE note_id = new.id;
         END
@@ -240,6 +386,26 @@ def init_database():
         )
     ''')
 
+    # RBAC版本号：角色、权限及其分配的任何变更都会使版本号加1（由触发器维护，
+    # 包括删除用户时级联删除的分配），各worker据此判断权限缓存是否失效
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rbac_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO rbac_version (id, version) VALUES (1, 0)')
+
+    for table in RBAC_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS rbac_version_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE rbac_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
     # 初始化默认角色和权限
     now = datetime.utcnow().isoformat() + 'Z'
 
@@ -390,14 +556,23 @@ def init_database():
                 VALUES (?, ?, ?)
             ''', (user_id, roles_map[role_name], now))
 
+    # 旧数据中的授权过期时间统一为UTC格式
+    _normalize_rbac_expiry(cursor)
+
+    # 创建并校验声明的索引，检查热点查询是否退化为全表扫描
+    QueryOptimizer.ensure_indexes(conn)
+    for query_name, problems in QueryOptimizer.find_plan_regressions(conn).items():
+        logger.warning(f"查询计划退化 {query_name}: {'; '.join(problems)}")
+
     conn.commit()
     conn.close()
 
 def get_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # 使返回结果可以像字典一样访问
-    return conn
+    """
+    从连接池获取数据库连接
+    连接已预设PRAGMA和sqlite3.Row行工厂；conn.close()会把连接归还连接池而不是关闭
+    """
+    return db_pool.acquire()
 
 class SQLiteUserRepository:
     """用户数据操作类"""
@@ -478,6 +653,24 @@ class SQLiteUserRepository:
 
         return self.get_user_by_id(user_id)
 
+    def update_password_hash(self, user_id: str, password_hash: str, expected_hash: str) -> bool:
+        """
+        替换密码哈希（登录时按新的哈希参数重新计算）
+        只在当前哈希仍为expected_hash时更新，避免覆盖并发修改的密码
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+            (password_hash, user_id, expected_hash)
+        )
+        updated = cursor.rowcount > 0
+
+        conn.commit()
+        conn.close()
+        return updated
+
     def get_all_users(self) -> List[dict]:
         """获取所有用户（管理员功能）"""
         conn = get_connection()
@@ -527,10 +720,26 @@ class SQLiteUserRepository:
 
         return deleted
 
+def _replace_note_tags(cursor, note_id: str, user_id: str, tags: List[str]):
+    """重写笔记在note_tags中的标签行，需与notes写入处于同一事务"""
+    cursor.execute('DELETE FROM note_tags WHERE note_id = ?', (note_id,))
+    cursor.executemany('''
+        INSERT OR IGNORE INTO note_tags (note_id, user_id, tag, position)
+        VALUES (?, ?, ?, ?)
+    ''', [(note_id, user_id, tag, position) for position, tag in enumerate(tags or []) if tag])
+
+def _tag_filter_condition(column: str, user_id: str, tags: List[str]) -> Tuple[str, list]:
+    """生成"包含任一标签"的SQL过滤条件，在LIMIT之前由数据库完成过滤"""
+    placeholders = ', '.join('?' * len(tags))
+    condition = (f"{column} IN (SELECT note_id FROM note_tags "
+                 f"WHERE user_id = ? AND tag IN ({placeholders}))")
+    return condition, [user_id, *tags]
+
 class SQLiteNotesRepository:
     """笔记数据操作类"""
     
-    def create_note(self, title: str, content: str, tags: List[str], user_id: str) -> dict:
+    def create_note(self, title: str, content: str, tags: List[str], user_id: str,
+                    folder_id: Optional[str] = None) -> dict:
         """创建新笔记"""
         conn = get_connection()
         cursor = conn.cursor()
@@ -540,9 +749,10 @@ class SQLiteNotesRepository:
         tags_json = json.dumps(tags)
         
         cursor.execute('''
-            INSERT INTO notes (id, title, content, tags, user_id, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (note_id, title, content, tags_json, user_id, now, now))
+            INSERT INTO notes (id, title, content, tags, folder_id, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (note_id, title, content, tags_json, folder_id, user_id, now, now))
+        _replace_note_tags(cursor, note_id, user_id, tags)
         
         conn.commit()
         
@@ -573,6 +783,69 @@ class SQLiteNotesRepository:
         
         conn.close()
         return notes
+
+    def get_notes_page(self, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                       folder_id: Optional[str] = None, uncategorized: bool = False,
+                       summary: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """
+        分页获取用户笔记（按 updated_at, id 倒序的游标分页）
+        - folder_id: 只返回指定文件夹的笔记；uncategorized=True 时只返回未分类笔记
+        - summary: 不返回content，改为返回纯文本摘要snippet
+        返回 (笔记列表, 下一页游标)，没有更多数据时游标为None
+        """
+        where_conditions = ["user_id = ?"]
+        params = [user_id]
+
+        if uncategorized:
+            where_conditions.append("folder_id IS NULL")
+        elif folder_id:
+            where_conditions.append("folder_id = ?")
+            params.append(folder_id)
+
+        position = decode_cursor(cursor)
+        if position:
+            where_conditions.append("(updated_at, id) < (?, ?)")
+            params.extend(position)
+
+        if summary:
+            # 只截取内容前缀用于生成摘要，避免读取整篇HTML
+            columns = "id, title, tags, folder_id, user_id, created_at, updated_at, substr(content, 1, ?) AS snippet"
+            params.insert(0, SNIPPET_LENGTH * 4)
+        else:
+            columns = "*"
+
+        limit_clause = ""
+        if limit:
+            limit_clause = "LIMIT ?"
+            params.append(limit + 1)  # 多取一条用于判断是否还有下一页
+
+        conn = get_connection()
+        cursor_obj = conn.cursor()
+
+        cursor_obj.execute(f'''
+            SELECT {columns} FROM notes
+            WHERE {" AND ".join(where_conditions)}
+            ORDER BY updated_at DESC, id DESC
+            {limit_clause}
+        ''', params)
+
+        rows = cursor_obj.fetchall()
+        conn.close()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+
+        notes = []
+        for row in rows:
+            note_dict = dict(row)
+            note_dict['tags'] = json.loads(note_dict['tags']) if note_dict['tags'] else []
+            if summary:
+                note_dict['snippet'] = make_snippet(note_dict['snippet'])
+            notes.append(note_dict)
+
+        return notes, next_cursor
     
     def get_note_by_id(self, note_id: str, user_id: str) -> Optional[dict]:
         """获取指定笔记"""
@@ -592,6 +865,34 @@ class SQLiteNotesRepository:
             return note_dict
         return None
     
+    def get_notes_by_ids(self, note_ids: List[str], user_id: str) -> List[dict]:
+        """
+        一次查询获取用户的多条笔记，不存在或不属于该用户的ID被忽略
+        调用方负责控制每批ID的数量（不超过SQLite的参数上限）
+        """
+        if not note_ids:
+            return []
+
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        placeholders = ', '.join('?' * len(note_ids))
+        cursor.execute(f'''
+            SELECT * FROM notes WHERE id IN ({placeholders}) AND user_id = ?
+        ''', [*note_ids, user_id])
+
+        notes = []
+        for row in cursor.fetchall():
+            note_dict = dict(row)
+            note_dict['tags'] = json.loads(note_dict['tags']) if note_dict['tags'] else []
+            notes.append(note_dict)
+
+        conn.close()
+
+        # 按主键逐个查找后在Python中排序，避免为了ORDER BY遍历用户的全部笔记
+        notes.sort(key=lambda note: (note['updated_at'], note['id']), reverse=True)
+        return notes
+
     def update_note(self, note_id: str, user_id: str, **kwargs) -> Optional[dict]:
         """更新笔记"""
         conn = get_connection()
@@ -605,11 +906,12 @@ class SQLiteNotesRepository:
             if field == 'tags':
                 update_fields.append('tags = ?')
                 values.append(json.dumps(value))
-            elif field in ['title', 'content']:
+            elif field in ['title', 'content', 'folder_id']:
                 update_fields.append(f'{field} = ?')
                 values.append(value)
         
         if not update_fields:
+            conn.close()
             return self.get_note_by_id(note_id, user_id)
         
         update_fields.append('updated_at = ?')
@@ -620,6 +922,9 @@ class SQLiteNotesRepository:
             UPDATE notes SET {', '.join(update_fields)}
             WHERE id = ? AND user_id = ?
         ''', values)
+
+        if 'tags' in kwargs and cursor.rowcount > 0:
+            _replace_note_tags(cursor, note_id, user_id, kwargs['tags'])
         
         conn.commit()
         conn.close()
@@ -703,6 +1008,12 @@ class SQLiteNotesRepository:
             where_conditions.append("n.folder_id = ?")
             params.append(filters['folder_id'])
 
+        # 添加标签过滤（包含任一标签）
+        if filters.get('tags'):
+            condition, tag_params = _tag_filter_condition("n.id", user_id, filters['tags'])
+            where_conditions.append(condition)
+            params.extend(tag_params)
+
         where_clause = " AND ".join(where_conditions)
 
         # 构建排序子句（验证字段名防止SQL注入）
@@ -739,18 +1050,10 @@ class SQLiteNotesRepository:
             if 'rank' in note_dict:
                 del note_dict['rank']
             note_dict['tags'] = json.loads(note_dict['tags'])
-
-            # 标签过滤（在Python层面处理）
-            if 'tags' in filters and filters['tags']:
-                note_tags_set = set(note_dict['tags'])
-                filter_tags_set = set(filters['tags'])
-                if not filter_tags_set.intersection(note_tags_set):
-                    continue
-
             notes.append(note_dict)
 
         conn.close()
-        return notes[:limit]  # 确保不超过限制
+        return notes
 
     def filter_notes(self, user_id: str, filters: dict, sort_by: str = 'updated_at', sort_order: str = 'desc', limit: int = 50) -> List[dict]:
         """
@@ -778,6 +1081,12 @@ class SQLiteNotesRepository:
             where_conditions.append("folder_id = ?")
             params.append(filters['folder_id'])
 
+        # 添加标签过滤（包含任一标签）
+        if filters.get('tags'):
+            condition, tag_params = _tag_filter_condition("id", user_id, filters['tags'])
+            where_conditions.append(condition)
+            params.extend(tag_params)
+
         where_clause = " AND ".join(where_conditions)
 
         # 构建排序子句
@@ -802,18 +1111,141 @@ class SQLiteNotesRepository:
         for row in cursor.fetchall():
             note_dict = dict(row)
             note_dict['tags'] = json.loads(note_dict['tags'])
+            notes.append(note_dict)
 
-            # 标签过滤
-            if 'tags' in filters and filters['tags']:
-                note_tags_set = set(note_dict['tags'])
-                filter_tags_set = set(filters['tags'])
-                if not filter_tags_set.intersection(note_tags_set):
-                    continue
+        conn.close()
+        return notes
 
-            notes.append(note_dict)
+    def get_tag_stats(self, user_id: str) -> List[dict]:
+        """
+        统计用户标签的使用次数
+        返回 [{'tag', 'notes_count'}]，按使用次数倒序、标签名正序排列
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
 
+        cursor.execute('''
+            SELECT tag, COUNT(*) AS notes_count FROM note_tags
+            WHERE user_id = ?
+            GROUP BY tag
+        ''', (user_id,))
+
+        stats = [dict(row) for row in cursor.fetchall()]
         conn.close()
-        return notes[:limit]
+
+        # 不同标签数量很少，在Python中排序即可，避免对聚合结果建临时B树
+        stats.sort(key=lambda item: (-item['notes_count'], item['tag']))
+        return stats
+
+    def replace_tags(self, user_id: str, source_tags: List[str], target_tag: Optional[str] = None) -> dict:
+        """
+        批量替换标签：把source_tags替换为target_tag（重命名/合并），target_tag为None时删除
+        在一个事务内以集合操作完成，不逐条读写笔记；标签不在FTS索引中，不会触发FTS重写
+        返回 {'updated_notes': 受影响的笔记数, 'tag_usages': 被替换的标签使用次数}
+        """
+        source_tags = [tag for tag in dict.fromkeys(source_tags) if tag and tag != target_tag]
+        if not source_tags:
+            return {'updated_notes': 0, 'tag_usages': 0}
+
+        placeholders = ', '.join('?' * len(source_tags))
+        now = datetime.utcnow().isoformat() + 'Z'
+
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        try:
+            if target_tag:
+                # 目标标签取源标签中最靠前的位置；笔记已有目标标签时保留较前的位置
+                cursor.execute(f'''
+                    INSERT INTO note_tags (note_id, user_id, tag, position)
+                    SELECT note_id, user_id, ?, MIN(position) FROM note_tags
+                    WHERE user_id = ? AND tag IN ({placeholders})
+                    GROUP BY note_id
+                    ON CONFLICT (note_id, tag) DO UPDATE SET position = MIN(position, excluded.position)
+                ''', [target_tag, user_id, *source_tags])
+
+            # 由标签索引表重建受影响笔记的JSON标签
+            cursor.execute(f'''
+                UPDATE notes SET
+                    tags = (
+                        SELECT json_group_array(tag) FROM (
+                            SELECT tag FROM note_tags
+                            WHERE note_id = notes.id AND tag NOT IN ({placeholders})
+                            ORDER BY position
+                        )
+                    ),
+                    updated_at = ?
+                WHERE user_id = ? AND id IN (
+                    SELECT note_id FROM note_tags WHERE user_id = ? AND tag IN ({placeholders})
+                )
+            ''', [*source_tags, now, user_id, user_id, *source_tags])
+            updated_notes = cursor.rowcount
+
+            cursor.execute(f'''
+                DELETE FROM note_tags WHERE user_id = ? AND tag IN ({placeholders})
+            ''', [user_id, *source_tags])
+            tag_usages = cursor.rowcount
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return {'updated_notes': updated_notes, 'tag_usages': tag_usages}
+
+    def add_tags_bulk(self, user_id: str, tags_by_note: Dict[str, List[str]]) -> int:
+        """
+        批量为多个笔记追加标签（如AI批量分类的结果），在一个事务内完成
+        已有标签保持原顺序，新标签排在后面；不属于该用户的笔记被忽略
+        返回标签实际发生变化的笔记数
+        """
+        now = datetime.utcnow().isoformat() + 'Z'
+
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        try:
+            changed_ids = []
+            for note_id, tags in tags_by_note.items():
+                rows = [(tag, offset, note_id, user_id)
+                        for offset, tag in enumerate(dict.fromkeys(tags)) if tag]
+                if not rows:
+                    continue
+                cursor.executemany('''
+                    INSERT INTO note_tags (note_id, user_id, tag, position)
+                    SELECT n.id, n.user_id, ?,
+                           (SELECT COALESCE(MAX(position), -1) + 1 FROM note_tags WHERE note_id = n.id) + ?
+                    FROM notes n WHERE n.id = ? AND n.user_id = ?
+                    ON CONFLICT (note_id, tag) DO NOTHING
+                ''', rows)
+                if cursor.rowcount > 0:
+                    changed_ids.append(note_id)
+
+            # 由标签索引表重建发生变化的笔记的JSON标签
+            for start in range(0, len(changed_ids), 500):
+                batch = changed_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                cursor.execute(f'''
+                    UPDATE notes SET
+                        tags = (
+                            SELECT json_group_array(tag) FROM (
+                                SELECT tag FROM note_tags WHERE note_id = notes.id ORDER BY position
+                            )
+                        ),
+                        updated_at = ?
+                    WHERE user_id = ? AND id IN ({placeholders})
+                ''', [now, user_id, *batch])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return len(changed_ids)
 
 class SQLiteBoardRepository:
     """看板数据操作类"""
@@ -864,45 +1296,67 @@ class SQLiteBoardRepository:
         
         return dict(board_row) if board_row else None
     
-    def get_board_with_data(self, board_id: str, user_id: str) -> Optional[dict]:
-        """获取看板及其完整数据（包含列表和卡片）"""
-        board = self.get_board_by_id(board_id, user_id)
-        if not board:
-            return None
-        
+    def get_board_with_data(self, board_id: str, user_id: str, since: Optional[str] = None) -> Optional[dict]:
+        """
+        获取看板及其完整数据（包含列表和卡片）
+        列表和卡片各用一次查询取回，在Python中按列表分组
+        since: 只返回该时间之后变更的列表和卡片（列表本身未变更但含变更卡片时也会返回），用于客户端增量刷新
+        """
         conn = get_connection()
         cursor = conn.cursor()
-        
+
+        cursor.execute('''
+            SELECT * FROM boards WHERE id = ? AND user_id = ?
+        ''', (board_id, user_id))
+
+        board_row = cursor.fetchone()
+        if not board_row:
+            conn.close()
+            return None
+
         # 获取看板的所有列表
         cursor.execute('''
             SELECT * FROM lists WHERE board_id = ?
             ORDER BY position ASC
         ''', (board_id,))
-        
+        list_rows = cursor.fetchall()
+
+        # 一次取回看板下的所有卡片（l.rowid 保证同一列表的卡片连续，整个排序都能走索引）
+        card_conditions = ["l.board_id = ?"]
+        params = [board_id]
+        if since:
+            card_conditions.append("c.updated_at > ?")
+            params.append(since)
+
+        cursor.execute(f'''
+            SELECT c.* FROM lists l
+            JOIN cards c ON c.list_id = l.id
+            WHERE {" AND ".join(card_conditions)}
+            ORDER BY l.position ASC, l.rowid ASC, c.position ASC
+        ''', params)
+        card_rows = cursor.fetchall()
+
+        conn.close()
+
+        cards_by_list = {}
+        for card_row in card_rows:
+            card_dict = dict(card_row)
+            card_dict['tags'] = json.loads(card_dict['tags']) if card_dict['tags'] else []
+            card_dict['completed'] = bool(card_dict['completed'])
+            cards_by_list.setdefault(card_dict['list_id'], []).append(card_dict)
+
         lists = []
-        for list_row in cursor.fetchall():
+        for list_row in list_rows:
             list_dict = dict(list_row)
-            
-            # 获取列表的所有卡片
-            cursor.execute('''
-                SELECT * FROM cards WHERE list_id = ?
-                ORDER BY position ASC
-            ''', (list_dict['id'],))
-            
-            cards = []
-            for card_row in cursor.fetchall():
-                card_dict = dict(card_row)
-                card_dict['tags'] = json.loads(card_dict['tags']) if card_dict['tags'] else []
-                card_dict['completed'] = bool(card_dict['completed'])
-                cards.append(card_dict)
-            
-            list_dict['cards'] = cards
+            list_dict['cards'] = cards_by_list.get(list_dict['id'], [])
+            if since and list_dict['updated_at'] <= since and not list_dict['cards']:
+                continue
             lists.append(list_dict)
-        
-        conn.close()
+
+        board = dict(board_row)
         board['lists'] = lists
         return board
-    
+
     def update_board(self, board_id: str, user_id: str, **kwargs) -> Optional[dict]:
         """更新看板"""
         conn = get_connection()
@@ -917,6 +1371,7 @@ class SQLiteBoardRepository:
                 values.append(value)
         
         if not update_fields:
+            conn.close()
             return self.get_board_by_id(board_id, user_id)
         
         update_fields.append('updated_at = ?')
@@ -986,6 +1441,7 @@ class SQLiteListRepository:
                 values.append(value)
         
         if not update_fields:
+            conn.close()
             return self.get_list_by_id(list_id)
         
         update_fields.append('updated_at = ?')
@@ -1076,6 +1532,7 @@ class SQLiteCardRepository:
                 values.append(value)
         
         if not update_fields:
+            conn.close()
             return self.get_card_by_id(card_id)
         
         update_fields.append('updated_at = ?')
@@ -1159,6 +1616,514 @@ class SQLiteCardCommentRepository:
         conn.close()
         return comments
 
+class SQLiteShareRepository:
+    """笔记分享和评论数据操作类"""
+
+    def create_share(self, note_id: str, user_id: str, share_token: str, permission: str,
+                     expires_at: Optional[str] = None, password: Optional[str] = None) -> dict:
+        """创建分享记录，password为已哈希的访问密码"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        share_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat() + 'Z'
+
+        cursor.execute('''
+            INSERT INTO note_shares (id, note_id, user_id, share_token, permission,
+                                     expires_at, password, view_count, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+        ''', (share_id, note_id, user_id, share_token, permission, expires_at, password, now, now))
+
+        conn.commit()
+
+        cursor.execute('SELECT * FROM note_shares WHERE id = ?', (share_id,))
+        share_row = cursor.fetchone()
+        conn.close()
+
+        return dict(share_row)
+
+    def get_share_by_token(self, share_token: str) -> Optional[dict]:
+        """通过分享token获取分享记录"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM note_shares WHERE share_token = ?', (share_token,))
+        share_row = cursor.fetchone()
+        conn.close()
+
+        return dict(share_row) if share_row else None
+
+    def get_share_by_id(self, share_id: str) -> Optional[dict]:
+        """通过ID获取分享记录"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM note_shares WHERE id = ?', (share_id,))
+        share_row = cursor.fetchone()
+        conn.close()
+
+        return dict(share_row) if share_row else None
+
+    def get_shares_by_user(self, user_id: str) -> List[dict]:
+        """获取用户创建的所有分享"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT * FROM note_shares WHERE user_id = ?
+            ORDER BY created_at DESC
+        ''', (user_id,))
+
+        shares = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return shares
+
+    def delete_share(self, share_id: str, user_id: str) -> bool:
+        """删除分享（评论随外键级联删除）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM note_shares WHERE id = ? AND user_id = ?', (share_id, user_id))
+
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+
+        return deleted
+
+    def increment_view_count(self, share_token: str, amount: int = 1) -> Optional[int]:
+        """原子地增加查看次数，返回增加后的值；分享不存在时返回None"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE note_shares SET view_count = view_count + ?
+            WHERE share_token = ?
+        ''', (amount, share_token))
+
+        view_count = None
+        if cursor.rowcount > 0:
+            cursor.execute('SELECT view_count FROM note_shares WHERE share_token = ?', (share_token,))
+            view_count = cursor.fetchone()['view_count']
+
+        conn.commit()
+        conn.close()
+
+        return view_count
+
+    def increment_view_counts(self, counts: dict) -> None:
+        """在一个事务内批量增加多个分享的查看次数，counts为 {share_token: 增量}"""
+        if not counts:
+            return
+
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            UPDATE note_shares SET view_count = view_count + ?
+            WHERE share_token = ?
+        ''', [(amount, share_token) for share_token, amount in counts.items()])
+
+        conn.commit()
+        conn.close()
+
+    def create_comment(self, share_token: str, note_id: str, content: str, author_name: str,
+                       author_email: Optional[str] = None, user_id: Optional[str] = None) -> dict:
+        """创建分享评论"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        comment_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat() + 'Z'
+
+        cursor.execute('''
+            INSERT INTO share_comments (id, note_id, share_token, content, author_name,
+                                        author_email, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (comment_id, note_id, share_token, content, author_name, author_email, user_id, now, now))
+
+        conn.commit()
+
+        cursor.execute('SELECT * FROM share_comments WHERE id = ?', (comment_id,))
+        comment_row = cursor.fetchone()
+        conn.close()
+
+        return dict(comment_row)
+
+    def get_comments_page(self, share_token: str, limit: int = 50,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        分页获取分享的评论（按 created_at, id 正序的游标分页）
+        返回 (评论列表, 下一页游标)，没有更多数据时游标为None
+        """
+        where_conditions = ["share_token = ?"]
+        params = [share_token]
+
+        position = decode_cursor(cursor)
+        if position:
+            where_conditions.append("(created_at, id) > (?, ?)")
+            params.extend(position)
+
+        params.append(limit + 1)  # 多取一条用于判断是否还有下一页
+
+        conn = get_connection()
+        cursor_obj = conn.cursor()
+
+        cursor_obj.execute(f'''
+            SELECT * FROM share_comments
+            WHERE {" AND ".join(where_conditions)}
+            ORDER BY created_at ASC, id ASC
+            LIMIT ?
+        ''', params)
+
+        comments = [dict(row) for row in cursor_obj.fetchall()]
+        conn.close()
+
+        next_cursor = None
+        if len(comments) > limit:
+            comments = comments[:limit]
+            next_cursor = encode_cursor(comments[-1]['created_at'], comments[-1]['id'])
+
+        return comments, next_cursor
+
+    def get_comment_by_id(self, comment_id: str) -> Optional[dict]:
+        """获取指定评论"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM share_comments WHERE id = ?', (comment_id,))
+        comment_row = cursor.fetchone()
+        conn.close()
+
+        return dict(comment_row) if comment_row else None
+
+    def delete_comment(self, comment_id: str) -> bool:
+        """删除评论"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM share_comments WHERE id = ?', (comment_id,))
+
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+
+        return deleted
+
+class SQLiteChatRepository:
+    """聊天会话和消息数据操作类"""
+
+    def create_session(self, user_id: str, title: str, model: str) -> dict:
+        """创建聊天会话"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        session_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat() + 'Z'
+
+        cursor.execute('''
+            INSERT INTO chat_sessions (id, title, model, user_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (session_id, title, model, user_id, now, now))
+
+        conn.commit()
+
+        cursor.execute('SELECT * FROM chat_sessions WHERE id = ?', (session_id,))
+        session_row = cursor.fetchone()
+        conn.close()
+
+        return dict(session_row)
+
+    def get_session(self, session_id: str, user_id: str) -> Optional[dict]:
+        """获取用户的指定会话"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM chat_sessions WHERE id = ? AND user_id = ?', (session_id, user_id))
+        session_row = cursor.fetchone()
+        conn.close()
+
+        return dict(session_row) if session_row else None
+
+    def get_sessions_page(self, user_id: str, limit: Optional[int] = None,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        分页获取用户的聊天会话（按 updated_at, id 倒序的游标分页）
+        返回 (会话列表, 下一页游标)，没有更多数据时游标为None
+        """
+        where_conditions = ["user_id = ?"]
+        params = [user_id]
+
+        position = decode_cursor(cursor)
+        if position:
+            where_conditions.append("(updated_at, id) < (?, ?)")
+            params.extend(position)
+
+        limit_clause = ""
+        if limit:
+            limit_clause = "LIMIT ?"
+            params.append(limit + 1)  # 多取一条用于判断是否还有下一页
+
+        conn = get_connection()
+        cursor_obj = conn.cursor()
+
+        cursor_obj.execute(f'''
+            SELECT * FROM chat_sessions
+            WHERE {" AND ".join(where_conditions)}
+            ORDER BY updated_at DESC, id DESC
+            {limit_clause}
+        ''', params)
+
+        sessions = [dict(row) for row in cursor_obj.fetchall()]
+        conn.close()
+
+        next_cursor = None
+        if limit and len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_cursor(sessions[-1]['updated_at'], sessions[-1]['id'])
+
+        return sessions, next_cursor
+
+    def update_session(self, session_id: str, user_id: str, **kwargs) -> Optional[dict]:
+        """更新会话标题或模型"""
+        update_fields = []
+        values = []
+
+        for field in ('title', 'model'):
+            if kwargs.get(field) is not None:
+                update_fields.append(f"{field} = ?")
+                values.append(kwargs[field])
+
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        if update_fields:
+            update_fields.append("updated_at = ?")
+            values.append(datetime.utcnow().isoformat() + 'Z')
+            values.extend([session_id, user_id])
+
+            cursor.execute(f'''
+                UPDATE chat_sessions SET {", ".join(update_fields)}
+                WHERE id = ? AND user_id = ?
+            ''', values)
+            conn.commit()
+
+        cursor.execute('SELECT * FROM chat_sessions WHERE id = ? AND user_id = ?', (session_id, user_id))
+        session_row = cursor.fetchone()
+        conn.close()
+
+        return dict(session_row) if session_row else None
+
+    def delete_session(self, session_id: str, user_id: str) -> bool:
+        """删除会话（消息随外键级联删除）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM chat_sessions WHERE id = ? AND user_id = ?', (session_id, user_id))
+
+        deleted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+
+        return deleted
+
+    def add_messages(self, session_id: str, messages: List[dict]) -> List[dict]:
+        """
+        在一个事务内追加多条消息并更新会话的 updated_at
+        messages: [{'role', 'content', 'created_at'(可选)}]，按时间顺序排列
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        now = datetime.utcnow().isoformat() + 'Z'
+        rows = [
+            (str(uuid.uuid4()), session_id, message['content'], message['role'], message.get('created_at') or now)
+            for message in messages
+        ]
+
+        cursor.executemany('''
+            INSERT INTO chat_messages (id, session_id, content, role, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        cursor.execute('UPDATE chat_sessions SET updated_at = ? WHERE id = ?', (now, session_id))
+
+        conn.commit()
+        conn.close()
+
+        return [
+            {'id': message_id, 'session_id': session_id, 'content': content, 'role': role, 'created_at': created_at}
+            for message_id, session_id, content, role, created_at in rows
+        ]
+
+    def get_messages_page(self, session_id: str, limit: int = 50,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        分页获取会话消息：第一页为最新的消息，游标指向更早的消息（按 created_at, id 倒序的游标分页）
+        每页内按时间正序返回，返回 (消息列表, 更早一页的游标)
+        """
+        where_conditions = ["session_id = ?"]
+        params = [session_id]
+
+        position = decode_cursor(cursor)
+        if position:
+            where_conditions.append("(created_at, id) < (?, ?)")
+            params.extend(position)
+
+        params.append(limit + 1)  # 多取一条用于判断是否还有更早的消息
+
+        conn = get_connection()
+        cursor_obj = conn.cursor()
+
+        cursor_obj.execute(f'''
+            SELECT * FROM chat_messages
+            WHERE {" AND ".join(where_conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', params)
+
+        messages = [dict(row) for row in cursor_obj.fetchall()]
+        conn.close()
+
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_cursor(messages[-1]['created_at'], messages[-1]['id'])
+
+        messages.reverse()
+        return messages, next_cursor
+
+class SQLiteRBACRepository:
+    """角色、权限及其分配的数据操作类（RBAC管理接口使用；权限检查由 middleware.rbac_checker 负责）"""
+
+    def get_roles(self) -> List[dict]:
+        """所有角色（按级别从高到低）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM roles ORDER BY level DESC')
+        roles = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return roles
+
+    def get_role(self, role_id: str) -> Optional[dict]:
+        """获取单个角色"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM roles WHERE id = ?', (role_id,))
+        role_row = cursor.fetchone()
+        conn.close()
+
+        return dict(role_row) if role_row else None
+
+    def get_role_permissions(self, role_id: str) -> List[dict]:
+        """角色拥有的所有权限"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT p.*
+            FROM role_permissions rp
+            JOIN permissions p ON rp.permission_id = p.id
+            WHERE rp.role_id = ?
+        ''', (role_id,))
+        permissions = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return permissions
+
+    def get_permissions(self) -> List[dict]:
+        """所有权限（按资源和操作排序）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM permissions ORDER BY resource, action')
+        permissions = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return permissions
+
+    def get_permission(self, permission_id: str) -> Optional[dict]:
+        """获取单个权限"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM permissions WHERE id = ?', (permission_id,))
+        permission_row = cursor.fetchone()
+        conn.close()
+
+        return dict(permission_row) if permission_row else None
+
+    def get_permissions_by_resource(self, resource: str) -> List[dict]:
+        """某个资源的所有权限"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM permissions WHERE resource = ?', (resource,))
+        permissions = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return permissions
+
+    def assign_role(self, user_id: str, role_id: str, assigned_by: str, expires_at: Optional[str] = None):
+        """为用户分配角色（已分配时更新分配人和过期时间）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        now = datetime.utcnow().isoformat() + 'Z'
+        cursor.execute('''
+            INSERT OR REPLACE INTO user_roles
+            (user_id, role_id, assigned_at, assigned_by, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, role_id, now, assigned_by, expires_at))
+
+        conn.commit()
+        conn.close()
+
+    def revoke_role(self, user_id: str, role_id: str) -> bool:
+        """撤销用户的角色，关联不存在时返回False"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM user_roles WHERE user_id = ? AND role_id = ?', (user_id, role_id))
+        deleted = cursor.rowcount > 0
+
+        conn.commit()
+        conn.close()
+
+        return deleted
+
+    def grant_permission(self, user_id: str, permission_id: str, granted_by: str,
+                         expires_at: Optional[str] = None):
+        """直接为用户授予权限（已授予时更新授予人和过期时间）"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        now = datetime.utcnow().isoformat() + 'Z'
+        cursor.execute('''
+            INSERT OR REPLACE INTO user_permissions
+            (user_id, permission_id, granted_at, granted_by, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, permission_id, now, granted_by, expires_at))
+
+        conn.commit()
+        conn.close()
+
+    def revoke_permission(self, user_id: str, permission_id: str) -> bool:
+        """撤销用户的直接权限，关联不存在时返回False"""
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM user_permissions WHERE user_id = ? AND permission_id = ?',
+                       (user_id, permission_id))
+        deleted = cursor.rowcount > 0
+
+        conn.commit()
+        conn.close()
+
+        return deleted
+
 # 初始化数据库
 init_database()
 
@@ -1169,3 +2134,6 @@ board_repo = SQLiteBoardRepository()
 list_repo = SQLiteListRepository()
 card_repo = SQLiteCardRepository()
 card_comment_repo = SQLiteCardCommentRepository()
+share_repo = SQLiteShareRepository()
+chat_repo = SQLiteChatRepository()
+rbac_repo = SQLiteRBACRepository()
@@ -6,9 +6,11 @@ Supabase数据库访问层
 from supabase import create_client, Client
 from supabase.lib.client_options import ClientOptions
 from config import settings
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import json
+from collections import Counter
+from pagination import encode_cursor, decode_cursor, make_snippet, SNIPPET_LENGTH
 
 # 全局Supabase客户端
 _supabase_client: Optional[Client] = None
@@ -73,6 +75,14 @@ def update_user(user_id: str, **kwargs) -> Dict[str, Any]:
     result = supabase.table('users').update(kwargs).eq('id', user_id).execute()
     return result.data[0]
 
+def update_password_hash(user_id: str, password_hash: str, expected_hash: str) -> bool:
+    """替换密码哈希，只在当前哈希仍为expected_hash时更新"""
+    supabase = get_supabase_client()
+
+    result = supabase.table('users').update({'password_hash': password_hash}) \
+        .eq('id', user_id).eq('password_hash', expected_hash).execute()
+    return bool(result.data)
+
 def delete_user(user_id: str) -> bool:
     """删除用户"""
     supabase = get_supabase_client()
@@ -84,7 +94,8 @@ def delete_user(user_id: str) -> bool:
 # 笔记相关操作
 # ===========================================
 
-def create_note(title: str, content: str, user_id: str, tags: Optional[List[str]] = None) -> Dict[str, Any]:
+def create_note(title: str, content: str, user_id: str, tags: Optional[List[str]] = None,
+                folder_id: Optional[str] = None) -> Dict[str, Any]:
     """创建新笔记"""
     supabase = get_supabase_client()
 
@@ -92,7 +103,8 @@ def create_note(title: str, content: str, user_id: str, tags: Optional[List[str]
         'title': title,
         'content': content,
         'user_id': user_id,
-        'tags': tags or []
+        'tags': tags or [],
+        'folder_id': folder_id
     }
 
     result = supabase.table('notes').insert(note_data).execute()
@@ -110,6 +122,63 @@ def get_notes_by_user(user_id: str, limit: Optional[int] = None, offset: int = 0
     result = query.execute()
     return result.data
 
+NOTE_SUMMARY_COLUMNS = 'id,title,tags,folder_id,user_id,created_at,updated_at'
+
+def get_notes_page(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                   folder_id: Optional[str] = None, uncategorized: bool = False,
+                   summary: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    分页获取用户笔记（按 updated_at, id 倒序的游标分页）
+    优先调用数据库函数get_notes_page（摘要模式只传输内容前缀），失败时退回PostgREST查询
+    """
+    supabase = get_supabase_client()
+    position = decode_cursor(cursor)
+    fetch_limit = limit + 1 if limit else None  # 多取一条用于判断是否还有下一页
+
+    try:
+        result = supabase.rpc('get_notes_page', {
+            'user_uuid': user_id,
+            'page_limit': fetch_limit,
+            'cursor_updated_at': position[0] if position else None,
+            'cursor_id': position[1] if position else None,
+            'folder': folder_id if not uncategorized else None,
+            'only_uncategorized': uncategorized,
+            'content_length': SNIPPET_LENGTH * 4 if summary else None
+        }).execute()
+        rows = result.data
+    except:
+        # PostgREST无法截断列，摘要模式下仍需取回content再在本地生成摘要
+        columns = NOTE_SUMMARY_COLUMNS + ',content' if summary else '*'
+        query = supabase.table('notes').select(columns).eq('user_id', user_id)
+
+        if uncategorized:
+            query = query.is_('folder_id', 'null')
+        elif folder_id:
+            query = query.eq('folder_id', folder_id)
+
+        if position:
+            updated_at, note_id = position
+            query = query.or_(
+                f'updated_at.lt."{updated_at}",and(updated_at.eq."{updated_at}",id.lt.{note_id})'
+            )
+
+        query = query.order('updated_at', desc=True).order('id', desc=True)
+        if fetch_limit:
+            query = query.limit(fetch_limit)
+
+        rows = query.execute().data
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+
+    if summary:
+        for row in rows:
+            row['snippet'] = make_snippet(row.pop('content', None))
+
+    return rows, next_cursor
+
 def get_note_by_id(note_id: str) -> Optional[Dict[str, Any]]:
     """通过ID获取笔记"""
     supabase = get_supabase_client()
@@ -152,6 +221,90 @@ def search_notes(user_id: str, query: str) -> List[Dict[str, Any]]:
             .or_(f'title.ilike.%{query}%,content.ilike.%{query}%').execute()
         return result.data
 
+def get_tag_stats(user_id: str) -> List[Dict[str, Any]]:
+    """统计用户标签的使用次数（数据库端GROUP BY）"""
+    supabase = get_supabase_client()
+
+    try:
+        result = supabase.rpc('get_tag_stats', {'user_uuid': user_id}).execute()
+        return result.data
+    except:
+        # RPC不可用时退回客户端统计
+        result = supabase.table('notes').select('tags').eq('user_id', user_id).execute()
+        counter = Counter(tag for row in result.data for tag in set(row.get('tags') or []))
+        return [
+            {'tag': tag, 'notes_count': count}
+            for tag, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+        ]
+
+def replace_tags(user_id: str, source_tags: List[str], target_tag: Optional[str] = None) -> Dict[str, int]:
+    """
+    批量替换标签（target_tag为None时删除）
+    优先调用数据库函数replace_tags在一个事务内完成，失败时退回逐条更新
+    """
+    supabase = get_supabase_client()
+
+    source_tags = [tag for tag in dict.fromkeys(source_tags) if tag and tag != target_tag]
+    if not source_tags:
+        return {'updated_notes': 0, 'tag_usages': 0}
+
+    try:
+        result = supabase.rpc('replace_tags', {
+            'user_uuid': user_id,
+            'source_tags': source_tags,
+            'target_tag': target_tag
+        }).execute()
+        return result.data[0]
+    except:
+        result = supabase.table('note_tags').select('note_id')\
+            .eq('user_id', user_id).in_('tag', source_tags).execute()
+        tag_usages = len(result.data)
+        note_ids = list({row['note_id'] for row in result.data})
+        if not note_ids:
+            return {'updated_notes': 0, 'tag_usages': 0}
+
+        notes = supabase.table('notes').select('id,tags').in_('id', note_ids).execute().data
+        for note in notes:
+            new_tags = []
+            for tag in note.get('tags') or []:
+                replacement = target_tag if tag in source_tags else tag
+                if replacement and replacement not in new_tags:
+                    new_tags.append(replacement)
+            supabase.table('notes').update({'tags': new_tags}).eq('id', note['id']).execute()
+
+        return {'updated_notes': len(notes), 'tag_usages': tag_usages}
+
+def add_tags_bulk(user_id: str, tags_by_note: Dict[str, List[str]]) -> int:
+    """
+    批量为多个笔记追加标签
+    优先调用数据库函数add_note_tags在一个事务内完成，失败时退回逐条更新
+    """
+    supabase = get_supabase_client()
+
+    tags_by_note = {note_id: [tag for tag in dict.fromkeys(tags) if tag]
+                    for note_id, tags in tags_by_note.items()}
+    tags_by_note = {note_id: tags for note_id, tags in tags_by_note.items() if tags}
+    if not tags_by_note:
+        return 0
+
+    try:
+        result = supabase.rpc('add_note_tags', {
+            'user_uuid': user_id,
+            'tags_by_note': tags_by_note
+        }).execute()
+        return result.data
+    except:
+        notes = supabase.table('notes').select('id,tags')\
+            .eq('user_id', user_id).in_('id', list(tags_by_note)).execute().data
+        updated = 0
+        for note in notes:
+            current = note.get('tags') or []
+            new_tags = current + [tag for tag in tags_by_note[note['id']] if tag not in current]
+            if len(new_tags) > len(current):
+                supabase.table('notes').update({'tags': new_tags}).eq('id', note['id']).execute()
+                updated += 1
+        return updated
+
 # ===========================================
 # 项目看板相关操作
 # ===========================================
@@ -411,6 +564,26 @@ def init_database():
     """初始化数据库(Supabase版本中表已通过SQL创建,此函数仅用于兼容性)"""
     pass
 
+def get_rbac_version() -> int:
+    """RBAC版本号（Supabase版本未维护，权限缓存只按TTL过期）"""
+    return 0
+
+def get_permission_names() -> List[str]:
+    """全部权限名（用于编译权限目录）"""
+    supabase = get_supabase_client()
+    result = supabase.table('permissions').select('name').execute()
+    return [row['name'] for row in result.data or []]
+
+def purge_expired_rbac_grants(now: str, batch_size: int = 500) -> int:
+    """删除已过期的用户角色和直接授权，返回删除的行数"""
+    supabase = get_supabase_client()
+
+    removed = 0
+    for table in ('user_roles', 'user_permissions'):
+        result = supabase.table(table).delete().lte('expires_at', now).execute()
+        removed += len(result.data or [])
+    return removed
+
 def get_connection():
     """获取数据库连接（为了兼容SQLite接口）"""
     return get_supabase_client()
@@ -433,6 +606,9 @@ class SupabaseUserRepository:
     
     def update_user(self, user_id: str, **kwargs) -> Optional[dict]:
         return update_user(user_id, **kwargs)
+
+    def update_password_hash(self, user_id: str, password_hash: str, expected_hash: str) -> bool:
+        return update_password_hash(user_id, password_hash, expected_hash)
     
     def get_all_users(self) -> List[dict]:
         supabase = get_supabase_client()
@@ -463,11 +639,17 @@ class SupabaseUserRepository:
 class SupabaseNotesRepository:
     """笔记数据操作类 - 兼容SQLite接口"""
     
-    def create_note(self, title: str, content: str, tags: List[str], user_id: str) -> dict:
-        return create_note(title, content, user_id, tags)
+    def create_note(self, title: str, content: str, tags: List[str], user_id: str,
+                    folder_id: Optional[str] = None) -> dict:
+        return create_note(title, content, user_id, tags, folder_id)
     
     def get_notes_by_user(self, user_id: str) -> List[dict]:
         return get_notes_by_user(user_id)
+
+    def get_notes_page(self, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                       folder_id: Optional[str] = None, uncategorized: bool = False,
+                       summary: bool = False) -> Tuple[List[dict], Optional[str]]:
+        return get_notes_page(user_id, limit, cursor, folder_id, uncategorized, summary)
     
     def get_note_by_id(self, note_id: str, user_id: str) -> Optional[dict]:
         note = get_note_by_id(note_id)
@@ -475,6 +657,14 @@ class SupabaseNotesRepository:
             return note
         return None
     
+    def get_notes_by_ids(self, note_ids: List[str], user_id: str) -> List[dict]:
+        if not note_ids:
+            return []
+        supabase = get_supabase_client()
+        result = supabase.table('notes').select('*').in_('id', note_ids).eq('user_id', user_id)\
+            .order('updated_at', desc=True).order('id', desc=True).execute()
+        return result.data
+    
     def update_note(self, note_id: str, user_id: str, **kwargs) -> Optional[dict]:
         # 验证所有权
         note = self.get_note_by_id(note_id, user_id)
@@ -492,6 +682,15 @@ class SupabaseNotesRepository:
     def search_notes(self, user_id: str, query: str, limit: int = 50) -> List[dict]:
         return search_notes(user_id, query)
 
+    def get_tag_stats(self, user_id: str) -> List[dict]:
+        return get_tag_stats(user_id)
+
+    def replace_tags(self, user_id: str, source_tags: List[str], target_tag: Optional[str] = None) -> dict:
+        return replace_tags(user_id, source_tags, target_tag)
+
+    def add_tags_bulk(self, user_id: str, tags_by_note: Dict[str, List[str]]) -> int:
+        return add_tags_bulk(user_id, tags_by_note)
+
 
 class SupabaseBoardRepository:
     """看板数据操作类 - 兼容SQLite接口"""
@@ -508,16 +707,29 @@ class SupabaseBoardRepository:
             return board
         return None
     
-    def get_board_with_data(self, board_id: str, user_id: str) -> Optional[dict]:
-        board = self.get_board_by_id(board_id, user_id)
-        if not board:
+    def get_board_with_data(self, board_id: str, user_id: str, since: Optional[str] = None) -> Optional[dict]:
+        # 通过PostgREST嵌套资源一次请求取回看板、列表和卡片
+        supabase = get_supabase_client()
+        query = supabase.table('boards').select('*, lists(*, cards(*))')\
+            .eq('id', board_id).eq('user_id', user_id)
+        if since:
+            query = query.gt('lists.cards.updated_at', since)
+
+        result = query.execute()
+        if not result.data:
             return None
-        
-        # 获取所有列表和卡片
-        lists = get_lists_by_board(board_id)
+
+        board = result.data[0]
+        lists = sorted(board.get('lists') or [], key=lambda item: item.get('position') or 0)
         for list_item in lists:
-            list_item['cards'] = get_cards_by_list(list_item['id'])
-        
+            list_item['cards'] = sorted(list_item.get('cards') or [], key=lambda card: card.get('position') or 0)
+
+        if since:
+            lists = [
+                list_item for list_item in lists
+                if list_item['cards'] or str(list_item['updated_at']) > since
+            ]
+
         board['lists'] = lists
         return board
     
@@ -594,6 +806,255 @@ class SupabaseCardCommentRepository:
         return result.data
 
 
+class SupabaseShareRepository:
+    """笔记分享和评论数据操作类 - 兼容SQLite接口"""
+
+    def create_share(self, note_id: str, user_id: str, share_token: str, permission: str,
+                     expires_at: Optional[str] = None, password: Optional[str] = None) -> dict:
+        supabase = get_supabase_client()
+        share_data = {
+            'note_id': note_id,
+            'user_id': user_id,
+            'share_token': share_token,
+            'permission': permission,
+            'expires_at': expires_at,
+            'password': password
+        }
+        result = supabase.table('note_shares').insert(share_data).execute()
+        return result.data[0]
+
+    def get_share_by_token(self, share_token: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('note_shares').select('*').eq('share_token', share_token).execute()
+        return result.data[0] if result.data else None
+
+    def get_share_by_id(self, share_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('note_shares').select('*').eq('id', share_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_shares_by_user(self, user_id: str) -> List[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('note_shares').select('*').eq('user_id', user_id)\
+            .order('created_at', desc=True).execute()
+        return result.data
+
+    def delete_share(self, share_id: str, user_id: str) -> bool:
+        supabase = get_supabase_client()
+        result = supabase.table('note_shares').delete().eq('id', share_id).eq('user_id', user_id).execute()
+        return len(result.data) > 0
+
+    def increment_view_count(self, share_token: str, amount: int = 1) -> Optional[int]:
+        # 通过数据库函数原子自增，避免读-改-写竞争
+        supabase = get_supabase_client()
+        result = supabase.rpc('increment_share_view_count', {
+            'token': share_token,
+            'amount': amount
+        }).execute()
+        return result.data
+
+    def increment_view_counts(self, counts: dict) -> None:
+        for share_token, amount in counts.items():
+            self.increment_view_count(share_token, amount)
+
+    def create_comment(self, share_token: str, note_id: str, content: str, author_name: str,
+                       author_email: Optional[str] = None, user_id: Optional[str] = None) -> dict:
+        supabase = get_supabase_client()
+        comment_data = {
+            'share_token': share_token,
+            'note_id': note_id,
+            'content': content,
+            'author_name': author_name,
+            'author_email': author_email,
+            'user_id': user_id
+        }
+        result = supabase.table('share_comments').insert(comment_data).execute()
+        return result.data[0]
+
+    def get_comments_page(self, share_token: str, limit: int = 50,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        supabase = get_supabase_client()
+        query = supabase.table('share_comments').select('*').eq('share_token', share_token)
+
+        position = decode_cursor(cursor)
+        if position:
+            created_at, comment_id = position
+            query = query.or_(
+                f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{comment_id})'
+            )
+
+        rows = query.order('created_at').order('id').limit(limit + 1).execute().data
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        return rows, next_cursor
+
+    def get_comment_by_id(self, comment_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('share_comments').select('*').eq('id', comment_id).execute()
+        return result.data[0] if result.data else None
+
+    def delete_comment(self, comment_id: str) -> bool:
+        supabase = get_supabase_client()
+        result = supabase.table('share_comments').delete().eq('id', comment_id).execute()
+        return len(result.data) > 0
+
+
+class SupabaseChatRepository:
+    """聊天会话和消息数据操作类 - 兼容SQLite接口"""
+
+    def create_session(self, user_id: str, title: str, model: str) -> dict:
+        return create_chat_session(title, model, user_id)
+
+    def get_session(self, session_id: str, user_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('chat_sessions').select('*').eq('id', session_id).eq('user_id', user_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_sessions_page(self, user_id: str, limit: Optional[int] = None,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        supabase = get_supabase_client()
+        query = supabase.table('chat_sessions').select('*').eq('user_id', user_id)
+
+        position = decode_cursor(cursor)
+        if position:
+            updated_at, session_id = position
+            query = query.or_(
+                f'updated_at.lt."{updated_at}",and(updated_at.eq."{updated_at}",id.lt.{session_id})'
+            )
+
+        query = query.order('updated_at', desc=True).order('id', desc=True)
+        if limit:
+            query = query.limit(limit + 1)
+        rows = query.execute().data
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+
+        return rows, next_cursor
+
+    def update_session(self, session_id: str, user_id: str, **kwargs) -> Optional[dict]:
+        supabase = get_supabase_client()
+        update_data = {field: kwargs[field] for field in ('title', 'model') if kwargs.get(field) is not None}
+        if not update_data:
+            return self.get_session(session_id, user_id)
+
+        result = supabase.table('chat_sessions').update(update_data)\
+            .eq('id', session_id).eq('user_id', user_id).execute()
+        return result.data[0] if result.data else None
+
+    def delete_session(self, session_id: str, user_id: str) -> bool:
+        supabase = get_supabase_client()
+        result = supabase.table('chat_sessions').delete().eq('id', session_id).eq('user_id', user_id).execute()
+        return len(result.data) > 0
+
+    def add_messages(self, session_id: str, messages: List[dict]) -> List[dict]:
+        # 一次请求批量插入，单条INSERT语句在数据库中是原子的
+        supabase = get_supabase_client()
+        now = datetime.utcnow().isoformat() + 'Z'
+        rows = [
+            {
+                'session_id': session_id,
+                'content': message['content'],
+                'role': message['role'],
+                'created_at': message.get('created_at') or now
+            }
+            for message in messages
+        ]
+        result = supabase.table('chat_messages').insert(rows).execute()
+        supabase.table('chat_sessions').update({'updated_at': now}).eq('id', session_id).execute()
+        return result.data
+
+    def get_messages_page(self, session_id: str, limit: int = 50,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        supabase = get_supabase_client()
+        query = supabase.table('chat_messages').select('*').eq('session_id', session_id)
+
+        position = decode_cursor(cursor)
+        if position:
+            created_at, message_id = position
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{message_id})'
+            )
+
+        rows = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute().data
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        rows.reverse()
+        return rows, next_cursor
+
+
+class SupabaseRBACRepository:
+    """角色、权限及其分配的数据操作类 - 兼容SQLite接口"""
+
+    def get_roles(self) -> List[dict]:
+        return get_all_roles()
+
+    def get_role(self, role_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('roles').select('*').eq('id', role_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_role_permissions(self, role_id: str) -> List[dict]:
+        return get_role_permissions(role_id)
+
+    def get_permissions(self) -> List[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('permissions').select('*').order('resource').order('action').execute()
+        return result.data
+
+    def get_permission(self, permission_id: str) -> Optional[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('permissions').select('*').eq('id', permission_id).execute()
+        return result.data[0] if result.data else None
+
+    def get_permissions_by_resource(self, resource: str) -> List[dict]:
+        supabase = get_supabase_client()
+        result = supabase.table('permissions').select('*').eq('resource', resource).execute()
+        return result.data
+
+    def assign_role(self, user_id: str, role_id: str, assigned_by: str, expires_at: Optional[str] = None):
+        supabase = get_supabase_client()
+        supabase.table('user_roles').upsert({
+            'user_id': user_id,
+            'role_id': role_id,
+            'assigned_at': datetime.utcnow().isoformat() + 'Z',
+            'assigned_by': assigned_by,
+            'expires_at': expires_at
+        }).execute()
+
+    def revoke_role(self, user_id: str, role_id: str) -> bool:
+        supabase = get_supabase_client()
+        result = supabase.table('user_roles').delete().eq('user_id', user_id).eq('role_id', role_id).execute()
+        return len(result.data) > 0
+
+    def grant_permission(self, user_id: str, permission_id: str, granted_by: str,
+                         expires_at: Optional[str] = None):
+        supabase = get_supabase_client()
+        supabase.table('user_permissions').upsert({
+            'user_id': user_id,
+            'permission_id': permission_id,
+            'granted_at': datetime.utcnow().isoformat() + 'Z',
+            'granted_by': granted_by,
+            'expires_at': expires_at
+        }).execute()
+
+    def revoke_permission(self, user_id: str, permission_id: str) -> bool:
+        supabase = get_supabase_client()
+        result = supabase.table('user_permissions').delete()\
+            .eq('user_id', user_id).eq('permission_id', permission_id).execute()
+        return len(result.data) > 0
+
+
 # 创建全局实例 - 与SQLite版本保持一致
 user_repo = SupabaseUserRepository()
 notes_repo = SupabaseNotesRepository()
@@ -601,6 +1062,9 @@ board_repo = SupabaseBoardRepository()
 list_repo = SupabaseListRepository()
 card_repo = SupabaseCardRepository()
 card_comment_repo = SupabaseCardCommentRepository()
+share_repo = SupabaseShareRepository()
+chat_repo = SupabaseChatRepository()
+rbac_repo = SupabaseRBACRepository()
 
 if __name__ == "__main__":
     # 测试数据库连接
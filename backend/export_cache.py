@@ -0,0 +1,206 @@
+"""
+导出结果磁盘缓存
+单个笔记导出的PDF/HTML按 (笔记ID, 更新时间, 格式, 模板版本) 缓存在磁盘上：
+- 笔记未修改时，重复导出和重新下载直接读取文件，不再渲染
+- 笔记修改后更新时间变化，自然落到新的键上；写入新版本时顺带删除同一笔记的旧版本
+- 总大小超过 EXPORT_CACHE_MAX_BYTES 时按最近访问时间淘汰
+- ETag为文件内容的哈希，支持 If-None-Match 条件请求
+
+文件名形如 {笔记哈希}-{版本哈希}-{内容哈希}.{格式}，重启后扫描目录即可恢复索引（按修改时间恢复LRU顺序）
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_FILE_PATTERN = re.compile(r'^([0-9a-f]{16})-([0-9a-f]{16})-([0-9a-f]{32})\.(\w+)$')
+
+def _short_hash(raw: str, length: int = 16) -> str:
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:length]
+
+class CachedExport:
+    """一个缓存的导出文件"""
+
+    __slots__ = ('note_hash', 'path', 'size', 'etag')
+
+    def __init__(self, note_hash: str, path: str, size: int, content_hash: str):
+        self.note_hash = note_hash
+        self.path = path
+        self.size = size
+        self.etag = f'"{content_hash}"'
+
+class ExportCache:
+    """磁盘上的导出结果缓存（LRU，按总字节数限制）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, CachedExport]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _keys(note_id: str, updated_at: str, format: str, template_version: int):
+        note_hash = _short_hash(note_id)
+        revision_hash = _short_hash(f"{updated_at}:{format}:{template_version}")
+        return note_hash, f"{note_hash}-{revision_hash}"
+
+    def _ensure_loaded(self):
+        """首次使用时扫描缓存目录恢复索引（调用方持有锁）"""
+        if self._loaded:
+            return
+        self._loaded = True
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            match = _FILE_PATTERN.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, match, entry.path, stat.st_size))
+
+        # 修改时间越早越先淘汰
+        for _, match, path, size in sorted(found, key=lambda item: item[0]):
+            note_hash, revision_hash, content_hash, _ = match.groups()
+            key = f"{note_hash}-{revision_hash}"
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous.size
+                self._remove_file(previous.path)
+            self._entries[key] = CachedExport(note_hash, path, size, content_hash)
+            self._total_bytes += size
+
+        self._evict()
+
+    def get(self, note_id: str, updated_at: str, format: str, template_version: int) -> Optional[CachedExport]:
+        """获取当前版本笔记的缓存文件"""
+        if not self.enabled:
+            return None
+
+        _, key = self._keys(note_id, updated_at, format, template_version)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry and os.path.exists(entry.path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # 更新修改时间，重启后仍能恢复访问顺序
+                try:
+                    os.utime(entry.path)
+                except OSError:
+                    pass
+                return entry
+
+            if entry:
+                # 文件被外部删除
+                del self._entries[key]
+                self._total_bytes -= entry.size
+            self.misses += 1
+            return None
+
+    def set(self, note_id: str, updated_at: str, format: str, template_version: int,
+            content: bytes) -> Optional[CachedExport]:
+        """写入渲染结果，并删除同一笔记同一格式的旧版本"""
+        if not self.enabled:
+            return None
+
+        note_hash, key = self._keys(note_id, updated_at, format, template_version)
+        content_hash = hashlib.sha256(content).hexdigest()[:32]
+        path = os.path.join(self.cache_dir, f"{key}-{content_hash}.{format}")
+
+        with self._lock:
+            self._ensure_loaded()
+
+        # 先写临时文件再原子替换，读取方不会看到写了一半的文件
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入导出缓存失败 {path}: {e}")
+            if tmp_path:
+                self._remove_file(tmp_path)
+            return None
+
+        entry = CachedExport(note_hash, path, len(content), content_hash)
+        with self._lock:
+            # 同一笔记同一格式的旧版本（包括并发写入的同一版本）
+            stale = [k for k, e in self._entries.items()
+                     if e.note_hash == note_hash and e.path.endswith(f".{format}")]
+            for stale_key in stale:
+                old = self._entries.pop(stale_key)
+                self._total_bytes -= old.size
+                if old.path != path:
+                    self._remove_file(old.path)
+
+            self._entries[key] = entry
+            self._total_bytes += entry.size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        """超出总大小时淘汰最久未访问的文件（调用方持有锁）"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._total_bytes -= old.size
+            self._remove_file(old.path)
+            self.evictions += 1
+
+    def invalidate_note(self, note_id: str):
+        """笔记删除时清理其全部缓存文件"""
+        if not self.enabled:
+            return
+
+        note_hash = _short_hash(note_id)
+        with self._lock:
+            self._ensure_loaded()
+            for key in [k for k, e in self._entries.items() if e.note_hash == note_hash]:
+                old = self._entries.pop(key)
+                self._total_bytes -= old.size
+                self._remove_file(old.path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除导出缓存文件失败 {path}: {e}")
+
+    def get_stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'files': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# 全局实例
+export_cache = ExportCache(
+    cache_dir=settings.EXPORT_CACHE_DIR,
+    max_bytes=settings.EXPORT_CACHE_MAX_BYTES,
+    enabled=settings.EXPORT_CACHE_ENABLED
+)
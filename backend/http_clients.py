@@ -0,0 +1,218 @@
+"""
+上游HTTP客户端注册表
+为OpenRouter、Gemini等上游服务提供应用生命周期内共享的 httpx.AsyncClient，
+复用keep-alive连接（可用时启用HTTP/2），避免每次请求都重新握手TCP+TLS
+
+用法:
+    client = get_http_client("openrouter")
+    response = await client.post("/chat/completions", json=data, headers=headers)
+
+测试时可把上游替换为本地桩服务:
+    - 设置 OPENROUTER_BASE_URL / GEMINI_BASE_URL 指向本地HTTP服务
+    - 或调用 http_clients.use_transport("openrouter", httpx.MockTransport(handler))
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  HTTP/2 为可选依赖（httpx[http2]）
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class UpstreamMetrics:
+    """单个上游的请求统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.status_counts: Dict[str, int] = {}
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def start(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finish(self, elapsed: float, status_code: Optional[int] = None):
+        with self._lock:
+            self.in_flight -= 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if status_code is None:
+                self.errors += 1
+            else:
+                status_class = f"{status_code // 100}xx"
+                self.status_counts[status_class] = self.status_counts.get(status_class, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            completed = self.requests - self.in_flight
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'status': dict(self.status_counts),
+                # 从发出请求到收到响应头的耗时
+                'avg_time_ms': round(self.total_time / completed * 1000, 2) if completed else 0,
+                'max_time_ms': round(self.max_time * 1000, 2)
+            }
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """包装底层transport，记录请求数、状态码、错误和耗时"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, metrics: UpstreamMetrics):
+        self._transport = transport
+        self._metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._metrics.start()
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            self._metrics.finish(time.perf_counter() - started)
+            raise
+        self._metrics.finish(time.perf_counter() - started, response.status_code)
+        return response
+
+    def connection_count(self) -> Optional[int]:
+        """当前连接池中的连接数（底层transport不支持时返回None）"""
+        pool = getattr(self._transport, '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        return len(connections) if connections is not None else None
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+class HTTPClientRegistry:
+    """按上游名称管理共享的 httpx.AsyncClient"""
+
+    def __init__(self):
+        self._upstreams: Dict[str, dict] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, MeteredTransport] = {}
+        self._metrics: Dict[str, UpstreamMetrics] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, base_url: str = "", timeout: Optional[httpx.Timeout] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        """注册上游；transport用于测试时注入桩实现"""
+        self._upstreams[name] = {
+            'base_url': base_url,
+            'timeout': timeout or httpx.Timeout(30.0, connect=10.0),
+            'transport': transport
+        }
+        self._metrics.setdefault(name, UpstreamMetrics())
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        upstream = self._upstreams[name]
+
+        transport = upstream['transport']
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(
+                http2=settings.HTTP2_ENABLED and HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+                ),
+                retries=1  # 仅重试连接建立失败，不会重复发送请求
+            )
+
+        metered = MeteredTransport(transport, self._metrics[name])
+        self._transports[name] = metered
+
+        return httpx.AsyncClient(
+            base_url=upstream['base_url'],
+            timeout=upstream['timeout'],
+            transport=metered
+        )
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """获取上游的共享客户端，未启动时按需创建"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None or client.is_closed:
+                    client = self._create_client(name)
+                    self._clients[name] = client
+        return client
+
+    async def startup(self):
+        """创建所有已注册上游的客户端（应用启动时调用）"""
+        for name in self._upstreams:
+            self.get(name)
+
+        if settings.HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            logger.warning("未安装h2，上游HTTP客户端使用HTTP/1.1（pip install 'httpx[http2]'）")
+
+    async def shutdown(self):
+        """关闭所有客户端并释放连接（应用关闭时调用）"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._transports.clear()
+
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭HTTP客户端失败: {e}")
+
+    async def use_transport(self, name: str, transport: Optional[httpx.AsyncBaseTransport]):
+        """替换上游的transport（测试中注入桩服务，传None恢复真实网络）"""
+        upstream = self._upstreams[name]
+        upstream['transport'] = transport
+
+        with self._lock:
+            client = self._clients.pop(name, None)
+            self._transports.pop(name, None)
+        if client is not None:
+            await client.aclose()
+
+    def get_stats(self) -> dict:
+        """各上游的连接和请求统计"""
+        stats = {}
+        for name, metrics in self._metrics.items():
+            upstream_stats = metrics.snapshot()
+            transport = self._transports.get(name)
+            upstream_stats['connections'] = transport.connection_count() if transport else 0
+            upstream_stats['http2'] = settings.HTTP2_ENABLED and HTTP2_AVAILABLE
+            stats[name] = upstream_stats
+        return stats
+
+# 全局注册表
+http_clients = HTTPClientRegistry()
+
+http_clients.register(
+    "openrouter",
+    base_url=settings.OPENROUTER_BASE_URL,
+    # 读超时针对流式响应相邻两个数据块之间的间隔
+    timeout=httpx.Timeout(60.0, connect=10.0)
+)
+http_clients.register(
+    "gemini",
+    base_url=settings.GEMINI_BASE_URL,
+    # 图像生成耗时较长；图像编辑在调用处单独放宽
+    timeout=httpx.Timeout(60.0, connect=10.0)
+)
+# 下载用户提供的图片等任意URL
+http_clients.register("default", timeout=httpx.Timeout(30.0, connect=10.0))
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    """获取共享的上游HTTP客户端"""
+    return http_clients.get(name)
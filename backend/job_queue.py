@@ -0,0 +1,516 @@
+"""
+后台任务队列
+批量导出、批量自动分类、图像生成等耗时操作不在请求中执行：接口入队后立即返回任务ID，由后台worker执行，
+客户端通过 /jobs 接口轮询进度并获取结果，不再受反向代理超时限制，也不占用请求worker
+- 任务持久化在独立的SQLite文件中，无需外部消息中间件
+- 运行中的任务定期写入心跳；进程退出后心跳超时的任务重新排队（多个进程可共享同一个任务文件）
+- 优先级高的先执行，同一优先级先进先出
+- 每个用户同时运行的任务数和排队的任务数都有上限，避免单个用户占满全部worker
+- 失败后按指数退避重试；4xx类错误（参数、密钥问题）和 JobError 不重试
+- 结果为JSON或文件，完成后保留 JOB_RESULT_TTL 秒
+
+任务处理函数通过 job_queue.register(kind, handler) 注册，签名为 async handler(ctx: JobContext) -> Optional[dict]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from database_async import AsyncRepository
+from database_optimized import DatabaseConnectionPool
+from pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# 任务优先级：用户正在等待结果的任务优先，整个账户的批量任务最后
+PRIORITY_INTERACTIVE = 10
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 0
+
+class JobError(Exception):
+    """任务失败且不应重试（如参数错误、数据不存在）"""
+
+class JobLimitExceeded(Exception):
+    """用户排队中的任务过多"""
+
+class JobStore:
+    """任务表的读写（同步，由 async_job_store 放到线程池执行）"""
+
+    def __init__(self, database_path: str):
+        self._pool = DatabaseConnectionPool(max_connections=4, database_path=database_path, min_idle=1)
+        self._init_table()
+
+    def _init_table(self):
+        with self._pool.get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    payload TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    run_after REAL NOT NULL,
+                    error TEXT,
+                    result TEXT,
+                    result_file TEXT,
+                    result_filename TEXT,
+                    result_media_type TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            # 领取任务：按状态过滤后按优先级、入队时间排序
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_status_priority
+                ON jobs(status, priority DESC, created_at, id)
+            ''')
+            # 用户任务列表（游标分页）和每用户计数
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_user_created
+                ON jobs(user_id, created_at DESC, id DESC)
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs(user_id, status)')
+            # 清理过期结果
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)')
+
+    def enqueue(self, user_id: str, kind: str, payload: dict, priority: int, max_attempts: int,
+                total: Optional[int], max_pending: int) -> dict:
+        """写入一个排队中的任务；用户排队和运行中的任务数达到上限时抛出 JobLimitExceeded"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+
+        with self._pool.get_connection() as conn:
+            pending = conn.execute('''
+                SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')
+            ''', (user_id,)).fetchone()[0]
+            if pending >= max_pending:
+                raise JobLimitExceeded(f"排队中的后台任务过多（最多 {max_pending} 个），请稍后再试")
+
+            conn.execute('''
+                INSERT INTO jobs (id, user_id, kind, status, priority, payload, total,
+                                  max_attempts, run_after, created_at)
+                VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)
+            ''', (job_id, user_id, kind, priority, json.dumps(payload, ensure_ascii=False),
+                  total, max_attempts, now, now))
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+        return dict(row)
+
+    def claim(self, kinds: List[str], per_user_limit: int) -> Optional[dict]:
+        """
+        领取下一个可执行的任务并标记为运行中
+        跳过尚未到重试时间的任务和运行中任务数已达上限的用户；单条UPDATE完成，多个worker并发领取不会重复
+        """
+        if not kinds:
+            return None
+
+        now = time.time()
+        placeholders = ','.join('?' * len(kinds))
+        with self._pool.get_connection() as conn:
+            row = conn.execute(f'''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, heartbeat_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' AND run_after <= ? AND kind IN ({placeholders})
+                      AND user_id NOT IN (
+                          SELECT user_id FROM jobs WHERE status = 'running'
+                          GROUP BY user_id HAVING COUNT(*) >= ?
+                      )
+                    ORDER BY priority DESC, created_at, id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', (now, now, now, *kinds, per_user_limit)).fetchone()
+
+        return dict(row) if row else None
+
+    def update_progress(self, job_id: str, progress: int, total: Optional[int] = None):
+        """更新任务进度"""
+        with self._pool.get_connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET progress = ?, total = COALESCE(?, total)
+                WHERE id = ? AND status = 'running'
+            ''', (progress, total, job_id))
+
+    def complete(self, job_id: str, result: Optional[Any], result_file: Optional[str],
+                 result_filename: Optional[str], result_media_type: Optional[str]) -> bool:
+        """标记任务成功；任务已被取消时返回False"""
+        with self._pool.get_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = 'succeeded', result = ?, result_file = ?, result_filename = ?,
+                                result_media_type = ?, error = NULL, finished_at = ?
+                WHERE id = ? AND status = 'running'
+            ''', (json.dumps(result, ensure_ascii=False) if result is not None else None,
+                  result_file, result_filename, result_media_type, time.time(), job_id))
+            return cursor.rowcount > 0
+
+    def retry(self, job_id: str, error: str, run_after: float):
+        """任务失败后重新排队，run_after之前不会被领取"""
+        with self._pool.get_connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'queued', error = ?, run_after = ?, progress = 0
+                WHERE id = ? AND status = 'running'
+            ''', (error, run_after, job_id))
+
+    def fail(self, job_id: str, error: str):
+        """标记任务最终失败"""
+        with self._pool.get_connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+                WHERE id = ? AND status = 'running'
+            ''', (error, time.time(), job_id))
+
+    def release(self, job_id: str):
+        """应用关闭时中断的任务放回队列，不计入重试次数"""
+        with self._pool.get_connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), progress = 0
+                WHERE id = ? AND status = 'running'
+            ''', (job_id,))
+
+    def heartbeat(self, job_ids: List[str]):
+        """刷新运行中任务的心跳"""
+        if not job_ids:
+            return
+        placeholders = ','.join('?' * len(job_ids))
+        with self._pool.get_connection() as conn:
+            conn.execute(f'''
+                UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND id IN ({placeholders})
+            ''', (time.time(), *job_ids))
+
+    def requeue_stale(self, before: float) -> Tuple[int, int]:
+        """
+        心跳早于before的运行中任务（所在进程已退出）放回队列，返回 (重新排队数, 失败数)
+        已用完重试次数的直接标记失败：导致进程退出的任务（如导出时内存不足）不会在每次重启后被反复领取
+        """
+        with self._pool.get_connection() as conn:
+            failed = conn.execute('''
+                UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+                WHERE status = 'running' AND heartbeat_at < ? AND attempts >= max_attempts
+            ''', ("任务执行期间进程异常退出，已达到最大重试次数", time.time(), before)).rowcount
+            requeued = conn.execute('''
+                UPDATE jobs SET status = 'queued', progress = 0
+                WHERE status = 'running' AND heartbeat_at < ?
+            ''', (before,)).rowcount
+        return requeued, failed
+
+    def cancel(self, job_id: str, user_id: str) -> Optional[dict]:
+        """取消排队中或运行中的任务，返回取消前的任务；任务不存在或已结束时返回None"""
+        with self._pool.get_connection() as conn:
+            row = conn.execute('''
+                SELECT * FROM jobs WHERE id = ? AND user_id = ? AND status IN ('queued', 'running')
+            ''', (job_id, user_id)).fetchone()
+            if not row:
+                return None
+
+            conn.execute('''
+                UPDATE jobs SET status = 'cancelled', error = '任务已取消', finished_at = ?
+                WHERE id = ?
+            ''', (time.time(), job_id))
+
+        return dict(row)
+
+    def get_job(self, job_id: str, user_id: str) -> Optional[dict]:
+        """获取用户的任务"""
+        with self._pool.get_connection() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ? AND user_id = ?', (job_id, user_id)).fetchone()
+        return dict(row) if row else None
+
+    def get_jobs_page(self, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """分页获取用户的任务（按 created_at, id 倒序的游标分页）"""
+        position = decode_cursor(cursor)
+
+        query = 'SELECT * FROM jobs WHERE user_id = ?'
+        params: list = [user_id]
+        if position:
+            query += ' AND (created_at, id) < (?, ?)'
+            params.extend([float(position[0]), position[1]])
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._pool.get_connection() as conn:
+            rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(repr(rows[-1]['created_at']), rows[-1]['id'])
+        return rows, next_cursor
+
+    def purge_finished(self, before: float) -> List[str]:
+        """删除在before之前结束的任务，返回需要删除的结果文件"""
+        with self._pool.get_connection() as conn:
+            rows = conn.execute('''
+                DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?
+                RETURNING result_file
+            ''', (before,)).fetchall()
+        return [row['result_file'] for row in rows if row['result_file']]
+
+    def count_by_status(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._pool.get_connection() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+class JobContext:
+    """传给任务处理函数的上下文：任务参数、进度上报和结果文件"""
+
+    # 进度写入数据库的最小间隔（秒），处理完成时总会写入
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, job: dict, result_dir: str):
+        self.job_id = job['id']
+        self.user_id = job['user_id']
+        self.kind = job['kind']
+        self.payload = json.loads(job['payload'])
+        self.attempt = job['attempts']
+        self.total = job['total']
+        self.result_file: Optional[str] = None
+        self.result_filename: Optional[str] = None
+        self.result_media_type: Optional[str] = None
+        self._result_dir = result_dir
+        self._last_report = 0.0
+
+    async def report(self, progress: int, total: Optional[int] = None):
+        """上报进度（按时间间隔节流）"""
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if now - self._last_report < self.PROGRESS_INTERVAL and progress != self.total:
+            return
+        self._last_report = now
+        await async_job_store.update_progress(self.job_id, progress, total)
+
+    def create_result_file(self, filename: str, media_type: str) -> str:
+        """分配结果文件路径，下载时使用filename作为文件名"""
+        os.makedirs(self._result_dir, exist_ok=True)
+        extension = os.path.splitext(filename)[1]
+        self.result_file = os.path.join(self._result_dir, f"{self.job_id}{extension}")
+        self.result_filename = filename
+        self.result_media_type = media_type
+        return self.result_file
+
+JobHandler = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+def _is_retryable(error: Exception) -> bool:
+    """JobError和4xx的HTTPException属于请求本身的问题，重试没有意义"""
+    if isinstance(error, JobError):
+        return False
+    status_code = getattr(error, 'status_code', None)
+    return not (isinstance(status_code, int) and status_code < 500)
+
+def _error_message(error: Exception) -> str:
+    return str(getattr(error, 'detail', None) or error) or error.__class__.__name__
+
+def _remove_file(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除任务结果文件失败 {path}: {e}")
+
+def public_job(job: dict) -> dict:
+    """对外返回的任务信息（不含参数和服务器文件路径）"""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'priority': job['priority'],
+        'progress': job['progress'],
+        'total': job['total'],
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'error': job['error'],
+        'result': json.loads(job['result']) if job['result'] else None,
+        'has_file': bool(job['result_file']),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+
+class JobQueue:
+    """在事件循环中运行的worker，从任务表领取并执行任务"""
+
+    # 心跳间隔（秒），超过4个间隔没有心跳的任务视为中断；同时按该间隔清理过期结果
+    HEARTBEAT_INTERVAL = 15
+
+    def __init__(self, workers: int, per_user_limit: int, max_pending_per_user: int,
+                 max_attempts: int, retry_base_delay: float, result_dir: str, result_ttl: float,
+                 poll_interval: float = 1.0):
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.max_pending_per_user = max_pending_per_user
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.result_dir = result_dir
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, Tuple[JobHandler, int]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}  # job_id -> 执行处理函数的任务
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._stats = {'succeeded': 0, 'failed': 0, 'retried': 0, 'cancelled': 0}
+
+    def register(self, kind: str, handler: JobHandler, max_attempts: Optional[int] = None):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = (handler, max_attempts or self.max_attempts)
+
+    async def enqueue(self, user_id: str, kind: str, payload: dict, priority: int = PRIORITY_NORMAL,
+                      total: Optional[int] = None) -> dict:
+        """提交任务，返回对外的任务信息"""
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+
+        _, max_attempts = self._handlers[kind]
+        job = await async_job_store.enqueue(
+            user_id, kind, payload, priority, max_attempts, total, self.max_pending_per_user
+        )
+        self._notify()
+        return public_job(job)
+
+    async def cancel(self, job_id: str, user_id: str) -> Optional[dict]:
+        """取消任务；运行中的任务会被中断"""
+        job = await async_job_store.cancel(job_id, user_id)
+        if not job:
+            return None
+
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        self._stats['cancelled'] += 1
+        return public_job(await async_job_store.get_job(job_id, user_id))
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """启动worker（应用启动时调用）"""
+        if self._tasks:
+            return
+
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance_loop()))
+
+    async def stop(self):
+        """停止worker，运行中的任务放回队列（应用关闭时调用）"""
+        self._stopping = True
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._stopping = False
+
+    async def _worker(self):
+        while True:
+            job = await async_job_store.claim(list(self._handlers), self.per_user_limit)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            await self._execute(job)
+            # 该用户空出了一个运行名额，唤醒其他worker
+            self._notify()
+
+    async def _execute(self, job: dict):
+        handler, _ = self._handlers[job['kind']]
+        ctx = JobContext(job, self.result_dir)
+        job_id = job['id']
+
+        # 处理函数在单独的任务中运行，用户取消时只中断该任务，worker继续处理下一个
+        handler_task = asyncio.ensure_future(handler(ctx))
+        self._running[job_id] = handler_task
+
+        try:
+            result = await handler_task
+            if await async_job_store.complete(job_id, result, ctx.result_file,
+                                              ctx.result_filename, ctx.result_media_type):
+                self._stats['succeeded'] += 1
+            else:
+                _remove_file(ctx.result_file)
+        except asyncio.CancelledError:
+            _remove_file(ctx.result_file)
+            if self._stopping:
+                # 应用关闭：放回队列，下次启动后继续执行
+                job_store.release(job_id)
+                raise
+            # 用户取消：状态已在数据库中更新，worker继续处理下一个任务
+        except Exception as e:
+            _remove_file(ctx.result_file)
+            message = _error_message(e)
+            if _is_retryable(e) and job['attempts'] < job['max_attempts']:
+                delay = min(self.retry_base_delay * 2 ** (job['attempts'] - 1), 300)
+                logger.warning(f"后台任务失败，{delay:.0f}秒后重试 {job['kind']} {job_id}: {message}")
+                await async_job_store.retry(job_id, message, time.time() + delay)
+                self._stats['retried'] += 1
+            else:
+                logger.error(f"后台任务失败 {job['kind']} {job_id}: {message}")
+                await async_job_store.fail(job_id, message)
+                self._stats['failed'] += 1
+        finally:
+            self._running.pop(job_id, None)
+
+    async def _maintenance_loop(self):
+        """定期刷新心跳、回收中断的任务并清理过期结果"""
+        while True:
+            try:
+                await async_job_store.heartbeat(list(self._running))
+                requeued, failed = await async_job_store.requeue_stale(time.time() - 4 * self.HEARTBEAT_INTERVAL)
+                if failed:
+                    self._stats['failed'] += failed
+                    logger.warning(f"{failed} 个中断的后台任务已达到最大重试次数，标记为失败")
+                if requeued:
+                    logger.info(f"重新排队 {requeued} 个中断的后台任务")
+                    self._notify()
+                await self.purge_expired()
+            except Exception as e:
+                logger.error(f"后台任务维护失败: {e}")
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+
+    async def purge_expired(self):
+        """删除超过保留时间的已结束任务及其结果文件"""
+        for path in await async_job_store.purge_finished(time.time() - self.result_ttl):
+            _remove_file(path)
+
+    def get_stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'running': len(self._running),
+            'kinds': sorted(self._handlers),
+            **self._stats
+        }
+
+# 全局实例
+job_store = JobStore(settings.JOB_QUEUE_PATH)
+async_job_store = AsyncRepository(job_store)
+
+job_queue = JobQueue(
+    workers=settings.JOB_QUEUE_WORKERS,
+    per_user_limit=settings.JOB_MAX_RUNNING_PER_USER,
+    max_pending_per_user=settings.JOB_MAX_PENDING_PER_USER,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_base_delay=settings.JOB_RETRY_BASE_DELAY,
+    result_dir=settings.JOB_RESULT_DIR,
+    result_ttl=settings.JOB_RESULT_TTL
+)
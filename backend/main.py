@@ -1,8 +1,17 @@
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth_router, notes_router, ai_router, user_router, todos_router, folders_router, chat_router, versions_router, projects_router, admin_router, tags_router, share_router, export_router, rbac_router, nano_banana_router
-from database import init_database
-from middleware import RBACMiddleware, PerformanceMiddleware
+from routers import auth_router, notes_router, ai_router, user_router, todos_router, folders_router, chat_router, versions_router, projects_router, admin_router, tags_router, share_router, export_router, rbac_router, nano_banana_router, jobs_router
+from database import init_database, run_in_db_executor, shutdown_db_executor
+from share_cache import view_count_buffer
+from http_clients import http_clients
+from job_queue import job_queue
+from pdf_render import shutdown_pdf_pool
+from password_hashing import shutdown_password_executor
+from middleware import RBACMiddleware, PerformanceMiddleware, rbac_checker, rbac_expiry_sweeper
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="AI Notebook API",
@@ -37,6 +46,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Synced-At", "X-Cache"],  # 分页游标、分享页条件请求、看板增量刷新
 )
 
 # 注册路由
@@ -55,6 +65,50 @@ app.include_router(share_router.router)  # 分享和评论路由
 app.include_router(export_router.router)  # 导出功能路由
 app.include_router(rbac_router.router)  # RBAC权限管理路由
 app.include_router(nano_banana_router.router)  # Nano Banana图像生成路由
+app.include_router(jobs_router.router)  # 后台任务进度和结果路由
+
+@app.on_event("startup")
+async def startup_event():
+    # 创建上游HTTP客户端（OpenRouter、Gemini共享连接池）
+    await http_clients.startup()
+
+    # 启动分享查看次数的批量写入任务
+    view_count_buffer.start()
+
+    # 启动后台任务worker（各路由已在导入时注册任务处理函数）
+    job_queue.start()
+
+    # 加载RBAC权限目录（权限名编译为位序号）；失败时不影响启动，第一次权限检查时会重试
+    try:
+        await run_in_db_executor(rbac_checker.load_catalog)
+    except Exception as e:
+        logger.error(f"加载RBAC权限目录失败: {e}")
+
+    # 启动过期角色/授权的定期清理任务
+    rbac_expiry_sweeper.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 停止后台任务worker，运行中的任务放回队列（需在关闭HTTP客户端和进程池之前）
+    await job_queue.stop()
+
+    # 写入剩余的分享查看次数（需在关闭数据库线程池之前）
+    await view_count_buffer.stop()
+
+    # 停止过期授权清理任务（需在关闭数据库线程池之前）
+    await rbac_expiry_sweeper.stop()
+
+    # 关闭上游HTTP客户端，释放keep-alive连接
+    await http_clients.shutdown()
+
+    # 关闭PDF渲染进程池
+    shutdown_pdf_pool(wait=False)
+
+    # 关闭密码哈希线程池
+    shutdown_password_executor(wait=False)
+
+    # 关闭数据库线程池
+    shutdown_db_executor(wait=False)
 
 @app.get("/")
 async def root():
@@ -2,13 +2,16 @@ import time
 import logging
 import hashlib
 import json
-from typing import Callable, Optional, List, Set
+from typing import Any, Callable, Dict, Optional, List, Set, Tuple, Union
 from fastapi import Request, Response, HTTPException, status
 from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
-from datetime import datetime
 import asyncio
+import threading
+from config import settings
+from database_async import run_in_db_executor
+from rbac_time import grant_time_now, parse_grant_expiry
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -304,135 +307,282 @@ class CompressionMiddleware(BaseHTTPMiddleware):
 
 # ===== RBAC权限系统 =====
 
-class RBACChecker:
-    """RBAC权限检查器"""
-
-    def __init__(self):
-        self._cache = {}  # 缓存用户权限
-        self._cache_ttl = 300  # 缓存5分钟
-
-    def _get_cache_key(self, user_id: str) -> str:
-        """生成缓存键"""
-        return f"rbac:user:{user_id}"
+class PermissionCatalog:
+    """权限目录：把全部权限名按名称排序后编号，用户的权限集合和权限要求都表示为位掩码"""
+
+    __slots__ = ('version', 'names', 'ids')
+
+    def __init__(self, version: int, names: List[str]):
+        self.version = version  # 加载时的RBAC版本号
+        self.names = tuple(sorted(set(names)))
+        self.ids = {name: bit for bit, name in enumerate(self.names)}
+
+    def mask_of(self, names) -> Tuple[int, bool]:
+        """权限名集合对应的位掩码，返回 (掩码, 是否包含目录中不存在的权限)"""
+        mask = 0
+        unknown = False
+        for name in names:
+            bit = self.ids.get(name)
+            if bit is None:
+                unknown = True
+            else:
+                mask |= 1 << bit
+        return mask, unknown
+
+class PermissionRequirement:
+    """
+    预先声明的权限要求（如 require_permission 的参数）
+    首次检查时按当前权限目录编译为位掩码，目录变化后重新编译
+    """
+
+    __slots__ = ('names', '_compiled')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._compiled = (None, 0, False)
+
+    def compile(self, catalog: PermissionCatalog) -> Tuple[int, bool]:
+        """返回 (掩码, 是否包含目录中不存在的权限)"""
+        compiled = self._compiled
+        if compiled[0] is not catalog:
+            # 整体替换元组，并发检查时不会读到一半的结果
+            compiled = self._compiled = (catalog, *catalog.mask_of(self.names))
+        return compiled[1], compiled[2]
+
+class RBACEntry:
+    """一个用户的角色、权限和最高角色级别（创建后不再修改）"""
+
+    __slots__ = ('version', 'catalog', 'roles', 'role_names', 'permissions', 'mask', 'max_level', 'valid_until')
+
+    def __init__(self, catalog: PermissionCatalog, roles: List[dict], permissions: Set[str], ttl: float):
+        self.version = catalog.version  # 加载时的RBAC版本号
+        self.catalog = catalog
+        self.roles = tuple(roles)
+        self.role_names = frozenset(role['name'] for role in roles)
+        self.permissions = frozenset(permissions)
+        self.mask, _ = catalog.mask_of(permissions)  # 角色权限与直接授予的权限合并
+        self.max_level = max((role['level'] for role in roles), default=0)
+        self.valid_until = time.monotonic() + ttl  # 缓存TTL与最早的授权过期时间中较早者
 
-    def _is_cache_valid(self, cache_key: str) -> bool:
-        """检查缓存是否有效"""
-        if cache_key not in self._cache:
-            return False
-
-        cached_time = self._cache[cache_key].get('timestamp', 0)
-        return time.time() - cached_time < self._cache_ttl
+class RBACChecker:
+    """
+    RBAC权限检查器
+    按用户缓存角色、权限和最高角色级别：
+    - 任何角色/权限变更都会使数据库中的全局版本号加1（触发器维护），
+      每隔 RBAC_VERSION_CHECK_INTERVAL 秒读取一次版本号，变化时整体丢弃缓存，多worker间也能及时生效
+    - 读取不加锁：缓存条目不可变，版本变化时替换整个字典；只有写入和淘汰时加锁
+    - 条目数超过上限时按写入顺序淘汰
+    - 权限检查是位运算：版本号变化时同时重新加载权限目录，用户权限在加载时编译为位掩码
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300, version_check_interval: float = 1.0):
+        self._cache: Dict[str, RBACEntry] = {}
+        self._cache_ttl = ttl
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self._catalog = PermissionCatalog(-1, [])
+        self._version_checked_at = 0.0
+        self._write_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version_changes = 0
+
+    def _current_catalog(self, now: float) -> PermissionCatalog:
+        """当前版本的权限目录（最多每隔version_check_interval秒读一次版本号）"""
+        if now - self._version_checked_at < self.version_check_interval:
+            return self._catalog
+
+        from database import get_rbac_version
+
+        version = get_rbac_version()
+        self._version_checked_at = now
+        if version != self._catalog.version:
+            from database import get_permission_names
+
+            catalog = PermissionCatalog(version, get_permission_names())
+            with self._write_lock:
+                if version != self._catalog.version:
+                    if self._catalog.version != -1:
+                        self.version_changes += 1
+                    self._catalog = catalog
+                    self._cache = {}
+        return self._catalog
+
+    def load_catalog(self):
+        """加载权限目录（应用启动时调用，避免第一个请求承担加载开销）"""
+        self._version_checked_at = 0.0
+        self._current_catalog(time.monotonic())
 
     def clear_user_cache(self, user_id: str):
-        """清除用户权限缓存"""
-        cache_key = self._get_cache_key(user_id)
-        if cache_key in self._cache:
-            del self._cache[cache_key]
-
-    def get_user_permissions(self, user_id: str) -> Set[str]:
         """
-        获取用户的所有权限
-        包括通过角色获得的权限和直接授予的权限
+        清除用户权限缓存
+        本进程修改RBAC数据后调用：下次检查时立即重新读取版本号，其他用户受影响的缓存也会失效
         """
-        from database import get_connection
+        with self._write_lock:
+            self._cache.pop(user_id, None)
+        self._version_checked_at = 0.0
 
-        cache_key = self._get_cache_key(user_id)
+    def invalidate_all(self):
+        """丢弃全部缓存（下次检查时重新读取版本号）"""
+        with self._write_lock:
+            self._cache = {}
+        self._version_checked_at = 0.0
 
-        # 检查缓存
-        if self._is_cache_valid(cache_key):
-            return self._cache[cache_key]['permissions']
+    def _load(self, user_id: str, catalog: PermissionCatalog) -> RBACEntry:
+        """
+        从数据库加载用户的角色和权限（包括通过角色获得的权限和直接授予的权限）
+        查询只按user_id走主键，过期判断在内存中进行，同时记录最早的未来过期时间
+        """
+        from database import get_connection
 
         conn = get_connection()
         cursor = conn.cursor()
 
-        permissions = set()
-
         try:
-            # 1. 获取用户通过角色获得的权限
             cursor.execute('''
-                SELECT DISTINCT p.name
+                SELECT r.id, r.name, r.display_name, r.level, ur.assigned_at, ur.expires_at
+                FROM user_roles ur
+                JOIN roles r ON ur.role_id = r.id
+                WHERE ur.user_id = ?
+            ''', (user_id,))
+            role_rows = [dict(row) for row in cursor.fetchall()]
+
+            cursor.execute('''
+                SELECT rp.role_id, p.name
                 FROM user_roles ur
                 JOIN role_permissions rp ON ur.role_id = rp.role_id
                 JOIN permissions p ON rp.permission_id = p.id
                 WHERE ur.user_id = ?
-                AND (ur.expires_at IS NULL OR ur.expires_at > ?)
-            ''', (user_id, datetime.utcnow().isoformat() + 'Z'))
+            ''', (user_id,))
+            role_permission_rows = cursor.fetchall()
 
-            for row in cursor.fetchall():
-                permissions.add(row['name'])
-
-            # 2. 获取用户直接被授予的权限
             cursor.execute('''
-                SELECT p.name
+                SELECT p.name, up.expires_at
                 FROM user_permissions up
                 JOIN permissions p ON up.permission_id = p.id
                 WHERE up.user_id = ?
-                AND (up.expires_at IS NULL OR up.expires_at > ?)
-            ''', (user_id, datetime.utcnow().isoformat() + 'Z'))
-
-            for row in cursor.fetchall():
-                permissions.add(row['name'])
-
-            # 缓存结果
-            self._cache[cache_key] = {
-                'permissions': permissions,
-                'timestamp': time.time()
-            }
+            ''', (user_id,))
+            direct_rows = cursor.fetchall()
 
         finally:
             conn.close()
 
-        return permissions
-
-    def get_user_roles(self, user_id: str) -> List[dict]:
-        """获取用户的所有角色"""
-        from database import get_connection
+        now = time.time()
+        next_expiry = None
+
+        def active(expires_at: Optional[str]) -> bool:
+            nonlocal next_expiry
+            expiry = parse_grant_expiry(expires_at)
+            if expiry is None:
+                return True
+            if expiry <= now:
+                return False
+            next_expiry = expiry if next_expiry is None else min(next_expiry, expiry)
+            return True
 
-        conn = get_connection()
-        cursor = conn.cursor()
+        # 1. 未过期的角色（按级别从高到低）
+        roles = sorted((row for row in role_rows if active(row['expires_at'])),
+                       key=lambda row: row['level'], reverse=True)
+        role_ids = {role['id'] for role in roles}
+
+        # 2. 通过角色获得的权限
+        permissions = {row['name'] for row in role_permission_rows if row['role_id'] in role_ids}
+
+        # 3. 直接被授予的权限
+        permissions.update(row['name'] for row in direct_rows if active(row['expires_at']))
+
+        ttl = self._cache_ttl
+        if next_expiry is not None:
+            # 最早的授权到期时条目同时失效
+            ttl = min(ttl, next_expiry - now)
+        return RBACEntry(catalog, roles, permissions, ttl)
+
+    def _get_entry(self, user_id: str) -> RBACEntry:
+        """获取用户的缓存条目，不存在或已过期时重新加载"""
+        now = time.monotonic()
+        catalog = self._current_catalog(now)
+
+        entry = self._cache.get(user_id)
+        if entry is not None and entry.catalog is catalog and now < entry.valid_until:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = self._load(user_id, catalog)
+
+        with self._write_lock:
+            # 加载期间版本号发生变化时不写入，避免缓存旧数据
+            if entry.catalog is self._catalog:
+                cache = self._cache
+                cache.pop(user_id, None)
+                cache[user_id] = entry
+                while len(cache) > self.max_size:
+                    cache.pop(next(iter(cache)))
+                    self.evictions += 1
+
+        return entry
+
+    def is_fresh(self, user_id: str) -> bool:
+        """缓存命中且还不需要读取版本号：此时的检查只是内存操作，不会访问数据库"""
+        now = time.monotonic()
+        if now - self._version_checked_at >= self.version_check_interval:
+            return False
+        entry = self._cache.get(user_id)
+        return entry is not None and entry.catalog is self._catalog and now < entry.valid_until
 
-        try:
-            cursor.execute('''
-                SELECT r.id, r.name, r.display_name, r.level, ur.assigned_at, ur.expires_at
-                FROM user_roles ur
-                JOIN roles r ON ur.role_id = r.id
-                WHERE ur.user_id = ?
-                AND (ur.expires_at IS NULL OR ur.expires_at > ?)
-                ORDER BY r.level DESC
-            ''', (user_id, datetime.utcnow().isoformat() + 'Z'))
+    async def run(self, check: Callable[..., Any], user_id: str, *args) -> Any:
+        """
+        在异步代码中执行检查，如 await rbac_checker.run(rbac_checker.has_role, user_id, "admin")
+        缓存命中时直接在事件循环中执行，需要读取版本号或加载用户权限时放到数据库线程池中执行
+        """
+        if self.is_fresh(user_id):
+            return check(user_id, *args)
+        return await run_in_db_executor(check, user_id, *args)
 
-            roles = [dict(row) for row in cursor.fetchall()]
-            return roles
+    def get_user_permissions(self, user_id: str) -> Set[str]:
+        """
+        获取用户的所有权限
+        包括通过角色获得的权限和直接授予的权限
+        """
+        return self._get_entry(user_id).permissions
 
-        finally:
-            conn.close()
+    def get_user_roles(self, user_id: str) -> List[dict]:
+        """获取用户的所有角色（按级别从高到低）"""
+        return [dict(role) for role in self._get_entry(user_id).roles]
 
     def has_permission(self, user_id: str, permission: str) -> bool:
         """检查用户是否拥有指定权限"""
-        permissions = self.get_user_permissions(user_id)
-        return permission in permissions
-
-    def has_any_permission(self, user_id: str, permissions: List[str]) -> bool:
-        """检查用户是否拥有任一权限"""
-        user_permissions = self.get_user_permissions(user_id)
-        return any(perm in user_permissions for perm in permissions)
-
-    def has_all_permissions(self, user_id: str, permissions: List[str]) -> bool:
-        """检查用户是否拥有所有权限"""
-        user_permissions = self.get_user_permissions(user_id)
-        return all(perm in user_permissions for perm in permissions)
+        entry = self._get_entry(user_id)
+        bit = entry.catalog.ids.get(permission)
+        return bit is not None and (entry.mask >> bit) & 1 == 1
+
+    def has_any_permission(self, user_id: str,
+                           permissions: Union[List[str], PermissionRequirement]) -> bool:
+        """检查用户是否拥有任一权限（可传入预先声明的PermissionRequirement）"""
+        entry = self._get_entry(user_id)
+        if not isinstance(permissions, PermissionRequirement):
+            permissions = PermissionRequirement(permissions)
+        mask, _ = permissions.compile(entry.catalog)
+        return entry.mask & mask != 0
+
+    def has_all_permissions(self, user_id: str,
+                            permissions: Union[List[str], PermissionRequirement]) -> bool:
+        """检查用户是否拥有所有权限（可传入预先声明的PermissionRequirement）"""
+        entry = self._get_entry(user_id)
+        if not isinstance(permissions, PermissionRequirement):
+            permissions = PermissionRequirement(permissions)
+        mask, unknown = permissions.compile(entry.catalog)
+        # 目录中不存在的权限任何人都不可能拥有
+        return not unknown and entry.mask & mask == mask
 
     def has_role(self, user_id: str, role_name: str) -> bool:
         """检查用户是否拥有指定角色"""
-        roles = self.get_user_roles(user_id)
-        return any(role['name'] == role_name for role in roles)
+        return role_name in self._get_entry(user_id).role_names
 
     def get_highest_role_level(self, user_id: str) -> int:
         """获取用户最高角色级别"""
-        roles = self.get_user_roles(user_id)
-        if not roles:
-            return 0
-        return max(role['level'] for role in roles)
+        return self._get_entry(user_id).max_level
 
     def can_access_resource(self, user_id: str, resource_owner_id: str,
                           required_permission: str) -> bool:
@@ -446,8 +596,95 @@ class RBACChecker:
 
         return self.has_permission(user_id, required_permission)
 
+    def get_stats(self) -> dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'max_size': self.max_size,
+            'version': self._catalog.version,
+            'permissions': len(self._catalog.names),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions,
+            'version_changes': self.version_changes
+        }
+
 # 全局RBAC检查器实例
-rbac_checker = RBACChecker()
+rbac_checker = RBACChecker(
+    max_size=settings.RBAC_CACHE_SIZE,
+    ttl=settings.RBAC_CACHE_TTL,
+    version_check_interval=settings.RBAC_VERSION_CHECK_INTERVAL
+)
+
+class RBACExpirySweeper:
+    """
+    过期授权清理
+    缓存条目已在最早的授权到期时失效，过期行不会再生效；这里由后台任务定期分批删除它们，
+    避免 user_roles / user_permissions 无限增长（删除会触发RBAC版本号变化，只在确实删除了行时发生）
+    """
+
+    def __init__(self, interval: float = 300, batch_size: int = 500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.removed = 0
+        self.errors = 0
+
+    async def sweep(self) -> int:
+        """删除当前已过期的授权，返回删除的行数"""
+        from database import purge_expired_rbac_grants, run_in_db_executor
+
+        now = grant_time_now()
+        try:
+            removed = await run_in_db_executor(purge_expired_rbac_grants, now, self.batch_size)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"清理过期RBAC授权失败，将在下次重试: {e}")
+            return 0
+
+        self.runs += 1
+        self.removed += removed
+        if removed:
+            logger.info(f"已清理 {removed} 条过期RBAC授权")
+        return removed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+    def start(self):
+        """启动后台清理任务（应用启动时调用）"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台清理任务（应用关闭时调用）"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        """清理统计信息"""
+        return {
+            'interval': self.interval,
+            'batch_size': self.batch_size,
+            'runs': self.runs,
+            'removed': self.removed,
+            'errors': self.errors
+        }
+
+rbac_expiry_sweeper = RBACExpirySweeper(
+    interval=settings.RBAC_SWEEP_INTERVAL,
+    batch_size=settings.RBAC_SWEEP_BATCH_SIZE
+)
 
 class RBACMiddleware(BaseHTTPMiddleware):
     """RBAC权限检查中间件"""
@@ -469,21 +706,42 @@ async def health_check_detailed():
     """详细的健康检查"""
     try:
         from database_optimized import db_pool, cache_manager
+        from share_cache import share_view_cache
+        from http_clients import http_clients
+        from ai_cache import ai_cache
+        from single_flight import ai_single_flight, ai_stream_flight
+        from sse import chat_stream_limiter
+        from job_queue import job_queue, job_store
+        from export_cache import export_cache
+        from recommend_index import recommend_index
+        from user_cache import user_cache
+        from password_hashing import get_stats as password_hashing_stats
 
         health_info = {
             "status": "healthy",
             "timestamp": time.time(),
             "database": {
-                "connections": {
-                    "available": len(db_pool.connections),
-                    "used": len(db_pool.used_connections),
-                    "max": db_pool.max_connections
-                }
+                "connections": db_pool.get_stats()
             },
             "cache": {
                 "size": len(cache_manager.cache),
                 "max_size": cache_manager.max_size
-            }
+            },
+            "share_view_cache": share_view_cache.get_stats(),
+            "upstreams": http_clients.get_stats(),
+            "ai_cache": ai_cache.get_stats(),
+            "ai_single_flight": {
+                "calls": ai_single_flight.get_stats(),
+                "streams": ai_stream_flight.get_stats()
+            },
+            "chat_streams": chat_stream_limiter.get_stats(),
+            "job_queue": {**job_queue.get_stats(), "statuses": job_store.count_by_status()},
+            "export_cache": export_cache.get_stats(),
+            "recommend_index": recommend_index.get_stats(),
+            "user_cache": user_cache.get_stats(),
+            "password_hashing": password_hashing_stats(),
+            "rbac_cache": rbac_checker.get_stats(),
+            "rbac_expiry_sweeper": rbac_expiry_sweeper.get_stats()
         }
     except ImportError:
         # 如果没有优化的数据库连接池,使用基础版本
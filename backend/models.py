@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -102,6 +102,17 @@ class Note(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class NoteSummary(BaseModel):
+    """笔记列表摘要（不含完整content）"""
+    id: str
+    title: str
+    snippet: str
+    tags: List[str]
+    folder_id: Optional[str] = None
+    user_id: str
+    created_at: datetime
+    updated_at: datetime
+
 # AI Request models
 class AIRequest(BaseModel):
     action: str  # "continue", "polish", "translate", "summarize", "question", "analyze_project_idea", "extract_todos", "generate_plan"
@@ -122,6 +133,7 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    user_id: Optional[str] = None
 
 # Chat models
 class ChatModel(str, Enum):
@@ -413,3 +425,32 @@ class SharedNoteView(BaseModel):
     note: Note
     share_info: NoteSharePublic
     comments: List[Comment]
+
+# Export models
+class ExportJobCreate(BaseModel):
+    note_ids: List[str] = []
+    all_notes: bool = False  # 导出整个账户，忽略note_ids
+    format: str = "pdf"  # html 或 pdf
+
+# Background job models
+class BackgroundJob(BaseModel):
+    """后台任务的状态、进度和结果"""
+    id: str
+    kind: str
+    status: str  # queued / running / succeeded / failed / cancelled
+    priority: int
+    progress: int
+    total: Optional[int] = None
+    attempts: int
+    max_attempts: int
+    error: Optional[str] = None
+    result: Optional[Any] = None
+    has_file: bool = False  # 结果文件通过 /jobs/{id}/result 下载
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+class AutoClassifyBatchRequest(BaseModel):
+    note_ids: List[str] = []
+    all_notes: bool = False  # 分类整个账户的笔记，忽略note_ids
+    apply_tags: bool = True  # 把建议的标签写回笔记；为False时只返回建议
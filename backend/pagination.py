@@ -0,0 +1,42 @@
+"""
+分页工具
+列表接口使用基于 (updated_at, id) 的游标(keyset)分页，游标对客户端不透明
+"""
+
+import base64
+import html
+import json
+import re
+from typing import Optional, Tuple
+
+SNIPPET_LENGTH = 200
+
+def encode_cursor(updated_at: str, item_id: str) -> str:
+    """将最后一条记录的排序键编码为游标"""
+    raw = json.dumps([str(updated_at), str(item_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    """解析游标，格式错误时抛出ValueError"""
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(updated_at), str(item_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def make_snippet(content: Optional[str], length: int = SNIPPET_LENGTH) -> str:
+    """从HTML内容生成纯文本摘要"""
+    if not content:
+        return ''
+
+    text = re.sub(r'<[^>]*>', ' ', content)
+    text = html.unescape(text)
+    text = re.sub(r'\s+', ' ', text).strip()
+
+    if len(text) > length:
+        return text[:length].rstrip() + '…'
+    return text
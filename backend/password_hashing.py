@@ -0,0 +1,117 @@
+"""
+密码哈希
+bcrypt哈希和校验每次耗时上百毫秒，直接在异步路由中调用会阻塞事件循环；这里放到独立的有界线程池中执行：
+- 线程数即同时进行的哈希计算数（PASSWORD_HASH_WORKERS），bcrypt计算时释放GIL，不影响其他请求
+- 排队等待的数量超过 PASSWORD_HASH_MAX_PENDING 时直接拒绝（登录洪峰时快速失败，而不是无限排队）
+- 哈希参数（BCRYPT_ROUNDS）调整后，用户下次登录时透明地按新参数重新计算哈希
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+class PasswordHasherBusy(Exception):
+    """等待哈希计算的请求过多"""
+
+_password_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+_pending_lock = threading.Lock()
+_stats = {'completed': 0, 'rejected': 0, 'rehashed': 0}
+
+def password_hash_workers() -> int:
+    """线程数（未配置时为CPU核数，最多4个）"""
+    return settings.PASSWORD_HASH_WORKERS or min(4, os.cpu_count() or 1)
+
+def get_password_executor() -> ThreadPoolExecutor:
+    """获取或创建密码哈希线程池单例"""
+    global _password_executor
+
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(
+            max_workers=password_hash_workers(),
+            thread_name_prefix="bcrypt"
+        )
+
+    return _password_executor
+
+def _job_done(future: Future):
+    """
+    线程池中的任务结束时释放名额（而不是在等待的协程中释放）：
+    客户端断开导致协程被取消时，已经开始的bcrypt计算仍在线程中运行，应继续占用名额
+    """
+    global _pending
+
+    with _pending_lock:
+        _pending -= 1
+        if not future.cancelled() and future.exception() is None:
+            _stats['completed'] += 1
+
+async def _run(func: Callable, *args) -> Any:
+    global _pending
+
+    with _pending_lock:
+        if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            _stats['rejected'] += 1
+            raise PasswordHasherBusy()
+        _pending += 1
+
+    try:
+        future = get_password_executor().submit(func, *args)
+    except BaseException:
+        with _pending_lock:
+            _pending -= 1
+        raise
+
+    future.add_done_callback(_job_done)
+    # 协程被取消时，尚未开始的任务会随之取消（同样通过回调释放名额）
+    return await asyncio.wrap_future(future)
+
+async def hash_password(password: str) -> str:
+    """在线程池中计算密码哈希"""
+    return await _run(pwd_context.hash, password)
+
+async def verify_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    在线程池中校验密码，返回 (是否匹配, 新哈希)
+    哈希使用的参数已过时（如轮数低于当前配置）时，新哈希不为None，调用方应保存它
+    """
+    try:
+        verified, new_hash = await _run(pwd_context.verify_and_update, password, password_hash)
+    except ValueError:
+        # 数据库中的哈希格式无法识别
+        logger.warning("无法识别的密码哈希格式")
+        return False, None
+
+    if verified and new_hash:
+        _stats['rehashed'] += 1
+    return verified, new_hash
+
+def shutdown_password_executor(wait: bool = True):
+    """关闭密码哈希线程池（应用关闭时调用）"""
+    global _password_executor
+
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=wait)
+        _password_executor = None
+
+def get_stats() -> dict:
+    """线程池统计信息"""
+    with _pending_lock:
+        return {
+            'workers': password_hash_workers(),
+            'pending': _pending,
+            'max_pending': settings.PASSWORD_HASH_MAX_PENDING,
+            'rounds': settings.BCRYPT_ROUNDS,
+            **_stats
+        }
@@ -0,0 +1,158 @@
+"""
+PDF渲染
+reportlab渲染是纯CPU计算，放到有界进程池中执行：
+- 不阻塞事件循环，导出期间其他请求照常响应
+- 批量导出时多个笔记并行渲染，充分利用多核
+- 子进程用spawn方式启动：进程池在已运行数据库线程池等线程的进程中创建，fork可能把其他线程持有的锁复制进子进程
+- 子进程异常退出（如渲染时内存不足被杀）后进程池不可用，这里丢弃它，下次提交时重建
+
+render_pdf 为模块级函数，可被子进程导入和调用
+"""
+
+import asyncio
+import html
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class PDFRenderUnavailable(RuntimeError):
+    """未安装reportlab"""
+
+def pdf_available() -> bool:
+    """是否安装了reportlab"""
+    return importlib.util.find_spec("reportlab") is not None
+
+def render_pdf(html_content: str, title: str) -> bytes:
+    """
+    将HTML转换为简单的PDF（使用reportlab）
+    这是一个简化实现，生产环境建议使用 weasyprint 或 pdfkit
+    """
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.lib.units import inch
+    except ImportError:
+        raise PDFRenderUnavailable("PDF导出功能需要安装reportlab库。请运行: pip install reportlab")
+
+    # 创建PDF缓冲区
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+
+    # 定义样式
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        spaceAfter=30,
+    )
+
+    content_style = ParagraphStyle(
+        'CustomContent',
+        parent=styles['BodyText'],
+        fontSize=12,
+        leading=14,
+    )
+
+    # 构建内容
+    story = []
+
+    # 标题
+    story.append(Paragraph(html.escape(title), title_style))
+    story.append(Spacer(1, 0.2 * inch))
+
+    # 内容（简单文本处理）
+    # 移除HTML标签（简化版）
+    text_content = re.sub('<[^<]+?>', '', html_content)
+    text_content = html.unescape(text_content)
+
+    # 分段处理
+    paragraphs = text_content.split('\n')
+    for para in paragraphs:
+        if para.strip():
+            story.append(Paragraph(html.escape(para), content_style))
+            story.append(Spacer(1, 0.1 * inch))
+
+    # 生成PDF
+    doc.build(story)
+    pdf_data = buffer.getvalue()
+    buffer.close()
+
+    return pdf_data
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """获取或创建PDF渲染进程池单例（首次导出可能并发发生在多个线程中）"""
+    global _pdf_pool
+
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=pdf_render_workers(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    """丢弃已损坏的进程池（其他线程可能已经替换过，只处理仍是当前单例的情况）"""
+    global _pdf_pool
+
+    with _pdf_pool_lock:
+        if _pdf_pool is not pool:
+            return
+        _pdf_pool = None
+
+    logger.warning("PDF渲染子进程异常退出，进程池将在下次提交时重建")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def pdf_render_workers() -> int:
+    """进程池的进程数（未配置时为CPU核数），也用于控制同时提交的渲染任务数量"""
+    return settings.PDF_RENDER_WORKERS or os.cpu_count() or 1
+
+def submit_pdf(html_content: str, title: str) -> Future:
+    """
+    提交一个渲染任务到进程池（同步代码中使用）
+    导致子进程退出的任务本身以 BrokenProcessPool 失败，之后提交的任务使用新的进程池
+    """
+    pool = get_pdf_pool()
+    try:
+        future = pool.submit(render_pdf, html_content, title)
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        pool = get_pdf_pool()
+        future = pool.submit(render_pdf, html_content, title)
+
+    def discard_if_broken(done: Future):
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            _discard_broken_pool(pool)
+
+    future.add_done_callback(discard_if_broken)
+    return future
+
+async def render_pdf_async(html_content: str, title: str) -> bytes:
+    """在进程池中渲染PDF（异步路由中使用）"""
+    return await asyncio.wrap_future(submit_pdf(html_content, title))
+
+def shutdown_pdf_pool(wait: bool = True):
+    """关闭PDF渲染进程池（应用关闭时调用）"""
+    global _pdf_pool
+
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
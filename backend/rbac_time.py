@@ -0,0 +1,41 @@
+"""
+RBAC授权过期时间
+user_roles / user_permissions 的 expires_at 统一存为UTC格式（精确到微秒，以Z结尾），
+同一格式的值按字符串比较即按时间比较；权限检查、管理接口和数据层的过期清理共用这里的解析和格式化
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def parse_grant_expiry(expires_at: Optional[str]) -> Optional[float]:
+    """
+    把角色/权限授权的expires_at解析为时间戳，NULL表示永不过期
+    不带时区的时间按UTC处理；无法解析时视为已过期
+    """
+    if not expires_at:
+        return None
+    try:
+        expiry = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f"无法解析的授权过期时间: {expires_at}")
+        return 0.0
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+def format_grant_expiry(expires_at: str) -> str:
+    """
+    把expires_at统一为UTC格式
+    不带时区的时间按UTC处理；无法解析时抛出ValueError
+    """
+    expiry = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+    return expiry.isoformat(timespec='microseconds') + 'Z'
+
+def grant_time_now() -> str:
+    """当前时间（与expires_at相同的格式，用于按字符串比较查找过期授权）"""
+    return datetime.utcnow().isoformat(timespec='microseconds') + 'Z'
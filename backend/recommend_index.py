@@ -0,0 +1,321 @@
+"""
+笔记推荐索引
+每个用户一个内存中的推荐模型，首次请求时扫描一次笔记建立，之后随笔记的创建、修改、删除增量更新：
+- TF-IDF：标题和正文分词后每个笔记保留权重最高的若干词，倒排表记录包含每个词的笔记
+- 标签共现：统计标签两两同时出现的次数，"相关笔记"也会考虑与当前笔记标签经常一起使用的标签
+推荐时只对倒排表和标签表中的候选笔记打分，不再读取用户的全部笔记
+
+模型是进程内的：多worker部署时其他worker的修改最多在 RECOMMEND_INDEX_TTL 内不可见（到期后重建）
+每个模型有自己的锁：打分只阻塞同一用户的笔记更新，不同用户的推荐可以同时进行
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from config import settings
+from pagination import make_snippet
+
+# 参与分词的正文长度
+CONTENT_CHARS = 5000
+# 每个笔记保留的词数（按词频），限制单个笔记的打分开销
+MAX_TERMS_PER_NOTE = 64
+# 查询时最多评估的候选笔记数
+MAX_CANDIDATES = 500
+# 出现在超过该比例笔记中的词区分度太低，不用于查找候选
+MAX_DOC_FREQ_RATIO = 0.5
+# 标题中的词权重加倍
+TITLE_WEIGHT = 2
+# 综合得分中文本相似度和标签相似度的权重
+TEXT_WEIGHT = 0.6
+TAG_WEIGHT = 0.4
+# 共现标签的权重折扣（相对于完全相同的标签）
+COOCCURRENCE_DISCOUNT = 0.5
+# 没有指定笔记时，以最近修改的几条笔记作为兴趣来源
+RECENT_SEEDS = 3
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]{2,}|[぀-ヿ㐀-䶿一-鿿가-힯]+')
+_CJK_RUN_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+_STOPWORDS = {
+    'the', 'and', 'for', 'are', 'with', 'this', 'that', 'from', 'was', 'you', 'not', 'but', 'have', 'has',
+    'nbsp', 'http', 'https', 'www', 'com'
+}
+
+def tokenize(text: str) -> List[str]:
+    """英文和数字按词切分；中日韩文字没有空格，按相邻两字切分"""
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if _CJK_RUN_PATTERN.match(word):
+            if len(word) == 1:
+                terms.append(word)
+            else:
+                terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word not in _STOPWORDS:
+            terms.append(word)
+    return terms
+
+def _note_terms(note: dict) -> Dict[str, float]:
+    """计算笔记的词频（亚线性缩放），只保留频率最高的 MAX_TERMS_PER_NOTE 个词"""
+    counts = Counter(tokenize(make_snippet(note.get('content'), CONTENT_CHARS)))
+    for term in tokenize(note.get('title') or ''):
+        counts[term] += TITLE_WEIGHT
+    top = counts.most_common(MAX_TERMS_PER_NOTE)
+    return {term: 1 + math.log(count) for term, count in top}
+
+class _IndexedNote:
+    __slots__ = ('id', 'title', 'tags', 'updated_at', 'terms')
+
+    def __init__(self, note: dict):
+        self.id = note['id']
+        self.title = note['title']
+        self.tags = list(dict.fromkeys(note.get('tags') or []))
+        self.updated_at = str(note.get('updated_at') or '')
+        self.terms = _note_terms(note)
+
+class UserRecommendModel:
+    """单个用户的推荐模型（调用方持有 self.lock 后再读写）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.notes: Dict[str, _IndexedNote] = {}
+        self.postings: Dict[str, Set[str]] = {}  # 词 -> 包含该词的笔记
+        self.tag_notes: Dict[str, Set[str]] = {}  # 标签 -> 使用该标签的笔记
+        self.cooccurrence: Dict[str, Counter] = {}  # 标签 -> 与之同时出现的标签计数
+        self.built_at = time.monotonic()
+
+    def add(self, note: dict):
+        """加入或更新一个笔记"""
+        self.insert(_IndexedNote(note))
+
+    def insert(self, indexed: "_IndexedNote"):
+        """加入已分词的笔记（替换同ID的旧版本）"""
+        self.remove(indexed.id)
+        self.notes[indexed.id] = indexed
+
+        for term in indexed.terms:
+            self.postings.setdefault(term, set()).add(indexed.id)
+        for tag in indexed.tags:
+            self.tag_notes.setdefault(tag, set()).add(indexed.id)
+            related = self.cooccurrence.setdefault(tag, Counter())
+            for other in indexed.tags:
+                if other != tag:
+                    related[other] += 1
+
+    def remove(self, note_id: str):
+        """移除一个笔记"""
+        indexed = self.notes.pop(note_id, None)
+        if indexed is None:
+            return
+
+        for term in indexed.terms:
+            notes = self.postings.get(term)
+            if notes is not None:
+                notes.discard(note_id)
+                if not notes:
+                    del self.postings[term]
+        for tag in indexed.tags:
+            notes = self.tag_notes.get(tag)
+            if notes is not None:
+                notes.discard(note_id)
+                if not notes:
+                    del self.tag_notes[tag]
+            related = self.cooccurrence.get(tag)
+            if related is not None:
+                for other in indexed.tags:
+                    if other != tag:
+                        related[other] -= 1
+                        if related[other] <= 0:
+                            del related[other]
+                if not related:
+                    del self.cooccurrence[tag]
+
+    def _idf(self, term: str) -> float:
+        return math.log((1 + len(self.notes)) / (1 + len(self.postings.get(term, ())))) + 1
+
+    def _vector(self, indexed: _IndexedNote, idf_cache: Dict[str, float]) -> Dict[str, float]:
+        """TF-IDF向量；IDF随笔记增删变化，因此在查询时计算（同一次查询内复用）"""
+        vector = {}
+        for term, tf in indexed.terms.items():
+            idf = idf_cache.get(term)
+            if idf is None:
+                idf = idf_cache[term] = self._idf(term)
+            vector[term] = tf * idf
+        return vector
+
+    def _tag_weights(self, tags: Iterable[str]) -> Dict[str, float]:
+        """种子标签权重为1，与其经常共现的标签按共现比例打折"""
+        weights: Dict[str, float] = {}
+        for tag in tags:
+            weights[tag] = 1.0
+        for tag in list(weights):
+            usage = len(self.tag_notes.get(tag, ())) or 1
+            for other, count in self.cooccurrence.get(tag, Counter()).most_common(5):
+                if other not in weights or weights[other] < 1.0:
+                    weight = COOCCURRENCE_DISCOUNT * count / usage
+                    weights[other] = max(weights.get(other, 0.0), weight)
+        return weights
+
+    def _candidates(self, query: Dict[str, float], tag_weights: Dict[str, float], exclude: Set[str]) -> Set[str]:
+        """从倒排表中收集候选：先取区分度高（IDF大）的词，再取相关标签"""
+        candidates: Set[str] = set()
+        max_df = max(2, int(len(self.notes) * MAX_DOC_FREQ_RATIO))
+        for term in sorted(query, key=lambda t: query[t], reverse=True):
+            notes = self.postings.get(term, ())
+            if len(notes) > max_df:
+                continue
+            candidates.update(notes)
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+        for tag in sorted(tag_weights, key=lambda t: tag_weights[t], reverse=True):
+            if len(candidates) >= MAX_CANDIDATES * 2:
+                break
+            candidates.update(self.tag_notes.get(tag, ()))
+        return candidates - exclude
+
+    def related(self, seeds: List[_IndexedNote], limit: int) -> List[dict]:
+        """与种子笔记最相似的笔记"""
+        idf_cache: Dict[str, float] = {}
+        query: Dict[str, float] = Counter()
+        for seed in seeds:
+            query.update(self._vector(seed, idf_cache))
+        query_norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+
+        tag_weights = self._tag_weights(tag for seed in seeds for tag in seed.tags)
+        exclude = {seed.id for seed in seeds}
+
+        scored = []
+        for note_id in self._candidates(query, tag_weights, exclude):
+            candidate = self.notes[note_id]
+            vector = self._vector(candidate, idf_cache)
+            norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+            dot = sum(w * query[t] for t, w in vector.items() if t in query)
+            text_score = dot / (norm * query_norm)
+
+            matching_tags = [tag for tag in candidate.tags if tag in tag_weights]
+            tag_score = 0.0
+            if candidate.tags and tag_weights:
+                tag_score = sum(tag_weights[tag] for tag in matching_tags) / math.sqrt(len(candidate.tags) * len(tag_weights))
+
+            score = TEXT_WEIGHT * text_score + TAG_WEIGHT * min(tag_score, 1.0)
+            if score > 0:
+                scored.append((score, candidate.updated_at, candidate, matching_tags))
+
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [{
+            'id': candidate.id,
+            'title': candidate.title,
+            'tags': candidate.tags,
+            'matching_tags': matching_tags,
+            'score': round(score, 4)
+        } for score, _, candidate, matching_tags in scored[:limit]]
+
+    def recent_seeds(self) -> List[_IndexedNote]:
+        """最近修改的笔记"""
+        return sorted(self.notes.values(), key=lambda note: note.updated_at, reverse=True)[:RECENT_SEEDS]
+
+class RecommendIndex:
+    """按用户缓存推荐模型（LRU + TTL），笔记变更时增量更新"""
+
+    def __init__(self, max_users: int = 200, ttl: float = 300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._models: "OrderedDict[str, UserRecommendModel]" = OrderedDict()
+        self._generations: Dict[str, int] = {}  # 建立模型期间发生的变更会使该次结果不被缓存
+        self._lock = threading.Lock()  # 只保护 _models 和 _generations，不在持有期间打分或更新模型
+        self.builds = 0
+        self.hits = 0
+
+    def _get_model(self, user_id: str, load_notes: Callable[[], Iterable[dict]]) -> UserRecommendModel:
+        with self._lock:
+            model = self._models.get(user_id)
+            if model and time.monotonic() - model.built_at < self.ttl:
+                self._models.move_to_end(user_id)
+                self.hits += 1
+                return model
+            generation = self._generations.get(user_id, 0)
+
+        # 在锁外读取笔记并建立模型
+        model = UserRecommendModel()
+        for note in load_notes():
+            model.add(note)
+
+        with self._lock:
+            self.builds += 1
+            if self._generations.get(user_id, 0) == generation:
+                self._models[user_id] = model
+                self._models.move_to_end(user_id)
+                while len(self._models) > self.max_users:
+                    evicted, _ = self._models.popitem(last=False)
+                    self._generations.pop(evicted, None)
+        return model
+
+    def recommend(self, user_id: str, load_notes: Callable[[], Iterable[dict]],
+                  note_id: Optional[str] = None, limit: int = 10) -> Optional[List[dict]]:
+        """
+        推荐笔记：指定note_id时返回与该笔记相关的笔记，否则以最近修改的笔记为兴趣来源
+        note_id不存在时返回None
+        load_notes在模型尚未建立或已过期时调用，返回用户的全部笔记（同步，需在线程池中执行）
+        """
+        model = self._get_model(user_id, load_notes)
+
+        with model.lock:
+            if note_id is not None:
+                seed = model.notes.get(note_id)
+                if seed is None:
+                    return None
+                seeds = [seed]
+            else:
+                seeds = model.recent_seeds()
+            if not seeds:
+                return []
+            return model.related(seeds, limit)
+
+    def _touch(self, user_id: str) -> Optional[UserRecommendModel]:
+        """记录一次变更并返回该用户已建立的模型"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            return self._models.get(user_id)
+
+    def note_saved(self, user_id: str, note: dict):
+        """笔记创建或修改后调用（同步，需在线程池中执行）"""
+        indexed = _IndexedNote(note)  # 分词在锁外进行
+        model = self._touch(user_id)
+        if model:
+            with model.lock:
+                # 同一笔记的两次保存可能在线程池中乱序到达，不用旧版本覆盖新版本
+                current = model.notes.get(indexed.id)
+                if current is None or current.updated_at <= indexed.updated_at:
+                    model.insert(indexed)
+
+    def note_deleted(self, user_id: str, note_id: str):
+        """笔记删除后调用（同步，需在线程池中执行）"""
+        model = self._touch(user_id)
+        if model:
+            with model.lock:
+                model.remove(note_id)
+
+    def invalidate_user(self, user_id: str):
+        """批量修改用户笔记（如批量标签操作）后丢弃模型，下次请求时重建"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._models.pop(user_id, None)
+
+    def get_stats(self) -> dict:
+        """索引统计信息"""
+        with self._lock:
+            return {
+                'users': len(self._models),
+                'max_users': self.max_users,
+                'notes': sum(len(model.notes) for model in self._models.values()),
+                'builds': self.builds,
+                'hits': self.hits
+            }
+
+# 全局实例
+recommend_index = RecommendIndex(
+    max_users=settings.RECOMMEND_INDEX_MAX_USERS,
+    ttl=settings.RECOMMEND_INDEX_TTL
+)
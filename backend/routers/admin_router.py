@@ -1,8 +1,9 @@
 from typing import List
 from fastapi import APIRouter, HTTPException, status, Depends
-from database import user_repo, notes_repo
+from database import async_user_repo, async_notes_repo
 from auth import get_current_admin_user, require_admin
 from models import User, UserListResponse, AdminUserUpdate, SystemStats
+from user_cache import user_cache
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -11,12 +12,12 @@ async def get_all_users(admin_user: User = Depends(require_admin)):
     """
     获取所有用户列表（仅管理员）
     """
-    users_data = user_repo.get_all_users()
+    users_data = await async_user_repo.get_all_users()
 
     # 为每个用户添加统计信息
     users_with_stats = []
     for user_data in users_data:
-        stats = user_repo.get_user_stats(user_data['id'])
+        stats = await async_user_repo.get_user_stats(user_data['id'])
         user_response = UserListResponse(
             **user_data,
             notes_count=stats.get('notes_count', 0),
@@ -34,7 +35,7 @@ async def get_user_details(
     """
     获取指定用户详情（仅管理员）
     """
-    user_data = user_repo.get_user_by_id(user_id)
+    user_data = await async_user_repo.get_user_by_id(user_id)
 
     if not user_data:
         raise HTTPException(
@@ -42,7 +43,7 @@ async def get_user_details(
             detail="用户不存在"
         )
 
-    stats = user_repo.get_user_stats(user_id)
+    stats = await async_user_repo.get_user_stats(user_id)
     return UserListResponse(
         **user_data,
         notes_count=stats.get('notes_count', 0),
@@ -60,7 +61,7 @@ async def update_user(
     可以修改角色、姓名等
     """
     # 检查用户是否存在
-    existing_user = user_repo.get_user_by_id(user_id)
+    existing_user = await async_user_repo.get_user_by_id(user_id)
     if not existing_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -70,7 +71,7 @@ async def update_user(
     # 防止删除最后一个管理员
     if user_update.role == "user" and existing_user.get('role') == 'admin':
         # 检查是否还有其他管理员
-        all_users = user_repo.get_all_users()
+        all_users = await async_user_repo.get_all_users()
         admin_count = sum(1 for u in all_users if u.get('role') == 'admin')
         if admin_count <= 1:
             raise HTTPException(
@@ -87,7 +88,9 @@ async def update_user(
     if user_update.openrouter_api_key is not None:
         update_data["openrouter_api_key"] = user_update.openrouter_api_key
 
-    updated_user = user_repo.update_user(user_id, **update_data)
+    updated_user = await async_user_repo.update_user(user_id, **update_data)
+    # 角色等变更需要在下次请求时生效
+    user_cache.invalidate(user_id)
     return User(**updated_user)
 
 @router.delete("/users/{user_id}")
@@ -107,7 +110,7 @@ async def delete_user(
         )
 
     # 检查用户是否存在
-    existing_user = user_repo.get_user_by_id(user_id)
+    existing_user = await async_user_repo.get_user_by_id(user_id)
     if not existing_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,7 +119,7 @@ async def delete_user(
 
     # 防止删除最后一个管理员
     if existing_user.get('role') == 'admin':
-        all_users = user_repo.get_all_users()
+        all_users = await async_user_repo.get_all_users()
         admin_count = sum(1 for u in all_users if u.get('role') == 'admin')
         if admin_count <= 1:
             raise HTTPException(
@@ -124,13 +127,15 @@ async def delete_user(
                 detail="不能删除最后一个管理员账户"
             )
 
-    success = user_repo.delete_user(user_id)
+    success = await async_user_repo.delete_user(user_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="删除用户失败"
         )
 
+    user_cache.invalidate(user_id)
+
     return {"message": "用户已删除", "user_id": user_id}
 
 @router.get("/stats", response_model=SystemStats)
@@ -138,7 +143,7 @@ async def get_system_stats(admin_user: User = Depends(require_admin)):
     """
     获取系统统计信息（仅管理员）
     """
-    all_users = user_repo.get_all_users()
+    all_users = await async_user_repo.get_all_users()
 
     # 统计用户角色
     admin_users = sum(1 for u in all_users if u.get('role') == 'admin')
@@ -148,7 +153,7 @@ async def get_system_stats(admin_user: User = Depends(require_admin)):
     total_notes = 0
     total_todos = 0
     for user in all_users:
-        stats = user_repo.get_user_stats(user['id'])
+        stats = await async_user_repo.get_user_stats(user['id'])
         total_notes += stats.get('notes_count', 0)
         total_todos += stats.get('todos_count', 0)
 
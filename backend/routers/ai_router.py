@@ -1,11 +1,28 @@
+import asyncio
 import httpx
-from fastapi import APIRouter, HTTPException, status, Depends
-from auth import get_current_user
-from models import User, AIRequest, AIResponse
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, status, Depends, Response
+from auth import get_current_user, get_user_by_id
+from models import User, AIRequest, AIResponse, AutoClassifyBatchRequest, BackgroundJob
+from http_clients import get_http_client
+from ai_cache import async_ai_cache, make_cache_key
+from single_flight import ai_single_flight
+from job_queue import JobContext, JobError, JobLimitExceeded, PRIORITY_BULK, PRIORITY_NORMAL, job_queue
+from config import settings
+from pagination import make_snippet
+from share_cache import share_view_cache
+from recommend_index import recommend_index
+from token_estimate import estimate_tokens
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
 
-async def call_openrouter_api(api_key: str, prompt: str, system_message: str = None, model: str = "anthropic/claude-3-sonnet") -> str:
+# 按ID提交的批量自动分类任务最多包含的笔记数（整个账户分类不受此限制）
+AUTO_CLASSIFY_BATCH_MAX = 5000
+
+async def call_openrouter_api(api_key: str, prompt: str, system_message: str = None, model: str = "anthropic/claude-3-sonnet",
+                              max_tokens: int = 1000) -> str:
     """调用OpenRouter API"""
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -20,57 +37,86 @@ async def call_openrouter_api(api_key: str, prompt: str, system_message: str = N
     data = {
         "model": model,
         "messages": messages,
-        "max_tokens": 1000
+        "max_tokens": max_tokens
     }
     
-    async with httpx.AsyncClient() as client:
+    client = get_http_client("openrouter")
+    try:
+        response = await client.post(
+            "/chat/completions",
+            headers=headers,
+            json=data,
+            timeout=30.0
+        )
+        response.raise_for_status()
+        result = response.json()
+        return result["choices"][0]["message"]["content"]
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to call AI service: {str(e)}"
+        )
+    except httpx.HTTPStatusError as e:
+        # 将上游错误信息更多地暴露给前端，帮助诊断（例如 Claude Code 限制）。
+        detail_text = None
         try:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Failed to call AI service: {str(e)}"
-            )
-        except httpx.HTTPStatusError as e:
-            # 将上游错误信息更多地暴露给前端，帮助诊断（例如 Claude Code 限制）。
-            detail_text = None
-            try:
-                error_json = e.response.json()
-                error_msg = error_json.get("error", {})
-                if isinstance(error_msg, dict):
-                    detail_text = error_msg.get("message", str(error_msg))
-                else:
-                    detail_text = str(error_msg)
-                
-                # 检测 Claude Code 限制错误
-                if "only authorized for use with Claude Code" in detail_text:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail=(
-                            "API密钥错误：你使用的是Claude Code专用密钥，无法用于其他API调用。"
-                            "请到OpenRouter.ai获取以'sk-or-'开头的正确密钥。"
-                        )
+            error_json = e.response.json()
+            error_msg = error_json.get("error", {})
+            if isinstance(error_msg, dict):
+                detail_text = error_msg.get("message", str(error_msg))
+            else:
+                detail_text = str(error_msg)
+            
+            # 检测 Claude Code 限制错误
+            if "only authorized for use with Claude Code" in detail_text:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=(
+                        "API密钥错误：你使用的是Claude Code专用密钥，无法用于其他API调用。"
+                        "请到OpenRouter.ai获取以'sk-or-'开头的正确密钥。"
                     )
-                    
-            except Exception:
-                detail_text = e.response.text
+                )
                 
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"AI服务错误 ({e.response.status_code}): {detail_text}"
-            )
+        except Exception:
+            detail_text = e.response.text
+            
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"AI服务错误 ({e.response.status_code}): {detail_text}"
+        )
+
+async def call_openrouter_cached(
+    user: User,
+    action: str,
+    prompt: str,
+    system_message: str = None,
+    model: str = "anthropic/claude-3-sonnet",
+    refresh: bool = False,
+    max_tokens: int = 1000
+) -> Tuple[str, bool]:
+    """
+    带结果缓存的OpenRouter调用
+    按 (用户, 动作, 模型, 提示词) 缓存，返回 (结果, 是否命中缓存)；refresh=True 时跳过缓存重新生成
+    缓存未命中时，相同请求的并发调用（如重复点击、多个标签页）合并为一次上游请求
+    """
+    if not refresh:
+        cached = await async_ai_cache.get(user.id, action, model, system_message, prompt)
+        if cached is not None:
+            return cached, True
+
+    async def fetch():
+        result = await call_openrouter_api(user.openrouter_api_key, prompt, system_message, model, max_tokens)
+        await async_ai_cache.set(user.id, action, model, result, system_message, prompt)
+        return result
+
+    flight_key = make_cache_key(user.id, action, model, system_message, prompt)
+    return await ai_single_flight.do(flight_key, fetch), False
 
 @router.post("/process", response_model=AIResponse)
 async def process_ai_request(
     ai_request: AIRequest,
+    response: Response,
+    refresh: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.openrouter_api_key:
@@ -147,24 +193,32 @@ async def process_ai_request(
     
     # 调用AI API，使用用户选择的模型
     model_to_use = ai_request.model if hasattr(ai_request, 'model') and ai_request.model else "anthropic/claude-3-sonnet"
-    result = await call_openrouter_api(
-        current_user.openrouter_api_key,
+    result, cache_hit = await call_openrouter_cached(
+        current_user,
+        ai_request.action,
         prompt,
         system_message,
-        model_to_use
+        model_to_use,
+        refresh=refresh
     )
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
     
     return AIResponse(result=result, action=ai_request.action)
 
 # Phase 3.2 - AI智能助手增强功能
 
 @router.post("/summarize/{note_id}")
-async def summarize_note(note_id: str, current_user: User = Depends(get_current_user)):
-    """智能摘要：为笔记生成简洁摘要"""
-    from database import notes_repo
+async def summarize_note(
+    note_id: str,
+    response: Response,
+    refresh: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """智能摘要：为笔记生成简洁摘要（笔记内容未变化时直接返回缓存结果）"""
+    from database import async_notes_repo
 
-    note = notes_repo.get_note(note_id)
-    if not note or note['user_id'] != current_user.id:
+    note = await async_notes_repo.get_note_by_id(note_id, current_user.id)
+    if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
 
     if not current_user.openrouter_api_key:
@@ -178,82 +232,72 @@ async def summarize_note(note_id: str, current_user: User = Depends(get_current_
 
 请用中文输出摘要。"""
 
-    summary = await call_openrouter_api(
-        current_user.openrouter_api_key,
+    summary, cache_hit = await call_openrouter_cached(
+        current_user,
+        "summarize_note",
         prompt,
         "你是一个专业的内容摘要助手。",
-        "anthropic/claude-3-haiku"  # 使用快速模型
+        "anthropic/claude-3-haiku",  # 使用快速模型
+        refresh=refresh
     )
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
 
     return {"summary": summary}
 
-@router.get("/recommend")
-async def recommend_notes(current_user: User = Depends(get_current_user)):
-    """内容推荐：基于标签和时间推荐相关笔记"""
-    from database import notes_repo
-    from collections import Counter
-
-    all_notes = notes_repo.get_notes_by_user(current_user.id)
-
-    if len(all_notes) < 2:
-        return {"recommendations": []}
-
-    # 统计标签频率
-    tag_counter = Counter()
-    for note in all_notes:
-        if note.get('tags'):
-            tag_counter.update(note['tags'])
-
-    # 获取最常用的标签
-    popular_tags = [tag for tag, _ in tag_counter.most_common(5)]
+RECOMMEND_READ_BATCH_SIZE = 500
+RECOMMEND_MAX_LIMIT = 50
 
-    # 推荐包含热门标签的笔记
-    recommendations = []
-    for note in all_notes:
-        if note.get('tags'):
-            matching_tags = set(note['tags']) & set(popular_tags)
-            if matching_tags:
-                recommendations.append({
-                    'id': note['id'],
-                    'title': note['title'],
-                    'tags': note['tags'],
-                    'matching_tags': list(matching_tags),
-                    'score': len(matching_tags)
-                })
-
-    # 按匹配度排序
-    recommendations.sort(key=lambda x: x['score'], reverse=True)
-
-    return {"recommendations": recommendations[:10]}
+def _iter_recommend_notes(user_id: str) -> Iterator[dict]:
+    """建立推荐模型时按游标分批读取用户的全部笔记"""
+    from database import notes_repo
 
-@router.post("/auto-classify/{note_id}")
-async def auto_classify_note(note_id: str, current_user: User = Depends(get_current_user)):
-    """自动分类：AI分析笔记内容并建议标签和文件夹"""
-    from database import notes_repo, folders_repo
+    cursor = None
+    while True:
+        notes, cursor = notes_repo.get_notes_page(user_id, limit=RECOMMEND_READ_BATCH_SIZE, cursor=cursor)
+        yield from notes
+        if not cursor:
+            break
 
-    note = notes_repo.get_note(note_id)
-    if not note or note['user_id'] != current_user.id:
-        raise HTTPException(status_code=404, detail="笔记不存在")
+@router.get("/recommend")
+async def recommend_notes(
+    note_id: Optional[str] = None,
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    内容推荐：基于内容相似度（TF-IDF）和标签共现推荐相关笔记
+    - note_id: 返回与该笔记相关的笔记；不指定时根据最近修改的笔记推荐
+    """
+    from database import run_in_db_executor
+
+    limit = max(1, min(limit, RECOMMEND_MAX_LIMIT))
+    recommendations = await run_in_db_executor(
+        recommend_index.recommend,
+        current_user.id,
+        lambda: _iter_recommend_notes(current_user.id),
+        note_id,
+        limit
+    )
 
-    if not current_user.openrouter_api_key:
-        raise HTTPException(status_code=400, detail="请先配置OpenRouter API Key")
+    if recommendations is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
 
-    # 获取用户的所有文件夹和标签
-    # folders = folders_repo.get_folders_by_user(current_user.id)  # 如果有实现
-    all_notes = notes_repo.get_notes_by_user(current_user.id)
+    return {"recommendations": recommendations}
 
-    existing_tags = set()
-    for n in all_notes:
-        if n.get('tags'):
-            existing_tags.update(n['tags'])
+CLASSIFY_SYSTEM_MESSAGE = "你是一个内容分类专家。"
+CLASSIFY_MODEL = "anthropic/claude-3-haiku"
 
-    prompt = f"""请分析以下笔记的内容，并建议合适的标签和分类：
+def _classify_prompt(note: dict, existing_tags: List[str]) -> str:
+    return f"""请分析以下笔记的内容，并建议合适的标签和分类：
 
 标题：{note['title']}
 内容：
 {note['content'][:1500]}
 
-现有标签：{', '.join(list(existing_tags)[:20]) if existing_tags else '无'}
+现有标签：{', '.join(existing_tags[:20]) if existing_tags else '无'}
 
 请以JSON格式返回建议：
 {{
@@ -264,22 +308,275 @@ async def auto_classify_note(note_id: str, current_user: User = Depends(get_curr
 
 只返回JSON，不要其他文字。"""
 
+async def _classify_note(user: User, note: dict, existing_tags: List[str], refresh: bool = False) -> Tuple[dict, bool]:
+    """
+    为单个笔记生成标签和分类建议，返回 (建议, 是否命中缓存)
+    结果无法解析为JSON时抛出ValueError
+    """
+    prompt = _classify_prompt(note, existing_tags)
+    result, cache_hit = await call_openrouter_cached(
+        user,
+        "auto_classify",
+        prompt,
+        CLASSIFY_SYSTEM_MESSAGE,
+        CLASSIFY_MODEL,
+        refresh=refresh
+    )
+
+    try:
+        return json.loads(result), cache_hit
+    except ValueError:
+        # 无法解析的结果不保留在缓存中，下次请求重新生成
+        await async_ai_cache.invalidate(user.id, "auto_classify", CLASSIFY_MODEL, CLASSIFY_SYSTEM_MESSAGE, prompt)
+        raise
+
+async def _existing_tags(user_id: str) -> List[str]:
+    """现有标签按使用次数排序，提示词内容稳定，便于命中缓存"""
+    from database import async_notes_repo
+
+    tag_stats = await async_notes_repo.get_tag_stats(user_id)
+    return [item['tag'] for item in tag_stats]
+
+# 批量分类时每个笔记只发送标题和纯文本摘录
+CLASSIFY_BATCH_EXCERPT_CHARS = 800
+# 批量分类时提供给模型的现有标签数（整个任务只统计一次）
+CLASSIFY_BATCH_VOCABULARY = 50
+# 每个笔记的JSON建议大约需要的输出token
+CLASSIFY_BATCH_OUTPUT_TOKENS = 60
+# 一次读取的笔记数
+CLASSIFY_READ_BATCH_SIZE = 500
+
+def _batch_classify_header(existing_tags: List[str]) -> str:
+    return f"""请为以下每条笔记建议合适的标签和分类。优先使用现有标签，确有必要时再新建标签。
+
+现有标签：{', '.join(existing_tags) if existing_tags else '无'}
+
+"""
+
+def _batch_classify_footer(count: int) -> str:
+    return f"""
+请以JSON对象返回全部 {count} 条笔记的建议，键为笔记编号：
+{{
+  "1": {{"suggested_tags": ["标签1", "标签2"], "category": "建议的分类（如：工作、学习、生活等）"}}
+}}
+
+只返回JSON，不要其他文字。"""
+
+def _batch_note_text(number: int, note: dict) -> str:
+    return f"[{number}] 标题：{note['title']}\n内容：{make_snippet(note['content'], CLASSIFY_BATCH_EXCERPT_CHARS)}\n"
+
+def pack_notes(notes: List[dict], header_tokens: int, token_budget: int, max_notes: int) -> List[List[dict]]:
+    """
+    按估算token把笔记装入尽量少的请求：每组输入不超过预算，且不超过max_notes条
+    单个笔记超出预算时单独成组（摘录长度有限，不会过长）
+    """
+    chunks = []
+    current: List[dict] = []
+    used = header_tokens
+    for note in notes:
+        cost = estimate_tokens(_batch_note_text(len(current) + 1, note))
+        if current and (used + cost > token_budget or len(current) >= max_notes):
+            chunks.append(current)
+            current, used = [], header_tokens
+        current.append(note)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _parse_json_object(text: str) -> dict:
+    """解析模型返回的JSON对象，容忍```json代码块和前后多余文字"""
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise ValueError("返回内容不是JSON对象")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("返回内容不是JSON对象")
+    return data
+
+def _clean_tags(tags) -> List[str]:
+    """规范化模型建议的标签：去空白、去重、限制数量和长度"""
+    if not isinstance(tags, list):
+        return []
+    cleaned = [tag.strip().lstrip('#') for tag in tags if isinstance(tag, str)]
+    return [tag for tag in dict.fromkeys(cleaned) if tag and len(tag) <= 30][:5]
+
+async def _classify_chunk(user: User, notes: List[dict], existing_tags: List[str]) -> List[dict]:
+    """一次上游请求为一组笔记生成建议；整组结果无法解析时每个笔记记录错误"""
+    header = _batch_classify_header(existing_tags)
+    body = ''.join(_batch_note_text(number, note) + '\n' for number, note in enumerate(notes, start=1))
+    prompt = header + body + _batch_classify_footer(len(notes))
+
+    result, _ = await call_openrouter_cached(
+        user,
+        "auto_classify_batch",
+        prompt,
+        CLASSIFY_SYSTEM_MESSAGE,
+        CLASSIFY_MODEL,
+        max_tokens=200 + CLASSIFY_BATCH_OUTPUT_TOKENS * len(notes)
+    )
+
+    try:
+        data = _parse_json_object(result)
+    except ValueError as e:
+        # 无法解析的结果不保留在缓存中，任务重试时重新生成
+        await async_ai_cache.invalidate(user.id, "auto_classify_batch", CLASSIFY_MODEL, CLASSIFY_SYSTEM_MESSAGE, prompt)
+        return [{'note_id': note['id'], 'error': f"自动分类失败: {str(e)}"} for note in notes]
+
+    results = []
+    for number, note in enumerate(notes, start=1):
+        entry = data.get(str(number))
+        if not isinstance(entry, dict) or not _clean_tags(entry.get('suggested_tags')):
+            results.append({'note_id': note['id'], 'error': "自动分类失败: 模型未返回该笔记的建议"})
+            continue
+        results.append({
+            'note_id': note['id'],
+            'suggested_tags': _clean_tags(entry.get('suggested_tags')),
+            'category': str(entry.get('category') or '未分类')
+        })
+    return results
+
+def _iter_classify_notes(user_id: str, note_ids: Optional[List[str]]) -> Iterator[List[dict]]:
+    """按批读取要分类的笔记；note_ids为None时按游标读取整个账户"""
+    from database import notes_repo
+
+    if note_ids is None:
+        cursor = None
+        while True:
+            notes, cursor = notes_repo.get_notes_page(user_id, limit=CLASSIFY_READ_BATCH_SIZE, cursor=cursor)
+            if notes:
+                yield notes
+            if not cursor:
+                break
+    else:
+        for start in range(0, len(note_ids), CLASSIFY_READ_BATCH_SIZE):
+            notes = notes_repo.get_notes_by_ids(note_ids[start:start + CLASSIFY_READ_BATCH_SIZE], user_id)
+            if notes:
+                yield notes
+
+async def _run_auto_classify_job(ctx: JobContext) -> dict:
+    """
+    后台批量自动分类
+    - 现有标签词表从标签索引统计一次，所有请求共用
+    - 笔记按token预算打包，每次上游请求分类多条笔记，同时进行的请求数有上限
+    - 全部完成后在一个事务内把建议的标签写回笔记
+    """
+    from database import async_notes_repo, run_in_db_executor
+
+    user = await get_user_by_id(ctx.user_id)
+    if not user or not user.openrouter_api_key:
+        raise JobError("请先配置OpenRouter API Key")
+
+    existing_tags = (await _existing_tags(ctx.user_id))[:CLASSIFY_BATCH_VOCABULARY]
+    header_tokens = estimate_tokens(_batch_classify_header(existing_tags) + _batch_classify_footer(0))
+    semaphore = asyncio.Semaphore(settings.AUTO_CLASSIFY_CONCURRENCY)
+    results: List[dict] = []
+    processed = 0
+
+    async def classify(chunk: List[dict]):
+        nonlocal processed
+        async with semaphore:
+            chunk_results = await _classify_chunk(user, chunk, existing_tags)
+        results.extend(chunk_results)
+        processed += len(chunk)
+        await ctx.report(processed)
+
+    batches = _iter_classify_notes(ctx.user_id, ctx.payload['note_ids'])
+    while True:
+        notes = await run_in_db_executor(next, batches, None)
+        if notes is None:
+            break
+        chunks = pack_notes(notes, header_tokens, settings.AUTO_CLASSIFY_BATCH_TOKENS, settings.AUTO_CLASSIFY_BATCH_NOTES)
+        tasks = [asyncio.ensure_future(classify(chunk)) for chunk in chunks]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # 一组请求失败（如密钥无效、上游不可用）时取消其余请求，由任务队列决定是否重试
+            for task in tasks:
+                task.cancel()
+            raise
+
+    await ctx.report(processed, total=processed)
+
+    tags_by_note: Dict[str, List[str]] = {
+        item['note_id']: item['suggested_tags'] for item in results if 'suggested_tags' in item
+    }
+    updated_notes = 0
+    if ctx.payload.get('apply_tags') and tags_by_note:
+        updated_notes = await async_notes_repo.add_tags_bulk(ctx.user_id, tags_by_note)
+        if updated_notes:
+            share_view_cache.invalidate_user(ctx.user_id)
+            recommend_index.invalidate_user(ctx.user_id)
+
+    return {
+        'classified': len(tags_by_note),
+        'failed': len(results) - len(tags_by_note),
+        'updated_notes': updated_notes,
+        'results': results
+    }
+
+job_queue.register("auto_classify", _run_auto_classify_job)
+
+@router.post("/auto-classify/batch", status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundJob)
+async def auto_classify_notes_batch(
+    batch: AutoClassifyBatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    批量自动分类：提交后台任务，立即返回任务信息
+    多条笔记合并到一次AI请求中分类，完成后默认把建议的标签写回笔记（apply_tags=false 只返回建议）
+    通过 GET /jobs/{job_id} 查询进度，结果中包含每个笔记的建议
+    """
+    if not current_user.openrouter_api_key:
+        raise HTTPException(status_code=400, detail="请先配置OpenRouter API Key")
+
+    note_ids = None
+    if not batch.all_notes:
+        note_ids = list(dict.fromkeys(batch.note_ids))  # 去重并保持顺序
+        if not note_ids:
+            raise HTTPException(status_code=400, detail="请选择要分类的笔记")
+        if len(note_ids) > AUTO_CLASSIFY_BATCH_MAX:
+            raise HTTPException(status_code=400, detail=f"一次最多分类 {AUTO_CLASSIFY_BATCH_MAX} 个笔记")
+
     try:
-        result = await call_openrouter_api(
-            current_user.openrouter_api_key,
-            prompt,
-            "你是一个内容分类专家。",
-            "anthropic/claude-3-haiku"
+        return await job_queue.enqueue(
+            current_user.id,
+            "auto_classify",
+            {'note_ids': note_ids, 'apply_tags': batch.apply_tags},
+            priority=PRIORITY_BULK if note_ids is None else PRIORITY_NORMAL,
+            total=len(note_ids) if note_ids is not None else None
         )
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+@router.post("/auto-classify/{note_id}")
+async def auto_classify_note(
+    note_id: str,
+    response: Response,
+    refresh: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """自动分类：AI分析笔记内容并建议标签和文件夹"""
+    from database import async_notes_repo
+
+    note = await async_notes_repo.get_note_by_id(note_id, current_user.id)
+    if not note:
+        raise HTTPException(status_code=404, detail="笔记不存在")
 
-        import json
-        # 尝试解析JSON
-        suggestions = json.loads(result)
+    if not current_user.openrouter_api_key:
+        raise HTTPException(status_code=400, detail="请先配置OpenRouter API Key")
+
+    existing_tags = await _existing_tags(current_user.id)
+
+    try:
+        suggestions, cache_hit = await _classify_note(current_user, note, existing_tags, refresh=refresh)
+        response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
         return suggestions
     except Exception as e:
         # 如果解析失败，返回默认建议
         return {
-            "suggested_tags": list(existing_tags)[:3] if existing_tags else [],
+            "suggested_tags": existing_tags[:3],
             "category": "未分类",
             "reason": f"自动分类失败: {str(e)}"
         }
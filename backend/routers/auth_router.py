@@ -1,27 +1,40 @@
 from datetime import timedelta
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import HTTPAuthorizationCredentials
-from database import user_repo
-from auth import authenticate_user, create_access_token, get_password_hash, get_current_user
+from database import async_user_repo
+from auth import authenticate_user, create_access_token, get_current_user
+from password_hashing import PasswordHasherBusy, hash_password
 from models import UserCreate, UserLogin, Token, User
 from config import settings
 
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
+def _hasher_busy() -> HTTPException:
+    """登录/注册过多时的快速失败响应"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="登录请求过多，请稍后重试",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", response_model=Token)
 async def register(user: UserCreate):
     # Check if user already exists
-    existing_user = user_repo.get_user_by_email(user.email)
+    existing_user = await async_user_repo.get_user_by_email(user.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
+
+    try:
+        hashed_password = await hash_password(user.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     
     try:
         # Create new user
-        hashed_password = get_password_hash(user.password)
-        created_user = user_repo.create_user(
+        created_user = await async_user_repo.create_user(
             email=user.email,
             password_hash=hashed_password,
             full_name=user.full_name,
@@ -31,7 +44,7 @@ async def register(user: UserCreate):
         # Create access token
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data={"sub": user.email, "uid": created_user["id"]}, expires_delta=access_token_expires
         )
 
         return {"access_token": access_token, "token_type": "bearer"}
@@ -43,7 +56,10 @@ async def register(user: UserCreate):
 
 @router.post("/login", response_model=Token)
 async def login(user: UserLogin):
-    authenticated_user = await authenticate_user(user.email, user.password)
+    try:
+        authenticated_user = await authenticate_user(user.email, user.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
     if not authenticated_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,7 +69,7 @@ async def login(user: UserLogin):
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": authenticated_user.email}, expires_delta=access_token_expires
+        data={"sub": authenticated_user.email, "uid": authenticated_user.id}, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
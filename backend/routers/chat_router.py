@@ -1,36 +1,91 @@
 import httpx
 import json
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from fastapi.responses import StreamingResponse
-from typing import List
+from starlette.background import BackgroundTask
+from typing import List, Optional
 from auth import get_current_user
-from models import User, ChatRequest
+from config import settings
+from database import async_chat_repo
+from models import User, ChatRequest, ChatSession, ChatSessionCreate, ChatSessionUpdate, ChatMessage
+from http_clients import get_http_client
+from ai_cache import make_cache_key
+from token_estimate import estimate_tokens
+from single_flight import ai_stream_flight
+from sse import HEARTBEAT_FRAME, coalesce_stream, chat_stream_limiter
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-async def call_openrouter_streaming(api_key: str, messages: List[dict], model: str = "anthropic/claude-3-sonnet"):
-    """调用OpenRouter API - 流式响应"""
+DEFAULT_CHAT_MODEL = "anthropic/claude-3-sonnet"
+MESSAGES_PAGE_SIZE = 50
+
+def build_context_window(history: List[dict], token_budget: int) -> List[dict]:
+    """
+    从最新的消息开始向前选取历史消息，总估算token数不超过预算
+    history按时间正序排列，返回连续的最近若干条消息（同样按时间正序）
+    """
+    window = []
+    used = 0
+    for message in reversed(history):
+        cost = estimate_tokens(message['content'])
+        if used + cost > token_budget:
+            break
+        window.append({"role": message['role'], "content": message['content']})
+        used += cost
+
+    window.reverse()
+    return window
+
+def _check_api_key(user: User):
+    if not user.openrouter_api_key:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请先在设置中配置你的 OpenRouter API 密钥"
+        )
+    if not user.openrouter_api_key.startswith("sk-or-"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                "无效的 OpenRouter API 密钥。请在设置中保存以 sk-or- 开头的密钥。"
+                "Claude Code/Anthropic 控制台的密钥无法在此使用。"
+            )
+        )
+
+async def _get_user_session(session_id: str, user: User) -> dict:
+    session = await async_chat_repo.get_session(session_id, user.id)
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat session not found"
+        )
+    return session
+
+async def _load_history(session_id: str) -> List[dict]:
+    """读取会话最近的历史消息（条数有上限，再按token预算截取）"""
+    history, _ = await async_chat_repo.get_messages_page(session_id, limit=settings.CHAT_CONTEXT_MAX_MESSAGES)
+    return history
+
+async def call_openrouter_streaming(api_key: str, messages: List[dict], model: str = DEFAULT_CHAT_MODEL):
+    """调用OpenRouter API - 流式响应，逐个产出回复文本片段"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
-    
+
     data = {
         "model": model,
         "messages": messages,
         "max_tokens": 2000,
         "stream": True
     }
-    
+
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=data
-            )
-            
+        # 使用共享客户端以流式方式读取响应，数据块到达即转发
+        client = get_http_client("openrouter")
+        async with client.stream("POST", "/chat/completions", headers=headers, json=data) as response:
             if response.status_code != 200:
+                await response.aread()
                 # 透出更多错误信息，便于识别凭证受限等问题
                 try:
                     err = response.json()
@@ -39,7 +94,7 @@ async def call_openrouter_streaming(api_key: str, messages: List[dict], model: s
                         detail_text = error_msg.get("message", str(error_msg))
                     else:
                         detail_text = str(error_msg)
-                    
+
                     # 检测 Claude Code 限制错误
                     if "only authorized for use with Claude Code" in detail_text:
                         raise HTTPException(
@@ -49,15 +104,15 @@ async def call_openrouter_streaming(api_key: str, messages: List[dict], model: s
                                 "请到OpenRouter.ai获取以'sk-or-'开头的正确密钥。"
                             )
                         )
-                        
+
                 except Exception:
                     detail_text = response.text
-                    
+
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"AI服务错误 ({response.status_code}): {detail_text}"
                 )
-            
+
             async for line in response.aiter_lines():
                 if line.startswith("data: "):
                     data_str = line[6:]  # Remove "data: " prefix
@@ -67,70 +122,215 @@ async def call_openrouter_streaming(api_key: str, messages: List[dict], model: s
                         chunk_data = json.loads(data_str)
                         if chunk_data.get("choices") and len(chunk_data["choices"]) > 0:
                             delta = chunk_data["choices"][0].get("delta", {})
-                            if "content" in delta:
-                                yield f"data: {json.dumps({'content': delta['content']})}\n\n"
+                            if delta.get("content"):
+                                yield delta["content"]
                     except json.JSONDecodeError:
                         continue
-                        
+
     except httpx.RequestError as e:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Failed to call AI service: {str(e)}"
         )
 
-@router.get("/sessions")
-async def get_chat_sessions(current_user: User = Depends(get_current_user)):
-    """获取聊天会话列表 - 演示版本（返回空数组）"""
-    return []
+def _stream_chat(request: Request, user: User, message: str, model: str, session: Optional[dict] = None,
+                 history: Optional[List[dict]] = None) -> StreamingResponse:
+    """
+    以SSE流式返回模型回复，上下文为按token预算截取的最近历史消息
+    - 文本片段按时间间隔/字节数合并成帧，空闲时发送心跳
+    - 客户端断开后立即停止并取消上游请求
+    - 指定会话时，在流正常结束后把用户消息和完整回复一次性写入会话（不逐块写库）
+    """
+    lease = chat_stream_limiter.acquire(user.id)
+    if lease is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"同时进行的对话过多（最多 {chat_stream_limiter.max_per_user} 个），请等待当前回复完成"
+        )
 
-@router.post("/sessions")
-async def create_chat_session(current_user: User = Depends(get_current_user)):
-    """创建新的聊天会话 - 演示版本"""
-    return {"id": "demo-session", "title": "演示会话", "model": "anthropic/claude-3-sonnet"}
+    messages = build_context_window(history or [], settings.CHAT_CONTEXT_TOKEN_BUDGET)
+    messages.append({"role": "user", "content": message})
+    asked_at = datetime.utcnow().isoformat() + 'Z'
 
-@router.get("/sessions/{session_id}/messages")
-async def get_chat_messages(session_id: str, current_user: User = Depends(get_current_user)):
-    """获取聊天消息 - 演示版本（返回空数组）"""
-    return []
+    # 相同用户、模型和消息的并发请求共享一次上游流，后加入者先回放已收到的数据块
+    flight_key = make_cache_key(user.id, "chat", model, json.dumps(messages, ensure_ascii=False))
 
-@router.post("/chat")
-async def quick_chat(
-    chat_request: ChatRequest,
-    current_user: User = Depends(get_current_user)
-):
-    """快速聊天 - 不需要会话管理"""
-    if not current_user.openrouter_api_key:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="请先在设置中配置你的 OpenRouter API 密钥"
-        )
-    if not current_user.openrouter_api_key.startswith("sk-or-"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=(
-                "无效的 OpenRouter API 密钥。请在设置中保存以 sk-or- 开头的密钥。"
-                "Claude Code/Anthropic 控制台的密钥无法在此使用。"
-            )
-        )
-    
-    messages = [{"role": "user", "content": chat_request.message}]
-    model = chat_request.model or "anthropic/claude-3-sonnet"
-    
     async def generate_response():
-        yield "data: {\"status\": \"start\"}\n\n"
         try:
-            async for chunk in call_openrouter_streaming(current_user.openrouter_api_key, messages, model):
-                yield chunk
+            yield "data: {\"status\": \"start\"}\n\n"
+            upstream = ai_stream_flight.stream(
+                flight_key,
+                lambda: call_openrouter_streaming(user.openrouter_api_key, messages, model)
+            )
+            # 退出时关闭上游订阅，最后一个订阅者离开会取消上游请求
+            frames = coalesce_stream(
+                upstream,
+                flush_interval=settings.SSE_FLUSH_INTERVAL,
+                flush_bytes=settings.SSE_FLUSH_BYTES,
+                heartbeat_interval=settings.SSE_HEARTBEAT_INTERVAL,
+                is_disconnected=request.is_disconnected
+            )
+            reply_parts = []
+            completed = False
+            try:
+                async for content in frames:
+                    if content is None:
+                        yield HEARTBEAT_FRAME
+                        continue
+                    reply_parts.append(content)
+                    yield f"data: {json.dumps({'content': content})}\n\n"
+                completed = not await request.is_disconnected()
+            finally:
+                await frames.aclose()
+
+            if not completed:
+                return
+
+            if session and reply_parts:
+                await async_chat_repo.add_messages(session['id'], [
+                    {"role": "user", "content": message, "created_at": asked_at},
+                    {"role": "assistant", "content": "".join(reply_parts)}
+                ])
+            yield "data: {\"status\": \"end\"}\n\n"
         except Exception as e:
-            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
-        finally:
+            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
             yield "data: {\"status\": \"end\"}\n\n"
-    
+        finally:
+            lease.release()
+
     return StreamingResponse(
         generate_response(),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
-    )
\ No newline at end of file
+            "X-Accel-Buffering": "no",  # 关闭nginx代理缓冲，合并后的帧立即送达
+        },
+        # 响应未开始迭代就结束时（如客户端提前断开）也要归还名额
+        background=BackgroundTask(lease.release)
+    )
+
+@router.get("/sessions", response_model=List[ChatSession])
+async def get_chat_sessions(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200, description="每页数量，不传则返回全部"),
+    cursor: Optional[str] = Query(None, description="下一页游标（取自上一页响应头 X-Next-Cursor）"),
+    current_user: User = Depends(get_current_user)
+):
+    """获取聊天会话列表（按最近活动倒序）"""
+    try:
+        sessions, next_cursor = await async_chat_repo.get_sessions_page(current_user.id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return [ChatSession(**session) for session in sessions]
+
+@router.post("/sessions", response_model=ChatSession)
+async def create_chat_session(
+    session_data: ChatSessionCreate = ChatSessionCreate(),
+    current_user: User = Depends(get_current_user)
+):
+    """创建新的聊天会话"""
+    session = await async_chat_repo.create_session(
+        current_user.id,
+        session_data.title or "新的对话",
+        session_data.model.value
+    )
+    return ChatSession(**session)
+
+@router.put("/sessions/{session_id}", response_model=ChatSession)
+async def update_chat_session(
+    session_id: str,
+    session_data: ChatSessionUpdate,
+    current_user: User = Depends(get_current_user)
+):
+    """修改会话标题或模型"""
+    session = await async_chat_repo.update_session(
+        session_id,
+        current_user.id,
+        title=session_data.title,
+        model=session_data.model.value if session_data.model else None
+    )
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat session not found"
+        )
+    return ChatSession(**session)
+
+@router.delete("/sessions/{session_id}")
+async def delete_chat_session(session_id: str, current_user: User = Depends(get_current_user)):
+    """删除会话及其消息"""
+    deleted = await async_chat_repo.delete_session(session_id, current_user.id)
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat session not found"
+        )
+    return {"message": "Chat session deleted successfully"}
+
+@router.get("/sessions/{session_id}/messages", response_model=List[ChatMessage])
+async def get_chat_messages(
+    session_id: str,
+    response: Response,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=200, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="更早一页的游标（取自上一页响应头 X-Next-Cursor）"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取聊天消息
+    第一页为最新的消息，页内按时间正序；还有更早的消息时通过响应头 X-Next-Cursor 返回游标
+    """
+    await _get_user_session(session_id, current_user)
+
+    try:
+        messages, next_cursor = await async_chat_repo.get_messages_page(session_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return [ChatMessage(**message) for message in messages]
+
+@router.post("/sessions/{session_id}/messages")
+async def send_chat_message(
+    session_id: str,
+    chat_request: ChatRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """在会话中发送消息：流式返回回复，并带上最近的历史消息作为上下文"""
+    _check_api_key(current_user)
+    session = await _get_user_session(session_id, current_user)
+    history = await _load_history(session_id)
+
+    model = chat_request.model or session['model']
+    return _stream_chat(request, current_user, chat_request.message, model, session, history)
+
+@router.post("/chat")
+async def quick_chat(
+    chat_request: ChatRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """快速聊天 - 不需要会话管理；传入session_id时等同于在该会话中发送消息"""
+    _check_api_key(current_user)
+
+    session = None
+    history = None
+    if chat_request.session_id:
+        session = await _get_user_session(chat_request.session_id, current_user)
+        history = await _load_history(session['id'])
+
+    model = chat_request.model or (session['model'] if session else DEFAULT_CHAT_MODEL)
+    return _stream_chat(request, current_user, chat_request.message, model, session, history)
@@ -1,144 +1,146 @@
 """
 笔记导出路由
 支持PDF导出和批量导出功能
+- PDF在进程池中渲染，不阻塞事件循环；批量导出时多个笔记并行渲染
+- 小批量直接流式下载ZIP；大批量可提交为后台任务，通过 /jobs 查询进度并下载
+- 单个笔记的导出结果缓存在磁盘上，笔记未修改时直接返回文件，支持ETag条件请求
 """
-from fastapi import APIRouter, HTTPException, status, Depends
-from fastapi.responses import FileResponse, StreamingResponse
-from typing import List
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from typing import Awaitable, BinaryIO, Callable, Iterator, List, Optional, Tuple
+from collections import deque
 from auth import get_current_user
-from models import User
-from database_sqlite import notes_repo
+from models import User, ExportJobCreate, BackgroundJob
+from database import notes_repo, async_notes_repo
+from zip_stream import stream_zip
+from pdf_render import PDFRenderUnavailable, pdf_available, pdf_render_workers, render_pdf_async, submit_pdf
+from job_queue import JobContext, JobLimitExceeded, PRIORITY_BULK, PRIORITY_NORMAL, job_queue
+from export_cache import CachedExport, export_cache
+from share_cache import etag_matches
+import asyncio
 import io
 import zipfile
 from datetime import datetime
 
 router = APIRouter(prefix="/export", tags=["export"])
 
-def html_to_simple_pdf(html_content: str, title: str) -> bytes:
-    """
-    将HTML转换为简单的PDF（使用reportlab）
-    这是一个简化实现，生产环境建议使用 weasyprint 或 pdfkit
-    """
-    try:
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        import html
-
-        # 创建PDF缓冲区
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-
-        # 定义样式
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30,
-        )
-
-        content_style = ParagraphStyle(
-            'CustomContent',
-            parent=styles['BodyText'],
-            fontSize=12,
-            leading=14,
-        )
-
-        # 构建内容
-        story = []
+# 批量导出时每次从数据库读取的笔记数，内存中最多同时保留一批
+EXPORT_BATCH_SIZE = 500
 
-        # 标题
-        story.append(Paragraph(html.escape(title), title_style))
-        story.append(Spacer(1, 0.2 * inch))
+# 导出模板版本：修改PDF或HTML的渲染方式后递增，使磁盘上已缓存的导出结果失效
+EXPORT_TEMPLATE_VERSION = 1
 
-        # 内容（简单文本处理）
-        # 移除HTML标签（简化版）
-        import re
-        text_content = re.sub('<[^<]+?>', '', html_content)
-        text_content = html.unescape(text_content)
+# 从缓存文件读取时每次读出的字节数
+FILE_CHUNK_SIZE = 64 * 1024
 
-        # 分段处理
-        paragraphs = text_content.split('\n')
-        for para in paragraphs:
-            if para.strip():
-                story.append(Paragraph(html.escape(para), content_style))
-                story.append(Spacer(1, 0.1 * inch))
-
-        # 生成PDF
-        doc.build(story)
-        pdf_data = buffer.getvalue()
-        buffer.close()
+def _open_cached(entry: CachedExport) -> Optional[BinaryIO]:
+    """打开缓存文件；打开后即使文件被淘汰删除，已打开的句柄仍可读完"""
+    try:
+        return open(entry.path, 'rb')
+    except FileNotFoundError:
+        return None
 
-        return pdf_data
+def _iter_file(f: BinaryIO) -> Iterator[bytes]:
+    try:
+        while chunk := f.read(FILE_CHUNK_SIZE):
+            yield chunk
+    finally:
+        f.close()
+
+async def _export_response(
+    request: Request,
+    note: dict,
+    format: str,
+    media_type: str,
+    filename: str,
+    render: Callable[[], Awaitable[bytes]]
+) -> Response:
+    """
+    返回单个笔记的导出文件
+    按 (笔记ID, 更新时间, 格式, 模板版本) 查找磁盘缓存，未命中时渲染并写入缓存
+    """
+    cache_args = (note['id'], str(note['updated_at']), format, EXPORT_TEMPLATE_VERSION)
+
+    cached = await asyncio.to_thread(export_cache.get, *cache_args)
+    f = await asyncio.to_thread(_open_cached, cached) if cached else None
+    cache_hit = f is not None
+
+    if not cache_hit:
+        content = await render()
+        cached = await asyncio.to_thread(export_cache.set, *cache_args, content)
+        if cached is None:
+            # 缓存未启用或写入失败，直接返回渲染结果
+            return StreamingResponse(
+                io.BytesIO(content),
+                media_type=media_type,
+                headers={
+                    "Content-Disposition": f"attachment; filename={filename}",
+                    "X-Cache": "MISS"
+                }
+            )
+
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": "private, no-cache",
+        "X-Cache": "HIT" if cache_hit else "MISS"
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        if f:
+            f.close()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if not cache_hit:
+        return Response(content=content, media_type=media_type, headers={
+            **headers, "Content-Disposition": f"attachment; filename={filename}"
+        })
 
-    except ImportError:
-        # 如果没有安装reportlab，返回HTML作为备用
-        raise HTTPException(
-            status_code=503,
-            detail="PDF导出功能需要安装reportlab库。请运行: pip install reportlab"
-        )
+    return StreamingResponse(
+        _iter_file(f),
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(cached.size)
+        }
+    )
 
 @router.get("/pdf/{note_id}")
 async def export_note_to_pdf(
     note_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """
     将单个笔记导出为PDF
     """
-    note = notes_repo.get_note(note_id)
-
-    if not note:
-        raise HTTPException(status_code=404, detail="笔记不存在")
-
-    if note['user_id'] != current_user.id:
-        raise HTTPException(status_code=403, detail="无权限导出此笔记")
-
-    try:
-        # 生成PDF
-        pdf_content = html_to_simple_pdf(note['content'], note['title'])
-
-        # 生成文件名
-        filename = f"{note['title'][:30]}_{datetime.now().strftime('%Y%m%d')}.pdf"
-        filename = filename.replace(' ', '_')
-
-        # 返回PDF文件
-        return StreamingResponse(
-            io.BytesIO(pdf_content),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
-        )
-
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"PDF导出失败: {str(e)}"
-        )
-
-@router.get("/html/{note_id}")
-async def export_note_to_html(
-    note_id: str,
-    current_user: User = Depends(get_current_user)
-):
-    """
-    将单个笔记导出为HTML
-    """
-    note = notes_repo.get_note(note_id)
+    note = await async_notes_repo.get_note_by_id(note_id, current_user.id)
 
     if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
 
-    if note['user_id'] != current_user.id:
-        raise HTTPException(status_code=403, detail="无权限导出此笔记")
+    # 生成文件名
+    filename = f"{note['title'][:30]}_{datetime.now().strftime('%Y%m%d')}.pdf"
+    filename = filename.replace(' ', '_')
 
-    # 生成完整的HTML文档
-    html_content = f"""<!DOCTYPE html>
+    async def render() -> bytes:
+        try:
+            # 在进程池中生成PDF
+            return await render_pdf_async(note['content'], note['title'])
+        except PDFRenderUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"PDF导出失败: {str(e)}"
+            )
+
+    return await _export_response(request, note, "pdf", "application/pdf", filename, render)
+
+def _note_html(note: dict) -> bytes:
+    """单个笔记导出的完整HTML文档"""
+    return f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -190,61 +192,49 @@ async def export_note_to_html(
         {note['content']}
     </div>
 </body>
-</html>"""
+</html>""".encode('utf-8')
+
+@router.get("/html/{note_id}")
+async def export_note_to_html(
+    note_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    将单个笔记导出为HTML
+    """
+    note = await async_notes_repo.get_note_by_id(note_id, current_user.id)
+
+    if not note:
+        raise HTTPException(status_code=404, detail="笔记不存在")
 
     filename = f"{note['title'][:30]}_{datetime.now().strftime('%Y%m%d')}.html"
     filename = filename.replace(' ', '_')
 
-    return StreamingResponse(
-        io.BytesIO(html_content.encode('utf-8')),
-        media_type="text/html",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
-    )
+    async def render() -> bytes:
+        return _note_html(note)
 
-@router.post("/batch")
-async def batch_export_notes(
-    note_ids: List[str],
-    format: str = "html",  # html 或 pdf
-    current_user: User = Depends(get_current_user)
-):
+    return await _export_response(request, note, "html", "text/html", filename, render)
+
+def _iter_export_notes(user_id: str, note_ids: Optional[List[str]]) -> Iterator[dict]:
     """
-    批量导出笔记为ZIP文件
+    按批读取要导出的笔记
+    note_ids为None时导出整个账户（按游标逐页读取），否则每批ID用一次 IN 查询取回
     """
-    if not note_ids:
-        raise HTTPException(status_code=400, detail="请选择要导出的笔记")
-
-    if len(note_ids) > 100:
-        raise HTTPException(status_code=400, detail="一次最多导出100个笔记")
-
-    # 创建ZIP文件
-    zip_buffer = io.BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for note_id in note_ids:
-            note = notes_repo.get_note(note_id)
-
-            if not note or note['user_id'] != current_user.id:
-                continue  # 跳过无权限的笔记
-
-            # 生成文件名
-            safe_title = note['title'][:30].replace(' ', '_').replace('/', '_')
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-            if format == "pdf":
-                try:
-                    # 生成PDF
-                    pdf_content = html_to_simple_pdf(note['content'], note['title'])
-                    filename = f"{safe_title}_{timestamp}.pdf"
-                    zip_file.writestr(filename, pdf_content)
-                except Exception as e:
-                    # PDF生成失败，跳过
-                    print(f"PDF生成失败: {str(e)}")
-                    continue
-            else:
-                # 生成HTML
-                html_content = f"""<!DOCTYPE html>
+    if note_ids is None:
+        cursor = None
+        while True:
+            notes, cursor = notes_repo.get_notes_page(user_id, limit=EXPORT_BATCH_SIZE, cursor=cursor)
+            yield from notes
+            if not cursor:
+                break
+    else:
+        for start in range(0, len(note_ids), EXPORT_BATCH_SIZE):
+            yield from notes_repo.get_notes_by_ids(note_ids[start:start + EXPORT_BATCH_SIZE], user_id)
+
+def _batch_html(note: dict) -> bytes:
+    """批量导出中单个笔记的HTML文档"""
+    return f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -258,19 +248,147 @@ async def batch_export_notes(
     <h1>{note['title']}</h1>
     <div>{note['content']}</div>
 </body>
-</html>"""
-                filename = f"{safe_title}_{timestamp}.html"
-                zip_file.writestr(filename, html_content.encode('utf-8'))
+</html>""".encode('utf-8')
+
+def _render_batch_entries(notes: Iterator[dict], format: str) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+    把笔记逐个渲染为ZIP条目 (文件名, 内容)，渲染失败时内容为None；同名文件自动加序号
+    PDF提交到进程池并行渲染，同时在途的任务数为进程数的两倍，按提交顺序产出
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = "pdf" if format == "pdf" else "html"
+    used_names = set()
 
-    zip_buffer.seek(0)
+    def entry_filename(note: dict) -> str:
+        # 生成文件名
+        safe_title = note['title'][:30].replace(' ', '_').replace('/', '_')
+        filename = f"{safe_title}_{timestamp}.{extension}"
+        sequence = 1
+        while filename in used_names:
+            sequence += 1
+            filename = f"{safe_title}_{timestamp}_{sequence}.{extension}"
+        used_names.add(filename)
+        return filename
+
+    if format != "pdf":
+        for note in notes:
+            yield entry_filename(note), _batch_html(note)
+        return
+
+    def collect(note: dict, future) -> Tuple[str, Optional[bytes]]:
+        filename = entry_filename(note)
+        try:
+            return filename, future.result()
+        except Exception as e:
+            # PDF生成失败，跳过
+            print(f"PDF生成失败: {str(e)}")
+            return filename, None
+
+    in_flight = deque()
+    window = pdf_render_workers() * 2
+    try:
+        for note in notes:
+            in_flight.append((note, submit_pdf(note['content'], note['title'])))
+            if len(in_flight) >= window:
+                yield collect(*in_flight.popleft())
+
+        while in_flight:
+            yield collect(*in_flight.popleft())
+    finally:
+        # 客户端中途断开时取消尚未开始的渲染
+        for _, future in in_flight:
+            future.cancel()
+
+def _selected_note_ids(note_ids: List[str], all_notes: bool) -> Optional[List[str]]:
+    """all_notes时返回None表示整个账户，否则返回去重后的ID列表"""
+    if all_notes:
+        return None
+    if note_ids:
+        return list(dict.fromkeys(note_ids))  # 去重并保持顺序
+    raise HTTPException(status_code=400, detail="请选择要导出的笔记")
+
+def _check_format(format: str):
+    if format == "pdf" and not pdf_available():
+        raise HTTPException(
+            status_code=503,
+            detail="PDF导出功能需要安装reportlab库。请运行: pip install reportlab"
+        )
+
+@router.post("/batch")
+async def batch_export_notes(
+    note_ids: List[str] = Body(default=[]),
+    format: str = "html",  # html 或 pdf
+    all_notes: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    批量导出笔记为ZIP文件
+    - 边生成边下载：每渲染完一个笔记就写出对应的ZIP字节，内存占用与笔记总数无关
+    - all_notes=true 时导出账户中的全部笔记，忽略note_ids
+    - 数百个PDF建议使用 POST /export/jobs 在后台导出
+    """
+    selected_ids = _selected_note_ids(note_ids, all_notes)
+    _check_format(format)
 
     # 生成ZIP文件名
     zip_filename = f"notes_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
 
+    # 同步生成器由StreamingResponse放到线程池中迭代，数据库读取和等待渲染都不阻塞事件循环
+    entries = _render_batch_entries(_iter_export_notes(current_user.id, selected_ids), format)
+
     return StreamingResponse(
-        zip_buffer,
+        stream_zip((name, content) for name, content in entries if content is not None),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename={zip_filename}"
         }
     )
+
+async def _run_export_job(ctx: JobContext) -> dict:
+    """后台导出任务：把选中的笔记写入结果目录中的ZIP文件"""
+    format = ctx.payload['format']
+    path = ctx.create_result_file(
+        f"notes_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip", "application/zip"
+    )
+
+    # 读取和渲染在线程池中进行（PDF再分发到进程池），压缩写盘也放到线程中，不阻塞事件循环
+    entries = _render_batch_entries(_iter_export_notes(ctx.user_id, ctx.payload['note_ids']), format)
+    processed = failed = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        async for filename, content in iterate_in_threadpool(entries):
+            if content is None:
+                failed += 1
+            else:
+                await asyncio.to_thread(zip_file.writestr, filename, content)
+            processed += 1
+            await ctx.report(processed)
+
+    # 不存在或无权限的笔记不计入总数
+    await ctx.report(processed, total=processed)
+    return {'exported': processed - failed, 'failed': failed}
+
+job_queue.register("export", _run_export_job)
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundJob)
+async def create_export_job(
+    job_data: ExportJobCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    提交后台导出任务，立即返回任务信息
+    通过 GET /jobs/{job_id} 查询进度，完成后从 /jobs/{job_id}/result 下载ZIP
+    """
+    selected_ids = _selected_note_ids(job_data.note_ids, job_data.all_notes)
+    _check_format(job_data.format)
+
+    try:
+        return await job_queue.enqueue(
+            current_user.id,
+            "export",
+            {'note_ids': selected_ids, 'format': job_data.format},
+            # 整个账户的导出排在按需选择的导出之后
+            priority=PRIORITY_BULK if selected_ids is None else PRIORITY_NORMAL,
+            total=len(selected_ids) if selected_ids is not None else None
+        )
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
@@ -0,0 +1,70 @@
+"""
+后台任务路由
+查询进度、获取结果和取消由各功能接口提交的后台任务（导出、批量自动分类、图像生成等）
+"""
+import os
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+from fastapi.responses import FileResponse
+from auth import get_current_user, get_current_user_id
+from models import User, BackgroundJob
+from job_queue import async_job_store, job_queue, public_job
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+async def _get_user_job(job_id: str, user_id: str) -> dict:
+    job = await async_job_store.get_job(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在或已过期")
+    return job
+
+@router.get("/", response_model=List[BackgroundJob])
+async def get_jobs(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="下一页游标（取自上一页响应头 X-Next-Cursor）"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """获取当前用户的后台任务（按提交时间倒序）"""
+    try:
+        jobs, next_cursor = await async_job_store.get_jobs_page(user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [public_job(job) for job in jobs]
+
+@router.get("/{job_id}", response_model=BackgroundJob)
+async def get_job(job_id: str, user_id: str = Depends(get_current_user_id)):
+    """查询任务状态和进度"""
+    return public_job(await _get_user_job(job_id, user_id))
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, user_id: str = Depends(get_current_user_id)):
+    """获取已完成任务的结果：有结果文件时下载文件，否则返回JSON结果"""
+    job = await _get_user_job(job_id, user_id)
+    if job['status'] != 'succeeded':
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"任务尚未完成（当前状态: {job['status']}）"
+        )
+
+    if job['result_file']:
+        if not os.path.exists(job['result_file']):
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="结果文件已被清理")
+        return FileResponse(
+            job['result_file'],
+            media_type=job['result_media_type'] or "application/octet-stream",
+            filename=job['result_filename']
+        )
+    return public_job(job)['result']
+
+@router.delete("/{job_id}", response_model=BackgroundJob)
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """取消排队中或运行中的任务"""
+    job = await job_queue.cancel(job_id, current_user.id)
+    if job is None:
+        await _get_user_job(job_id, current_user.id)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="任务已结束，无法取消")
+    return job
@@ -1,10 +1,13 @@
+import asyncio
 import httpx
 import base64
 from fastapi import APIRouter, HTTPException, status, Depends
-from auth import get_current_user
-from models import User
+from auth import get_current_user, get_user_by_id
+from models import User, BackgroundJob
 from pydantic import BaseModel
 from typing import Optional, List
+from http_clients import get_http_client
+from job_queue import JobContext, JobError, JobLimitExceeded, PRIORITY_INTERACTIVE, job_queue
 
 router = APIRouter(prefix="/api/nano-banana", tags=["nano-banana"])
 
@@ -35,7 +38,7 @@ async def call_gemini_api(
     api_key: str,
     endpoint: str,
     data: dict,
-    timeout: float = 60.0
+    timeout: Optional[float] = None
 ) -> dict:
     """
     调用Google Gemini API
@@ -44,76 +47,76 @@ async def call_gemini_api(
         api_key: Google API密钥
         endpoint: API端点 (generateContent 或 generateImage)
         data: 请求数据
-        timeout: 超时时间（秒）
+        timeout: 超时时间（秒），默认使用gemini上游的超时配置
 
     Returns:
         API响应数据
     """
-    # Google Gemini API基础URL
-    base_url = "https://generativelanguage.googleapis.com/v1beta"
-
-    # 构建完整URL
-    url = f"{base_url}/models/gemini-2.5-flash-image-preview:{endpoint}?key={api_key}"
+    # 相对于gemini上游基础URL的路径
+    url = f"/models/gemini-2.5-flash-image-preview:{endpoint}"
 
     headers = {
         "Content-Type": "application/json"
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url,
-                headers=headers,
-                json=data,
-                timeout=timeout
-            )
-            response.raise_for_status()
-            return response.json()
-
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Gemini API请求失败: {str(e)}"
-            )
-        except httpx.HTTPStatusError as e:
-            error_detail = e.response.text
-            try:
-                error_json = e.response.json()
-                if "error" in error_json:
-                    error_detail = error_json["error"].get("message", error_detail)
-            except:
-                pass
+    client = get_http_client("gemini")
+    try:
+        response = await client.post(
+            url,
+            params={"key": api_key},
+            headers=headers,
+            json=data,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        )
+        response.raise_for_status()
+        return response.json()
 
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Gemini API错误 ({e.response.status_code}): {error_detail}"
-            )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Gemini API请求失败: {str(e)}"
+        )
+    except httpx.HTTPStatusError as e:
+        error_detail = e.response.text
+        try:
+            error_json = e.response.json()
+            if "error" in error_json:
+                error_detail = error_json["error"].get("message", error_detail)
+        except:
+            pass
 
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Gemini API错误 ({e.response.status_code}): {error_detail}"
+        )
 
-@router.post("/generate", response_model=ImageResponse)
-async def generate_image(
-    request: ImageGenerateRequest,
-    current_user: User = Depends(get_current_user)
-):
-    """
-    文本生成图像 (Text-to-Image)
 
-    使用Google Gemini 2.5 Flash Image Preview模型根据文本描述生成图像
-    """
-    # 检查API密钥
-    if not hasattr(current_user, 'google_api_key') or not current_user.google_api_key:
+def _check_google_api_key(user: User):
+    """检查用户是否配置了Google API密钥"""
+    if not hasattr(user, 'google_api_key') or not user.google_api_key:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="未配置Google API密钥。请在设置中添加Google API密钥。"
         )
 
-    # 验证参数
+def _validate_generate_request(request: ImageGenerateRequest):
+    """验证文本生成图像的参数"""
     if request.num_images < 1 or request.num_images > 4:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="num_images必须在1-4之间"
         )
 
+def _validate_edit_request(request: ImageEditRequest):
+    """验证图像编辑的输入图像"""
+    if not request.image_url and not request.image_base64:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="必须提供image_url或image_base64"
+        )
+
+async def _generate_images(api_key: str, request: ImageGenerateRequest) -> ImageResponse:
+    """调用Gemini根据文本描述生成图像"""
     # 构建Gemini API请求
     prompt_text = request.prompt
     if request.negative_prompt:
@@ -134,7 +137,7 @@ async def generate_image(
 
     # 调用Gemini API
     result = await call_gemini_api(
-        current_user.google_api_key,
+        api_key,
         "generateContent",
         gemini_request
     )
@@ -161,31 +164,23 @@ async def generate_image(
     )
 
 
-@router.post("/edit", response_model=ImageResponse)
-async def edit_image(
-    request: ImageEditRequest,
+@router.post("/generate", response_model=ImageResponse)
+async def generate_image(
+    request: ImageGenerateRequest,
     current_user: User = Depends(get_current_user)
 ):
     """
-    图像编辑 (Image-to-Image)
+    文本生成图像 (Text-to-Image)
 
-    使用Google Gemini 2.5 Flash Image Preview模型编辑现有图像
-    支持局部编辑、对象替换、背景更改等
+    使用Google Gemini 2.5 Flash Image Preview模型根据文本描述生成图像
     """
-    # 检查API密钥
-    if not hasattr(current_user, 'google_api_key') or not current_user.google_api_key:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="未配置Google API密钥。请在设置中添加Google API密钥。"
-        )
+    _check_google_api_key(current_user)
+    _validate_generate_request(request)
 
-    # 验证输入图像
-    if not request.image_url and not request.image_base64:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="必须提供image_url或image_base64"
-        )
+    return await _generate_images(current_user.google_api_key, request)
 
+async def _edit_image(api_key: str, request: ImageEditRequest) -> ImageResponse:
+    """调用Gemini按指令编辑图像"""
     # 准备图像数据
     image_data = None
     if request.image_base64:
@@ -197,22 +192,22 @@ async def edit_image(
         }
     elif request.image_url:
         # 下载图像并转换为base64
-        async with httpx.AsyncClient() as client:
-            try:
-                img_response = await client.get(request.image_url, timeout=30.0)
-                img_response.raise_for_status()
-                img_base64 = base64.b64encode(img_response.content).decode('utf-8')
-                image_data = {
-                    "inlineData": {
-                        "mimeType": img_response.headers.get("content-type", "image/jpeg"),
-                        "data": img_base64
-                    }
+        client = get_http_client()
+        try:
+            img_response = await client.get(request.image_url)
+            img_response.raise_for_status()
+            img_base64 = base64.b64encode(img_response.content).decode('utf-8')
+            image_data = {
+                "inlineData": {
+                    "mimeType": img_response.headers.get("content-type", "image/jpeg"),
+                    "data": img_base64
                 }
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"无法下载图像: {str(e)}"
-                )
+            }
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无法下载图像: {str(e)}"
+            )
 
     # 构建Gemini API请求
     parts = [
@@ -232,22 +227,22 @@ async def edit_image(
         })
     elif request.mask_url:
         # 下载蒙版图像
-        async with httpx.AsyncClient() as client:
-            try:
-                mask_response = await client.get(request.mask_url, timeout=30.0)
-                mask_response.raise_for_status()
-                mask_base64 = base64.b64encode(mask_response.content).decode('utf-8')
-                parts.insert(1, {
-                    "inlineData": {
-                        "mimeType": mask_response.headers.get("content-type", "image/png"),
-                        "data": mask_base64
-                    }
-                })
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"无法下载蒙版图像: {str(e)}"
-                )
+        client = get_http_client()
+        try:
+            mask_response = await client.get(request.mask_url)
+            mask_response.raise_for_status()
+            mask_base64 = base64.b64encode(mask_response.content).decode('utf-8')
+            parts.insert(1, {
+                "inlineData": {
+                    "mimeType": mask_response.headers.get("content-type", "image/png"),
+                    "data": mask_base64
+                }
+            })
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"无法下载蒙版图像: {str(e)}"
+            )
 
     gemini_request = {
         "contents": [{
@@ -262,7 +257,7 @@ async def edit_image(
 
     # 调用Gemini API
     result = await call_gemini_api(
-        current_user.google_api_key,
+        api_key,
         "generateContent",
         gemini_request,
         timeout=90.0  # 图像编辑可能需要更长时间
@@ -289,6 +284,85 @@ async def edit_image(
     )
 
 
+@router.post("/edit", response_model=ImageResponse)
+async def edit_image(
+    request: ImageEditRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    图像编辑 (Image-to-Image)
+
+    使用Google Gemini 2.5 Flash Image Preview模型编辑现有图像
+    支持局部编辑、对象替换、背景更改等
+    """
+    _check_google_api_key(current_user)
+    _validate_edit_request(request)
+
+    return await _edit_image(current_user.google_api_key, request)
+
+
+async def _run_image_job(ctx: JobContext) -> dict:
+    """后台图像生成/编辑任务：结果图片写入JSON文件，通过 /jobs/{job_id}/result 获取"""
+    user = await get_user_by_id(ctx.user_id)
+    if not user or not user.google_api_key:
+        raise JobError("未配置Google API密钥。请在设置中添加Google API密钥。")
+
+    if ctx.kind == "image_edit":
+        response = await _edit_image(user.google_api_key, ImageEditRequest(**ctx.payload))
+    else:
+        response = await _generate_images(user.google_api_key, ImageGenerateRequest(**ctx.payload))
+
+    path = ctx.create_result_file("images.json", "application/json")
+
+    def write_result():
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(response.model_dump_json())
+
+    await asyncio.to_thread(write_result)
+
+    await ctx.report(1, total=1)
+    return {'images': len(response.images)}
+
+job_queue.register("image_generate", _run_image_job)
+job_queue.register("image_edit", _run_image_job)
+
+async def _enqueue_image_job(user: User, kind: str, request: BaseModel) -> dict:
+    try:
+        return await job_queue.enqueue(
+            user.id, kind, request.model_dump(), priority=PRIORITY_INTERACTIVE, total=1
+        )
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+@router.post("/generate/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundJob)
+async def generate_image_job(
+    request: ImageGenerateRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    后台文本生成图像，立即返回任务信息
+    通过 GET /jobs/{job_id} 查询状态，完成后从 /jobs/{job_id}/result 获取与 /generate 相同格式的结果
+    """
+    _check_google_api_key(current_user)
+    _validate_generate_request(request)
+
+    return await _enqueue_image_job(current_user, "image_generate", request)
+
+@router.post("/edit/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=BackgroundJob)
+async def edit_image_job(
+    request: ImageEditRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    后台图像编辑，立即返回任务信息
+    通过 GET /jobs/{job_id} 查询状态，完成后从 /jobs/{job_id}/result 获取与 /edit 相同格式的结果
+    """
+    _check_google_api_key(current_user)
+    _validate_edit_request(request)
+
+    return await _enqueue_image_job(current_user, "image_edit", request)
+
+
 @router.get("/models")
 async def get_available_models():
     """获取可用的Nano Banana模型信息"""
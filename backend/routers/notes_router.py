@@ -1,22 +1,53 @@
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from database import notes_repo
-from auth import get_current_user
-from models import Note, NoteCreate, NoteUpdate, User
+from typing import List, Optional, Union
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+from database import async_notes_repo, run_in_db_executor
+from auth import get_current_user, get_current_user_id
+from models import Note, NoteSummary, NoteCreate, NoteUpdate, User
+from share_cache import share_view_cache
+from export_cache import export_cache
+from recommend_index import recommend_index
 
 router = APIRouter(prefix="/notes", tags=["notes"])
 
-@router.get("/", response_model=List[Note])
+@router.get("/", response_model=Union[List[Note], List[NoteSummary]])
 async def get_notes(
+    response: Response,
     folder_id: Optional[str] = Query(None, description="过滤指定文件夹的笔记，null获取未分类笔记"),
-    current_user: User = Depends(get_current_user)
+    limit: Optional[int] = Query(None, ge=1, le=200, description="每页数量，不传则返回全部"),
+    cursor: Optional[str] = Query(None, description="下一页游标（取自上一页响应头 X-Next-Cursor）"),
+    fields: str = Query("full", pattern="^(full|summary)$", description="full返回完整笔记，summary不含content只返回摘要"),
+    user_id: str = Depends(get_current_user_id)
 ):
-    notes_data = notes_repo.get_notes_by_user(current_user.id)
+    """
+    获取笔记列表
+    - 按 updated_at 倒序的游标分页，还有下一页时通过响应头 X-Next-Cursor 返回游标
+    - fields=summary 时不返回content，改为返回纯文本摘要snippet
+    """
+    try:
+        notes_data, next_cursor = await async_notes_repo.get_notes_page(
+            user_id,
+            limit=limit,
+            cursor=cursor,
+            folder_id=folder_id if folder_id != "null" else None,
+            uncategorized=folder_id == "null",
+            summary=fields == "summary"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    if fields == "summary":
+        return [NoteSummary(**note) for note in notes_data]
     return [Note(**note) for note in notes_data]
 
 @router.get("/{note_id}", response_model=Note)
-async def get_note(note_id: str, current_user: User = Depends(get_current_user)):
-    note_data = notes_repo.get_note_by_id(note_id, current_user.id)
+async def get_note(note_id: str, user_id: str = Depends(get_current_user_id)):
+    note_data = await async_notes_repo.get_note_by_id(note_id, user_id)
     
     if not note_data:
         raise HTTPException(
@@ -29,12 +60,14 @@ async def get_note(note_id: str, current_user: User = Depends(get_current_user))
 @router.post("/", response_model=Note)
 async def create_note(note: NoteCreate, current_user: User = Depends(get_current_user)):
     try:
-        created_note = notes_repo.create_note(
+        created_note = await async_notes_repo.create_note(
             title=note.title,
             content=note.content,
             tags=note.tags,
-            user_id=current_user.id
+            user_id=current_user.id,
+            folder_id=note.folder_id
         )
+        await run_in_db_executor(recommend_index.note_saved, current_user.id, created_note)
         return Note(**created_note)
     except Exception as e:
         raise HTTPException(
@@ -52,32 +85,42 @@ async def update_note(note_id: str, note_update: NoteUpdate, current_user: User
         update_data["content"] = note_update.content
     if note_update.tags is not None:
         update_data["tags"] = note_update.tags
+    if note_update.folder_id is not None:
+        update_data["folder_id"] = note_update.folder_id
     
-    updated_note = notes_repo.update_note(note_id, current_user.id, **update_data)
+    updated_note = await async_notes_repo.update_note(note_id, current_user.id, **update_data)
     if not updated_note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Note not found"
         )
+
+    # 笔记内容变化后，指向它的公开分享页需要重新渲染
+    share_view_cache.invalidate_note(note_id)
+    await run_in_db_executor(recommend_index.note_saved, current_user.id, updated_note)
     
     return Note(**updated_note)
 
 @router.delete("/{note_id}")
 async def delete_note(note_id: str, current_user: User = Depends(get_current_user)):
-    success = notes_repo.delete_note(note_id, current_user.id)
+    success = await async_notes_repo.delete_note(note_id, current_user.id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Note not found"
         )
 
+    share_view_cache.invalidate_note(note_id)
+    export_cache.invalidate_note(note_id)
+    await run_in_db_executor(recommend_index.note_deleted, current_user.id, note_id)
+
     return {"message": "Note deleted successfully"}
 
 @router.get("/search/query", response_model=List[Note])
 async def search_notes(
     q: str = Query(..., min_length=1, description="搜索关键词"),
     limit: int = Query(50, ge=1, le=100, description="返回结果数量限制"),
-    current_user: User = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """
     全文搜索笔记
@@ -85,7 +128,7 @@ async def search_notes(
     - 按相关度排序
     - 支持FTS5语法：AND、OR、NOT等
     """
-    notes_data = notes_repo.search_notes(current_user.id, q, limit)
+    notes_data = await async_notes_repo.search_notes(user_id, q, limit)
     return [Note(**note) for note in notes_data]
 
 # Phase 3.4 - 高级搜索功能
@@ -99,7 +142,7 @@ async def advanced_search_notes(
     sort_by: str = Query("updated_at", description="排序字段：updated_at, created_at, title"),
     sort_order: str = Query("desc", description="排序方向：asc, desc"),
     limit: int = Query(50, ge=1, le=200, description="返回结果数量限制"),
-    current_user: User = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """
     高级搜索笔记
@@ -138,8 +181,8 @@ async def advanced_search_notes(
 
     # 如果有搜索关键词，使用全文搜索
     if q:
-        notes_data = notes_repo.advanced_search(
-            user_id=current_user.id,
+        notes_data = await async_notes_repo.advanced_search(
+            user_id=user_id,
             query=q,
             filters=filters,
             sort_by=sort_by,
@@ -148,8 +191,8 @@ async def advanced_search_notes(
         )
     else:
         # 没有关键词，只按条件过滤
-        notes_data = notes_repo.filter_notes(
-            user_id=current_user.id,
+        notes_data = await async_notes_repo.filter_notes(
+            user_id=user_id,
             filters=filters,
             sort_by=sort_by,
             sort_order=sort_order,
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import List, Optional
+from datetime import datetime, timezone
 from auth import get_current_user
 from models import (
     User, Board, BoardCreate, BoardUpdate, BoardWithData,
     BoardList as ListModel, ListCreate, ListUpdate, ListWithCards,
     Card, CardCreate, CardUpdate, CardComment, CardCommentCreate
 )
-from database import board_repo, list_repo, card_repo, card_comment_repo
+from database import async_board_repo, async_list_repo, async_card_repo, async_card_comment_repo
 
 router = APIRouter(
     prefix="/api",
@@ -18,7 +19,7 @@ router = APIRouter(
 async def get_user_boards(current_user: User = Depends(get_current_user)):
     """获取用户的所有看板"""
     try:
-        boards = board_repo.get_boards_by_user(current_user.id)
+        boards = await async_board_repo.get_boards_by_user(current_user.id)
         return boards
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -27,7 +28,7 @@ async def get_user_boards(current_user: User = Depends(get_current_user)):
 async def create_board(board_data: BoardCreate, current_user: User = Depends(get_current_user)):
     """创建新看板"""
     try:
-        board = board_repo.create_board(
+        board = await async_board_repo.create_board(
             name=board_data.name,
             description=board_data.description,
             color=board_data.color,
@@ -37,13 +38,37 @@ async def create_board(board_data: BoardCreate, current_user: User = Depends(get
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _normalize_since(since: Optional[str]) -> Optional[str]:
+    """把客户端传入的时间转换为与数据库一致的UTC ISO格式，格式错误时抛出ValueError"""
+    if not since:
+        return None
+    value = datetime.fromisoformat(since.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec='microseconds') + 'Z'
+
 @router.get("/boards/{board_id}", response_model=BoardWithData)
-async def get_board_with_data(board_id: str, current_user: User = Depends(get_current_user)):
-    """获取看板及其完整数据（包含列表和卡片）"""
+async def get_board_with_data(
+    board_id: str,
+    response: Response,
+    since: Optional[str] = Query(None, description="只返回该时间之后变更的列表和卡片（ISO 8601），用于增量刷新"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取看板及其完整数据（包含列表和卡片）
+    响应头 X-Synced-At 为本次查询开始的服务器时间，可作为下次增量刷新的since
+    """
+    try:
+        since = _normalize_since(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since timestamp")
+
     try:
-        board = board_repo.get_board_with_data(board_id, current_user.id)
+        synced_at = datetime.utcnow().isoformat(timespec='microseconds') + 'Z'
+        board = await async_board_repo.get_board_with_data(board_id, current_user.id, since=since)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
+        response.headers["X-Synced-At"] = synced_at
         return board
     except HTTPException:
         raise
@@ -55,13 +80,13 @@ async def update_board(board_id: str, board_data: BoardUpdate, current_user: Use
     """更新看板"""
     try:
         # 验证看板存在且属于当前用户
-        existing_board = board_repo.get_board_by_id(board_id, current_user.id)
+        existing_board = await async_board_repo.get_board_by_id(board_id, current_user.id)
         if not existing_board:
             raise HTTPException(status_code=404, detail="Board not found")
         
         # 更新看板
         update_data = board_data.dict(exclude_unset=True)
-        updated_board = board_repo.update_board(board_id, current_user.id, **update_data)
+        updated_board = await async_board_repo.update_board(board_id, current_user.id, **update_data)
         return updated_board
     except HTTPException:
         raise
@@ -73,11 +98,11 @@ async def delete_board(board_id: str, current_user: User = Depends(get_current_u
     """删除看板"""
     try:
         # 验证看板存在且属于当前用户
-        existing_board = board_repo.get_board_by_id(board_id, current_user.id)
+        existing_board = await async_board_repo.get_board_by_id(board_id, current_user.id)
         if not existing_board:
             raise HTTPException(status_code=404, detail="Board not found")
         
-        success = board_repo.delete_board(board_id, current_user.id)
+        success = await async_board_repo.delete_board(board_id, current_user.id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete board")
         
@@ -93,18 +118,18 @@ async def create_list(board_id: str, list_data: ListCreate, current_user: User =
     """在指定看板下创建新列表"""
     try:
         # 验证看板存在且属于当前用户
-        board = board_repo.get_board_by_id(board_id, current_user.id)
+        board = await async_board_repo.get_board_by_id(board_id, current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
         # 如果没有指定位置，设置为最后
         if list_data.position is None:
             # 获取当前看板的最大位置
-            board_data = board_repo.get_board_with_data(board_id, current_user.id)
+            board_data = await async_board_repo.get_board_with_data(board_id, current_user.id)
             max_position = max([lst.get('position', 0) for lst in board_data['lists']], default=-1)
             list_data.position = max_position + 1
         
-        list_obj = list_repo.create_list(
+        list_obj = await async_list_repo.create_list(
             title=list_data.title,
             position=list_data.position,
             board_id=board_id
@@ -120,17 +145,17 @@ async def update_list(list_id: str, list_data: ListUpdate, current_user: User =
     """更新列表"""
     try:
         # 验证列表存在
-        existing_list = list_repo.get_list_by_id(list_id)
+        existing_list = await async_list_repo.get_list_by_id(list_id)
         if not existing_list:
             raise HTTPException(status_code=404, detail="List not found")
         
         # 验证列表所属看板是否属于当前用户
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
         update_data = list_data.dict(exclude_unset=True)
-        updated_list = list_repo.update_list(list_id, **update_data)
+        updated_list = await async_list_repo.update_list(list_id, **update_data)
         return updated_list
     except HTTPException:
         raise
@@ -142,16 +167,16 @@ async def delete_list(list_id: str, current_user: User = Depends(get_current_use
     """删除列表"""
     try:
         # 验证列表存在
-        existing_list = list_repo.get_list_by_id(list_id)
+        existing_list = await async_list_repo.get_list_by_id(list_id)
         if not existing_list:
             raise HTTPException(status_code=404, detail="List not found")
         
         # 验证列表所属看板是否属于当前用户
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
-        success = list_repo.delete_list(list_id)
+        success = await async_list_repo.delete_list(list_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete list")
         
@@ -167,19 +192,19 @@ async def create_card(list_id: str, card_data: CardCreate, current_user: User =
     """在指定列表下创建新卡片"""
     try:
         # 验证列表存在
-        existing_list = list_repo.get_list_by_id(list_id)
+        existing_list = await async_list_repo.get_list_by_id(list_id)
         if not existing_list:
             raise HTTPException(status_code=404, detail="List not found")
         
         # 验证列表所属看板是否属于当前用户
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
         # 如果没有指定位置，设置为最后
         if card_data.position is None:
             # 获取当前列表的最大位置
-            board_data = board_repo.get_board_with_data(existing_list['board_id'], current_user.id)
+            board_data = await async_board_repo.get_board_with_data(existing_list['board_id'], current_user.id)
             target_list = next((lst for lst in board_data['lists'] if lst['id'] == list_id), None)
             if target_list:
                 max_position = max([card.get('position', 0) for card in target_list['cards']], default=-1)
@@ -189,7 +214,7 @@ async def create_card(list_id: str, card_data: CardCreate, current_user: User =
         
         due_date_str = card_data.due_date.isoformat() + 'Z' if card_data.due_date else None
         
-        card = card_repo.create_card(
+        card = await async_card_repo.create_card(
             title=card_data.title,
             description=card_data.description,
             priority=card_data.priority.value,
@@ -210,13 +235,13 @@ async def update_card(card_id: str, card_data: CardUpdate, current_user: User =
     """更新卡片"""
     try:
         # 验证卡片存在
-        existing_card = card_repo.get_card_by_id(card_id)
+        existing_card = await async_card_repo.get_card_by_id(card_id)
         if not existing_card:
             raise HTTPException(status_code=404, detail="Card not found")
         
         # 验证卡片所属看板是否属于当前用户
-        existing_list = list_repo.get_list_by_id(existing_card['list_id'])
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        existing_list = await async_list_repo.get_list_by_id(existing_card['list_id'])
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
@@ -230,7 +255,7 @@ async def update_card(card_id: str, card_data: CardUpdate, current_user: User =
         if 'priority' in update_data and update_data['priority']:
             update_data['priority'] = update_data['priority'].value
         
-        updated_card = card_repo.update_card(card_id, **update_data)
+        updated_card = await async_card_repo.update_card(card_id, **update_data)
         return updated_card
     except HTTPException:
         raise
@@ -242,17 +267,17 @@ async def delete_card(card_id: str, current_user: User = Depends(get_current_use
     """删除卡片"""
     try:
         # 验证卡片存在
-        existing_card = card_repo.get_card_by_id(card_id)
+        existing_card = await async_card_repo.get_card_by_id(card_id)
         if not existing_card:
             raise HTTPException(status_code=404, detail="Card not found")
         
         # 验证卡片所属看板是否属于当前用户
-        existing_list = list_repo.get_list_by_id(existing_card['list_id'])
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        existing_list = await async_list_repo.get_list_by_id(existing_card['list_id'])
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
-        success = card_repo.delete_card(card_id)
+        success = await async_card_repo.delete_card(card_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete card")
         
@@ -268,17 +293,17 @@ async def create_card_comment(card_id: str, comment_data: CardCommentCreate, cur
     """为卡片添加评论"""
     try:
         # 验证卡片存在
-        existing_card = card_repo.get_card_by_id(card_id)
+        existing_card = await async_card_repo.get_card_by_id(card_id)
         if not existing_card:
             raise HTTPException(status_code=404, detail="Card not found")
         
         # 验证卡片所属看板是否属于当前用户
-        existing_list = list_repo.get_list_by_id(existing_card['list_id'])
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        existing_list = await async_list_repo.get_list_by_id(existing_card['list_id'])
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
-        comment = card_comment_repo.create_comment(
+        comment = await async_card_comment_repo.create_comment(
             card_id=card_id,
             content=comment_data.content,
             user_id=current_user.id
@@ -294,17 +319,17 @@ async def get_card_comments(card_id: str, current_user: User = Depends(get_curre
     """获取卡片的所有评论"""
     try:
         # 验证卡片存在
-        existing_card = card_repo.get_card_by_id(card_id)
+        existing_card = await async_card_repo.get_card_by_id(card_id)
         if not existing_card:
             raise HTTPException(status_code=404, detail="Card not found")
         
         # 验证卡片所属看板是否属于当前用户
-        existing_list = list_repo.get_list_by_id(existing_card['list_id'])
-        board = board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
+        existing_list = await async_list_repo.get_list_by_id(existing_card['list_id'])
+        board = await async_board_repo.get_board_by_id(existing_list['board_id'], current_user.id)
         if not board:
             raise HTTPException(status_code=404, detail="Board not found")
         
-        comments = card_comment_repo.get_comments_by_card(card_id)
+        comments = await async_card_comment_repo.get_comments_by_card(card_id)
         return comments
     except HTTPException:
         raise
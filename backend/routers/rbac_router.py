@@ -4,18 +4,32 @@ RBAC权限管理路由
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from datetime import datetime
+from typing import List, Optional
 from pydantic import BaseModel
 
 from auth import get_current_user, require_role, require_permission
 from models import User
-from database import get_connection
+from database import async_rbac_repo, async_user_repo
 from middleware import rbac_checker
-import uuid
+from rbac_time import format_grant_expiry
 
 router = APIRouter(prefix="/api/rbac", tags=["RBAC权限管理"])
 
+def _normalize_expires_at(expires_at: Optional[str]) -> Optional[str]:
+    """
+    把授权过期时间统一为与 assigned_at 相同的UTC格式（精确到微秒，以Z结尾）
+    过期授权的批量清理按字符串比较，依赖这一格式；无法解析时返回400
+    """
+    if not expires_at:
+        return None
+    try:
+        return format_grant_expiry(expires_at)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="expires_at 必须是ISO 8601格式的时间"
+        )
+
 # ===== Pydantic 模型 =====
 
 class RoleResponse(BaseModel):
@@ -64,19 +78,7 @@ async def get_all_roles(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """获取所有角色列表(需要roles.manage权限)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT * FROM roles ORDER BY level DESC
-        ''')
-
-        roles = [dict(row) for row in cursor.fetchall()]
-        return roles
-
-    finally:
-        conn.close()
+    return await async_rbac_repo.get_roles()
 
 @router.get("/roles/{role_id}", response_model=RoleResponse)
 async def get_role(
@@ -84,23 +86,15 @@ async def get_role(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """获取单个角色详情"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('SELECT * FROM roles WHERE id = ?', (role_id,))
-        role = cursor.fetchone()
-
-        if not role:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="角色不存在"
-            )
+    role = await async_rbac_repo.get_role(role_id)
 
-        return dict(role)
+    if not role:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="角色不存在"
+        )
 
-    finally:
-        conn.close()
+    return role
 
 @router.get("/roles/{role_id}/permissions", response_model=List[PermissionResponse])
 async def get_role_permissions(
@@ -108,22 +102,7 @@ async def get_role_permissions(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """获取角色拥有的所有权限"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT p.*
-            FROM role_permissions rp
-            JOIN permissions p ON rp.permission_id = p.id
-            WHERE rp.role_id = ?
-        ''', (role_id,))
-
-        permissions = [dict(row) for row in cursor.fetchall()]
-        return permissions
-
-    finally:
-        conn.close()
+    return await async_rbac_repo.get_role_permissions(role_id)
 
 # ===== 权限管理接口 =====
 
@@ -132,19 +111,7 @@ async def get_all_permissions(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """获取所有权限列表"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT * FROM permissions ORDER BY resource, action
-        ''')
-
-        permissions = [dict(row) for row in cursor.fetchall()]
-        return permissions
-
-    finally:
-        conn.close()
+    return await async_rbac_repo.get_permissions()
 
 @router.get("/permissions/by-resource/{resource}")
 async def get_permissions_by_resource(
@@ -152,19 +119,7 @@ async def get_permissions_by_resource(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """按资源获取权限"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT * FROM permissions WHERE resource = ?
-        ''', (resource,))
-
-        permissions = [dict(row) for row in cursor.fetchall()]
-        return permissions
-
-    finally:
-        conn.close()
+    return await async_rbac_repo.get_permissions_by_resource(resource)
 
 # ===== 用户角色管理接口 =====
 
@@ -175,47 +130,33 @@ async def assign_role_to_user(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """为用户分配角色"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    expires_at = _normalize_expires_at(assignment.expires_at)
 
-    try:
-        # 检查用户是否存在
-        cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-        if not cursor.fetchone():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-
-        # 检查角色是否存在
-        cursor.execute('SELECT id FROM roles WHERE id = ?', (assignment.role_id,))
-        if not cursor.fetchone():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="角色不存在"
-            )
-
-        # 分配角色
-        now = datetime.utcnow().isoformat() + 'Z'
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_roles
-            (user_id, role_id, assigned_at, assigned_by, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, assignment.role_id, now, current_user.id, assignment.expires_at))
-
-        conn.commit()
-
-        # 清除用户权限缓存
-        rbac_checker.clear_user_cache(user_id)
-
-        return {
-            "message": "角色分配成功",
-            "user_id": user_id,
-            "role_id": assignment.role_id
-        }
-
-    finally:
-        conn.close()
+    # 检查用户是否存在
+    if not await async_user_repo.get_user_by_id(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户不存在"
+        )
+
+    # 检查角色是否存在
+    if not await async_rbac_repo.get_role(assignment.role_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="角色不存在"
+        )
+
+    # 分配角色
+    await async_rbac_repo.assign_role(user_id, assignment.role_id, current_user.id, expires_at)
+
+    # 清除用户权限缓存
+    rbac_checker.clear_user_cache(user_id)
+
+    return {
+        "message": "角色分配成功",
+        "user_id": user_id,
+        "role_id": assignment.role_id
+    }
 
 @router.delete("/users/{user_id}/roles/{role_id}")
 async def revoke_role_from_user(
@@ -224,34 +165,20 @@ async def revoke_role_from_user(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """撤销用户的角色"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            DELETE FROM user_roles
-            WHERE user_id = ? AND role_id = ?
-        ''', (user_id, role_id))
-
-        if cursor.rowcount == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户角色关联不存在"
-            )
-
-        conn.commit()
-
-        # 清除用户权限缓存
-        rbac_checker.clear_user_cache(user_id)
+    if not await async_rbac_repo.revoke_role(user_id, role_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户角色关联不存在"
+        )
 
-        return {
-            "message": "角色撤销成功",
-            "user_id": user_id,
-            "role_id": role_id
-        }
+    # 清除用户权限缓存
+    rbac_checker.clear_user_cache(user_id)
 
-    finally:
-        conn.close()
+    return {
+        "message": "角色撤销成功",
+        "user_id": user_id,
+        "role_id": role_id
+    }
 
 @router.get("/users/{user_id}/roles")
 async def get_user_roles(
@@ -260,13 +187,15 @@ async def get_user_roles(
 ):
     """获取用户的所有角色"""
     # 只能查看自己的角色或需要roles.manage权限
-    if current_user.id != user_id and not rbac_checker.has_permission(current_user.id, "roles.manage"):
+    if current_user.id != user_id and not await rbac_checker.run(
+        rbac_checker.has_permission, current_user.id, "roles.manage"
+    ):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="无权查看其他用户的角色"
         )
 
-    roles = rbac_checker.get_user_roles(user_id)
+    roles = await rbac_checker.run(rbac_checker.get_user_roles, user_id)
     return {"user_id": user_id, "roles": roles}
 
 # ===== 用户权限管理接口 =====
@@ -278,47 +207,33 @@ async def grant_permission_to_user(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """直接为用户授予权限(特殊情况使用)"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    expires_at = _normalize_expires_at(grant.expires_at)
 
-    try:
-        # 检查用户是否存在
-        cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-        if not cursor.fetchone():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-
-        # 检查权限是否存在
-        cursor.execute('SELECT id FROM permissions WHERE id = ?', (grant.permission_id,))
-        if not cursor.fetchone():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="权限不存在"
-            )
-
-        # 授予权限
-        now = datetime.utcnow().isoformat() + 'Z'
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_permissions
-            (user_id, permission_id, granted_at, granted_by, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, grant.permission_id, now, current_user.id, grant.expires_at))
-
-        conn.commit()
-
-        # 清除用户权限缓存
-        rbac_checker.clear_user_cache(user_id)
-
-        return {
-            "message": "权限授予成功",
-            "user_id": user_id,
-            "permission_id": grant.permission_id
-        }
-
-    finally:
-        conn.close()
+    # 检查用户是否存在
+    if not await async_user_repo.get_user_by_id(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户不存在"
+        )
+
+    # 检查权限是否存在
+    if not await async_rbac_repo.get_permission(grant.permission_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="权限不存在"
+        )
+
+    # 授予权限
+    await async_rbac_repo.grant_permission(user_id, grant.permission_id, current_user.id, expires_at)
+
+    # 清除用户权限缓存
+    rbac_checker.clear_user_cache(user_id)
+
+    return {
+        "message": "权限授予成功",
+        "user_id": user_id,
+        "permission_id": grant.permission_id
+    }
 
 @router.delete("/users/{user_id}/permissions/{permission_id}")
 async def revoke_permission_from_user(
@@ -327,34 +242,32 @@ async def revoke_permission_from_user(
     current_user: User = Depends(require_permission("roles.manage"))
 ):
     """撤销用户的直接权限"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            DELETE FROM user_permissions
-            WHERE user_id = ? AND permission_id = ?
-        ''', (user_id, permission_id))
-
-        if cursor.rowcount == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户权限关联不存在"
-            )
+    if not await async_rbac_repo.revoke_permission(user_id, permission_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="用户权限关联不存在"
+        )
 
-        conn.commit()
+    # 清除用户权限缓存
+    rbac_checker.clear_user_cache(user_id)
 
-        # 清除用户权限缓存
-        rbac_checker.clear_user_cache(user_id)
+    return {
+        "message": "权限撤销成功",
+        "user_id": user_id,
+        "permission_id": permission_id
+    }
 
-        return {
-            "message": "权限撤销成功",
-            "user_id": user_id,
-            "permission_id": permission_id
-        }
+async def _permission_summary(user_id: str) -> dict:
+    """用户的角色、权限和最高角色级别（第一次检查加载缓存后，其余检查都在内存中完成）"""
+    roles = await rbac_checker.run(rbac_checker.get_user_roles, user_id)
+    permissions = list(await rbac_checker.run(rbac_checker.get_user_permissions, user_id))
+    role_level = await rbac_checker.run(rbac_checker.get_highest_role_level, user_id)
 
-    finally:
-        conn.close()
+    return {
+        "roles": roles,
+        "permissions": permissions,
+        "role_level": role_level
+    }
 
 @router.get("/users/{user_id}/permissions", response_model=UserPermissionsResponse)
 async def get_user_permissions(
@@ -363,22 +276,15 @@ async def get_user_permissions(
 ):
     """获取用户的所有权限(包括角色权限和直接权限)"""
     # 只能查看自己的权限或需要roles.manage权限
-    if current_user.id != user_id and not rbac_checker.has_permission(current_user.id, "roles.manage"):
+    if current_user.id != user_id and not await rbac_checker.run(
+        rbac_checker.has_permission, current_user.id, "roles.manage"
+    ):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="无权查看其他用户的权限"
         )
 
-    roles = rbac_checker.get_user_roles(user_id)
-    permissions = list(rbac_checker.get_user_permissions(user_id))
-    role_level = rbac_checker.get_highest_role_level(user_id)
-
-    return {
-        "user_id": user_id,
-        "roles": roles,
-        "permissions": permissions,
-        "role_level": role_level
-    }
+    return {"user_id": user_id, **await _permission_summary(user_id)}
 
 # ===== 当前用户权限查询接口 =====
 
@@ -387,16 +293,10 @@ async def get_my_permissions(
     current_user: User = Depends(get_current_user)
 ):
     """获取当前用户的所有权限"""
-    roles = rbac_checker.get_user_roles(current_user.id)
-    permissions = list(rbac_checker.get_user_permissions(current_user.id))
-    role_level = rbac_checker.get_highest_role_level(current_user.id)
-
     return {
         "user_id": current_user.id,
         "email": current_user.email,
-        "roles": roles,
-        "permissions": permissions,
-        "role_level": role_level
+        **await _permission_summary(current_user.id)
     }
 
 @router.get("/me/check-permission/{permission}")
@@ -405,7 +305,7 @@ async def check_my_permission(
     current_user: User = Depends(get_current_user)
 ):
     """检查当前用户是否拥有指定权限"""
-    has_perm = rbac_checker.has_permission(current_user.id, permission)
+    has_perm = await rbac_checker.run(rbac_checker.has_permission, current_user.id, permission)
 
     return {
         "permission": permission,
@@ -418,7 +318,7 @@ async def check_my_role(
     current_user: User = Depends(get_current_user)
 ):
     """检查当前用户是否拥有指定角色"""
-    has_role = rbac_checker.has_role(current_user.id, role_name)
+    has_role = await rbac_checker.run(rbac_checker.has_role, current_user.id, role_name)
 
     return {
         "role_name": role_name,
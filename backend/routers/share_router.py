@@ -2,10 +2,14 @@
 笔记分享和评论路由
 提供笔记分享链接生成、公开访问和评论功能
 """
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from auth import get_current_user
+from database import async_notes_repo, async_share_repo
+from share_cache import (
+    CachedShareView, share_view_cache, view_count_buffer, make_share_etag, etag_matches
+)
 from models import (
     User, NoteShareCreate, NoteShare, NoteSharePublic,
     SharedNoteView, Comment, CommentCreate, CommentUpdate
@@ -15,9 +19,8 @@ import hashlib
 
 router = APIRouter(prefix="/share", tags=["share"])
 
-# 临时内存存储（实际应使用数据库）
-shares_db = {}
-comments_db = {}
+# 分享页随笔记一起返回的首页评论数，更多评论通过评论分页接口加载
+COMMENTS_PAGE_SIZE = 50
 
 def generate_share_token():
     """生成唯一的分享token"""
@@ -27,6 +30,99 @@ def hash_password(password: str) -> str:
     """哈希密码"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def _to_utc_iso(value: Optional[datetime]) -> Optional[str]:
+    """将时间统一转换为UTC ISO字符串存储（无时区信息的时间按UTC处理）"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat() + 'Z'
+
+def _is_expired(share: dict) -> bool:
+    """检查分享是否已过期"""
+    expires_at = share.get('expires_at')
+    if not expires_at:
+        return False
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) > expires_at
+
+def _check_share_access(share: Optional[dict], password: Optional[str]):
+    """校验分享的存在性、过期时间和访问密码"""
+    if not share:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="分享链接不存在或已失效"
+        )
+
+    # 检查是否过期
+    if _is_expired(share):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="分享链接已过期"
+        )
+
+    # 检查密码
+    if share['password']:
+        if not password:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="需要提供访问密码"
+            )
+        if hash_password(password) != share['password']:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="密码错误"
+            )
+
+async def _get_accessible_share(share_token: str, password: Optional[str]) -> dict:
+    """获取可公开访问的分享"""
+    share = await async_share_repo.get_share_by_token(share_token)
+    _check_share_access(share, password)
+    return share
+
+def _cache_headers(share: dict, etag: str) -> dict:
+    """公开分享可被CDN缓存；带密码的分享只允许浏览器缓存，且每次需重新验证"""
+    if share['password']:
+        cache_control = "private, no-cache"
+    else:
+        cache_control = f"public, max-age=0, s-maxage={int(share_view_cache.ttl)}, must-revalidate"
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+async def _render_shared_note(share_token: str) -> Optional[CachedShareView]:
+    """查询分享、笔记和首页评论并序列化为响应体；分享或笔记不存在时返回None"""
+    share = await async_share_repo.get_share_by_token(share_token)
+    if not share:
+        return None
+
+    note = await async_notes_repo.get_note_by_id(share['note_id'], share['user_id'])
+    if not note:
+        return None
+
+    comments, next_cursor = await async_share_repo.get_comments_page(share_token, COMMENTS_PAGE_SIZE)
+
+    view = SharedNoteView(
+        note=note,
+        share_info=NoteSharePublic(
+            id=share['id'],
+            note_id=share['note_id'],
+            permission=share['permission'],
+            # 查看次数是渲染时的快照，包含尚未写入数据库的计数
+            view_count=share['view_count'] + view_count_buffer.pending(share_token),
+            created_at=share['created_at']
+        ),
+        comments=[Comment(**c) for c in comments]
+    )
+
+    return CachedShareView(
+        share=share,
+        body=view.model_dump_json().encode('utf-8'),
+        etag=make_share_etag(share_token, str(note['updated_at']), share['permission'], comments, next_cursor),
+        next_cursor=next_cursor
+    )
+
 @router.post("/notes/{note_id}", response_model=NoteShare)
 async def create_share_link(
     note_id: str,
@@ -37,9 +133,8 @@ async def create_share_link(
     创建笔记分享链接
     需要用户登录并拥有该笔记
     """
-    # 验证笔记所有权
-    from database import notes_repo
-    note = notes_repo.get_note(note_id)
+    # 验证笔记所有权（按当前用户查询，不属于该用户的笔记视为不存在）
+    note = await async_notes_repo.get_note_by_id(note_id, current_user.id)
 
     if not note:
         raise HTTPException(
@@ -47,99 +142,81 @@ async def create_share_link(
             detail="笔记不存在"
         )
 
-    if note['user_id'] != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="无权限分享此笔记"
-        )
-
     # 生成分享记录
-    share_token = generate_share_token()
-    share_id = secrets.token_urlsafe(16)
-
-    share = {
-        'id': share_id,
-        'note_id': note_id,
-        'user_id': current_user.id,
-        'share_token': share_token,
-        'permission': share_data.permission,
-        'expires_at': share_data.expires_at,
-        'password': hash_password(share_data.password) if share_data.password else None,
-        'view_count': 0,
-        'created_at': datetime.now(),
-        'updated_at': datetime.now()
-    }
-
-    shares_db[share_token] = share
+    share = await async_share_repo.create_share(
+        note_id=note_id,
+        user_id=current_user.id,
+        share_token=generate_share_token(),
+        permission=share_data.permission.value,
+        expires_at=_to_utc_iso(share_data.expires_at),
+        password=hash_password(share_data.password) if share_data.password else None
+    )
 
     return NoteShare(**share)
 
 @router.get("/view/{share_token}", response_model=SharedNoteView)
 async def get_shared_note(
     share_token: str,
+    request: Request,
     password: Optional[str] = None
 ):
     """
     通过分享链接查看笔记（无需登录）
+    随笔记返回第一页评论，更多评论的游标通过响应头 X-Next-Cursor 返回
+    渲染结果按token缓存，支持 If-None-Match 条件请求（命中时返回304）
     """
-    share = shares_db.get(share_token)
+    cached = share_view_cache.get(share_token)
+    if cached is None:
+        cached = await _render_shared_note(share_token)
+        if cached is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="分享链接不存在或已失效"
+            )
+        share_view_cache.set(share_token, cached)
 
-    if not share:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="分享链接不存在或已失效"
-        )
+    # 过期时间和密码每次都要校验，不受缓存影响
+    _check_share_access(cached.share, password)
 
-    # 检查是否过期
-    if share['expires_at'] and datetime.now() > share['expires_at']:
-        raise HTTPException(
-            status_code=status.HTTP_410_GONE,
-            detail="分享链接已过期"
-        )
+    # 查看次数在内存中合并，由后台任务批量写入
+    view_count_buffer.add(share_token)
 
-    # 检查密码
-    if share['password']:
-        if not password:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="需要提供访问密码"
-            )
-        if hash_password(password) != share['password']:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="密码错误"
-            )
+    headers = _cache_headers(cached.share, cached.etag)
 
-    # 增加查看次数
-    share['view_count'] += 1
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    # 获取笔记内容
-    from database import notes_repo
-    note = notes_repo.get_note(share['note_id'])
+    if cached.next_cursor:
+        headers["X-Next-Cursor"] = cached.next_cursor
 
-    if not note:
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+@router.get("/view/{share_token}/comments", response_model=List[Comment])
+async def get_shared_note_comments(
+    share_token: str,
+    response: Response,
+    password: Optional[str] = None,
+    limit: int = Query(COMMENTS_PAGE_SIZE, ge=1, le=200, description="每页评论数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 返回的游标")
+):
+    """
+    分页获取分享笔记的评论（按时间正序）
+    下一页游标通过响应头 X-Next-Cursor 返回，没有更多评论时不返回该响应头
+    """
+    await _get_accessible_share(share_token, password)
+
+    try:
+        comments, next_cursor = await async_share_repo.get_comments_page(share_token, limit, cursor)
+    except ValueError:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="笔记不存在"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
         )
 
-    # 获取评论
-    note_comments = [
-        Comment(**c) for c in comments_db.values()
-        if c['share_token'] == share_token
-    ]
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
-    return SharedNoteView(
-        note=note,
-        share_info=NoteSharePublic(
-            id=share['id'],
-            note_id=share['note_id'],
-            permission=share['permission'],
-            view_count=share['view_count'],
-            created_at=share['created_at']
-        ),
-        comments=note_comments
-    )
+    return [Comment(**c) for c in comments]
 
 @router.post("/view/{share_token}/comments", response_model=Comment)
 async def add_comment(
@@ -151,9 +228,9 @@ async def add_comment(
     添加评论到分享的笔记
     游客和登录用户都可以评论
     """
-    share = shares_db.get(share_token)
+    share = await async_share_repo.get_share_by_token(share_token)
 
-    if not share:
+    if not share or _is_expired(share):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="分享链接不存在"
@@ -167,20 +244,15 @@ async def add_comment(
         )
 
     # 创建评论
-    comment_id = secrets.token_urlsafe(16)
-    comment = {
-        'id': comment_id,
-        'note_id': share['note_id'],
-        'share_token': share_token,
-        'content': comment_data.content,
-        'author_name': comment_data.author_name or "匿名",
-        'author_email': comment_data.author_email,
-        'user_id': current_user.id if current_user else None,
-        'created_at': datetime.now(),
-        'updated_at': datetime.now()
-    }
-
-    comments_db[comment_id] = comment
+    comment = await async_share_repo.create_comment(
+        share_token=share_token,
+        note_id=share['note_id'],
+        content=comment_data.content,
+        author_name=comment_data.author_name or "匿名",
+        author_email=comment_data.author_email,
+        user_id=current_user.id if current_user else None
+    )
+    share_view_cache.invalidate(share_token)
 
     return Comment(**comment)
 
@@ -189,12 +261,9 @@ async def get_my_shares(current_user: User = Depends(get_current_user)):
     """
     获取当前用户创建的所有分享链接
     """
-    user_shares = [
-        NoteShare(**s) for s in shares_db.values()
-        if s['user_id'] == current_user.id
-    ]
+    shares = await async_share_repo.get_shares_by_user(current_user.id)
 
-    return user_shares
+    return [NoteShare(**s) for s in shares]
 
 @router.delete("/{share_id}")
 async def delete_share(
@@ -204,37 +273,24 @@ async def delete_share(
     """
     删除分享链接
     """
-    # 查找要删除的分享
-    share_to_delete = None
-    token_to_delete = None
-
-    for token, share in shares_db.items():
-        if share['id'] == share_id:
-            if share['user_id'] != current_user.id:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="无权限删除此分享"
-                )
-            share_to_delete = share
-            token_to_delete = token
-            break
-
-    if not share_to_delete:
+    share = await async_share_repo.get_share_by_id(share_id)
+
+    if not share:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="分享不存在"
         )
 
-    # 删除分享和相关评论
-    del shares_db[token_to_delete]
+    if share['user_id'] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权限删除此分享"
+        )
 
-    # 删除相关评论
-    comments_to_delete = [
-        cid for cid, c in comments_db.items()
-        if c['share_token'] == token_to_delete
-    ]
-    for cid in comments_to_delete:
-        del comments_db[cid]
+    # 删除分享，相关评论随外键级联删除
+    await async_share_repo.delete_share(share_id, current_user.id)
+    share_view_cache.invalidate(share['share_token'])
+    view_count_buffer.discard(share['share_token'])
 
     return {"success": True, "message": "分享链接已删除"}
 
@@ -246,7 +302,7 @@ async def delete_comment(
     """
     删除评论（仅笔记所有者或评论者本人可删除）
     """
-    comment = comments_db.get(comment_id)
+    comment = await async_share_repo.get_comment_by_id(comment_id)
 
     if not comment:
         raise HTTPException(
@@ -255,7 +311,7 @@ async def delete_comment(
         )
 
     # 检查权限
-    share = shares_db.get(comment['share_token'])
+    share = await async_share_repo.get_share_by_token(comment['share_token'])
     if not share:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -272,6 +328,7 @@ async def delete_comment(
             detail="无权限删除此评论"
         )
 
-    del comments_db[comment_id]
+    await async_share_repo.delete_comment(comment_id)
+    share_view_cache.invalidate(comment['share_token'])
 
     return {"success": True, "message": "评论已删除"}
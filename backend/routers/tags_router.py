@@ -4,10 +4,11 @@
 """
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List, Dict
-from database import notes_repo
+from database import async_notes_repo
 from auth import get_current_user
 from models import User
-from collections import Counter
+from share_cache import share_view_cache
+from recommend_index import recommend_index
 
 router = APIRouter(prefix="/tags", tags=["tags"])
 
@@ -18,37 +19,23 @@ async def get_tags_statistics(current_user: User = Depends(get_current_user)):
     返回所有标签及其使用次数，按使用频率排序
     """
     try:
-        # 获取用户的所有笔记
-        notes = notes_repo.get_notes_by_user(current_user.id)
+        # 标签使用次数由数据库GROUP BY统计
+        tag_stats = await async_notes_repo.get_tag_stats(current_user.id)
 
-        # 收集所有标签
-        all_tags = []
-
-        # 从笔记中提取标签
-        for note in notes:
-            if note.get('tags'):
-                all_tags.extend(note['tags'])
-
-        # 统计标签使用频率
-        tag_counter = Counter(all_tags)
-
-        # 构建统计结果
+        # 构建统计结果（标签在每篇笔记中只计一次，total_count与notes_count相同）
         stats = []
-        for tag, count in tag_counter.most_common():
-            # 计算该标签在笔记中的分布
-            notes_count = sum(1 for note in notes if tag in note.get('tags', []))
-
+        for item in tag_stats:
             stats.append({
-                'tag': tag,
-                'total_count': count,
-                'notes_count': notes_count,
+                'tag': item['tag'],
+                'total_count': item['notes_count'],
+                'notes_count': item['notes_count'],
                 'todos_count': 0,  # 待办事项功能待实现
-                'color': _get_tag_color(tag)  # 为标签分配颜色
+                'color': _get_tag_color(item['tag'])  # 为标签分配颜色
             })
 
         return {
-            'total_tags': len(tag_counter),
-            'total_usages': sum(tag_counter.values()),
+            'total_tags': len(stats),
+            'total_usages': sum(item['total_count'] for item in stats),
             'tags': stats
         }
 
@@ -81,20 +68,16 @@ async def rename_tag(
         )
 
     try:
-        updated_notes = 0
-
-        # 更新笔记中的标签
-        notes = notes_repo.get_notes_by_user(current_user.id)
-        for note in notes:
-            if old_tag in note.get('tags', []):
-                new_tags = [new_tag if t == old_tag else t for t in note['tags']]
-                notes_repo.update_note(note['id'], tags=new_tags)
-                updated_notes += 1
+        # 一次集合操作更新所有包含旧标签的笔记
+        result = await async_notes_repo.replace_tags(current_user.id, [old_tag], new_tag)
+        share_view_cache.invalidate_user(current_user.id)
+        recommend_index.invalidate_user(current_user.id)
 
         return {
             'success': True,
             'message': f'成功将标签 "{old_tag}" 重命名为 "{new_tag}"',
-            'updated_notes': updated_notes,
+            'updated_notes': result['updated_notes'],
+            'updated_tag_usages': result['tag_usages'],
             'updated_todos': 0
         }
 
@@ -127,27 +110,16 @@ async def merge_tags(
         )
 
     try:
-        updated_notes = 0
-
-        # 更新笔记中的标签
-        notes = notes_repo.get_notes_by_user(current_user.id)
-        for note in notes:
-            tags = note.get('tags', [])
-            has_source = any(tag in source_tags for tag in tags)
-
-            if has_source:
-                # 移除所有源标签，添加目标标签（避免重复）
-                new_tags = [t for t in tags if t not in source_tags]
-                if target_tag not in new_tags:
-                    new_tags.append(target_tag)
-
-                notes_repo.update_note(note['id'], tags=new_tags)
-                updated_notes += 1
+        # 移除所有源标签并添加目标标签（避免重复）
+        result = await async_notes_repo.replace_tags(current_user.id, source_tags, target_tag)
+        share_view_cache.invalidate_user(current_user.id)
+        recommend_index.invalidate_user(current_user.id)
 
         return {
             'success': True,
             'message': f'成功将 {len(source_tags)} 个标签合并为 "{target_tag}"',
-            'updated_notes': updated_notes,
+            'updated_notes': result['updated_notes'],
+            'updated_tag_usages': result['tag_usages'],
             'updated_todos': 0
         }
 
@@ -173,20 +145,16 @@ async def delete_tag(
         )
 
     try:
-        updated_notes = 0
-
-        # 从笔记中删除标签
-        notes = notes_repo.get_notes_by_user(current_user.id)
-        for note in notes:
-            if tag in note.get('tags', []):
-                new_tags = [t for t in note['tags'] if t != tag]
-                notes_repo.update_note(note['id'], tags=new_tags)
-                updated_notes += 1
+        # 从所有笔记中删除标签
+        result = await async_notes_repo.replace_tags(current_user.id, [tag])
+        share_view_cache.invalidate_user(current_user.id)
+        recommend_index.invalidate_user(current_user.id)
 
         return {
             'success': True,
             'message': f'成功删除标签 "{tag}"',
-            'updated_notes': updated_notes,
+            'updated_notes': result['updated_notes'],
+            'updated_tag_usages': result['tag_usages'],
             'updated_todos': 0
         }
 
@@ -206,22 +174,15 @@ async def get_tag_suggestions(
     基于用户历史标签和文本内容推荐标签
     """
     try:
-        # 获取用户的所有历史标签
-        notes = notes_repo.get_notes_by_user(current_user.id)
-
-        all_tags = []
-        for note in notes:
-            if note.get('tags'):
-                all_tags.extend(note['tags'])
-
-        # 统计标签频率
-        tag_counter = Counter(all_tags)
+        # 获取用户历史标签的使用频率（已按频率倒序）
+        tag_stats = await async_notes_repo.get_tag_stats(current_user.id)
 
         # 基于文本内容的智能匹配（简单实现）
         suggestions = []
         text_lower = text.lower()
 
-        for tag, count in tag_counter.most_common(20):
+        for item in tag_stats[:20]:
+            tag, count = item['tag'], item['notes_count']
             # 如果文本包含标签关键词，提高优先级
             score = count
             if tag.lower() in text_lower:
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 import re
-from database import user_repo
+from database import async_user_repo
 from auth import get_current_user
 from models import User, UserUpdate
+from user_cache import user_cache
 
 router = APIRouter(prefix="/user", tags=["user"])
 
@@ -41,11 +42,13 @@ async def update_user_profile(
     if not update_data:
         return current_user
     
-    updated_user = user_repo.update_user(current_user.id, **update_data)
+    updated_user = await async_user_repo.update_user(current_user.id, **update_data)
     if not updated_user:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to update user profile"
         )
+
+    user_cache.invalidate(current_user.id)
     
     return User(**updated_user)
@@ -0,0 +1,192 @@
+"""
+公开分享页缓存
+- ShareViewCache: 按分享token缓存渲染好的响应体和ETag，笔记或评论变更时失效
+- ViewCountBuffer: 在内存中合并查看次数，定期批量写入数据库
+
+缓存是进程内的：多worker部署时，其他worker上的条目最多在TTL内过期
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+def make_share_etag(share_token: str, note_updated_at: str, permission: str,
+                    comments: List[dict], next_cursor: Optional[str]) -> str:
+    """
+    由笔记更新时间、分享权限、首页评论（ID和更新时间）和评论游标生成弱ETag
+    不包含查看次数：否则热门链接每次重新渲染ETag都会变化，CDN和浏览器的重新验证全部变成200
+    响应体中的查看次数快照因此可能与ETag相同的其他响应不同，所以使用弱ETag（语义等价）
+    """
+    parts = [share_token, note_updated_at, permission, next_cursor or '']
+    parts.extend(f"{comment['id']}@{comment['updated_at']}" for comment in comments)
+    raw = '\0'.join(str(part) for part in parts)
+    return 'W/"' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 请求头是否命中当前ETag"""
+    if not if_none_match:
+        return False
+
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    # If-None-Match 使用弱比较，两边都忽略 W/ 前缀
+    opaque = etag.removeprefix('W/')
+    return '*' in candidates or any(candidate.removeprefix('W/') == opaque for candidate in candidates)
+
+class CachedShareView:
+    """一个分享页的渲染结果"""
+
+    __slots__ = ('share', 'body', 'etag', 'next_cursor', 'cached_at')
+
+    def __init__(self, share: dict, body: bytes, etag: str, next_cursor: Optional[str]):
+        self.share = share  # 分享记录，用于每次请求校验过期时间和密码
+        self.body = body  # 序列化后的 SharedNoteView
+        self.etag = etag
+        self.next_cursor = next_cursor  # 评论下一页游标
+        self.cached_at = time.monotonic()
+
+class ShareViewCache:
+    """按分享token缓存渲染结果（LRU + TTL）"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedShareView]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, share_token: str) -> Optional[CachedShareView]:
+        """获取未过期的缓存条目"""
+        with self._lock:
+            entry = self._entries.get(share_token)
+            if entry and time.monotonic() - entry.cached_at < self.ttl:
+                self._entries.move_to_end(share_token)
+                self.hits += 1
+                return entry
+
+            if entry:
+                del self._entries[share_token]
+            self.misses += 1
+            return None
+
+    def set(self, share_token: str, entry: CachedShareView):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[share_token] = entry
+            self._entries.move_to_end(share_token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, share_token: str):
+        """分享或其评论变更时失效"""
+        with self._lock:
+            self._entries.pop(share_token, None)
+
+    def invalidate_note(self, note_id: str):
+        """笔记变更时失效所有指向该笔记的分享"""
+        with self._lock:
+            for token in [t for t, e in self._entries.items() if e.share['note_id'] == note_id]:
+                del self._entries[token]
+
+    def invalidate_user(self, user_id: str):
+        """批量修改用户笔记（如批量标签操作）时失效该用户的所有分享"""
+        with self._lock:
+            for token in [t for t, e in self._entries.items() if e.share['user_id'] == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+class ViewCountBuffer:
+    """
+    查看次数合并写入
+    每次访问只在内存中计数，由后台任务按固定间隔一次性写入数据库
+    """
+
+    def __init__(self, flush_interval: float = 5):
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, share_token: str, amount: int = 1):
+        """记录一次查看"""
+        with self._lock:
+            self._pending[share_token] = self._pending.get(share_token, 0) + amount
+
+    def pending(self, share_token: str) -> int:
+        """尚未写入数据库的查看次数"""
+        with self._lock:
+            return self._pending.get(share_token, 0)
+
+    def discard(self, share_token: str):
+        """分享删除后丢弃未写入的计数"""
+        with self._lock:
+            self._pending.pop(share_token, None)
+
+    async def flush(self):
+        """把累积的查看次数在一个事务内写入数据库"""
+        with self._lock:
+            counts, self._pending = self._pending, {}
+
+        if not counts:
+            return
+
+        from database import async_share_repo
+
+        try:
+            await async_share_repo.increment_view_counts(counts)
+        except Exception as e:
+            logger.warning(f"写入分享查看次数失败，将在下次重试: {e}")
+            with self._lock:
+                for token, amount in counts.items():
+                    self._pending[token] = self._pending.get(token, 0) + amount
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """启动后台写入任务（应用启动时调用）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写入剩余计数（应用关闭时调用）"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+# 全局实例
+share_view_cache = ShareViewCache(
+    max_size=settings.SHARE_VIEW_CACHE_SIZE,
+    ttl=settings.SHARE_VIEW_CACHE_TTL
+)
+view_count_buffer = ViewCountBuffer(flush_interval=settings.SHARE_VIEW_FLUSH_INTERVAL)
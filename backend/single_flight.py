@@ -0,0 +1,148 @@
+"""
+进程内请求合并（single-flight）
+相同指纹的并发调用只向上游发出一次请求，其余调用等待并共享同一个结果
+- SingleFlight: 普通协程调用，所有调用方得到相同的返回值或异常
+- StreamFlight: 流式调用，后加入的调用方先回放已缓冲的数据块，再继续接收新数据块
+
+只合并正在进行中的调用，完成后立即移除；跨请求复用结果由 ai_cache 负责
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+class SingleFlight:
+    """合并相同key的并发协程调用"""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable]):
+        """
+        执行func，若相同key的调用正在进行则等待其结果
+        调用在独立任务中执行，个别调用方取消不会中断其他等待者
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.leaders += 1
+        else:
+            self.joined += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # 没有等待者时也要取出异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> dict:
+        return {
+            'in_flight': len(self._tasks),
+            'leaders': self.leaders,
+            'joined': self.joined
+        }
+
+class _SharedStream:
+    """一次上游流式调用：由后台任务消费上游并缓冲数据块，订阅者按各自进度读取"""
+
+    def __init__(self, source: AsyncIterator):
+        self.chunks: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("上游流已取消")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            # 关闭上游生成器，释放其持有的HTTP连接
+            aclose = getattr(source, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self):
+        # 唤醒所有等待者后换一个新的Event，供下一轮等待
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator:
+        position = 0
+        while True:
+            if position < len(self.chunks):
+                chunk = self.chunks[position]
+                position += 1
+                yield chunk
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+class StreamFlight:
+    """合并相同key的并发流式调用"""
+
+    def __init__(self):
+        self._streams: Dict[str, _SharedStream] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def stream(self, key: str, func: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """
+        迭代func()产生的数据块，若相同key的流正在进行则加入该流
+        后加入者从第一个数据块开始回放；所有订阅者都离开后取消上游流
+        """
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            shared = _SharedStream(func())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+            self.leaders += 1
+        else:
+            self.joined += 1
+
+        shared.subscribers += 1
+        try:
+            async for chunk in shared.subscribe():
+                yield chunk
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                self._forget(key, shared)
+                shared.cancel()
+
+    def _forget(self, key: str, shared: _SharedStream):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def get_stats(self) -> dict:
+        return {
+            'in_flight': len(self._streams),
+            'leaders': self.leaders,
+            'joined': self.joined
+        }
+
+# 全局实例
+ai_single_flight = SingleFlight()
+ai_stream_flight = StreamFlight()
@@ -0,0 +1,164 @@
+"""
+SSE流式响应工具
+- coalesce_stream: 按时间间隔或字节数合并上游文本片段，空闲时产出心跳，客户端断开时立即停止并关闭上游
+- StreamLimiter: 限制每个用户同时打开的流数量
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from config import settings
+
+HEARTBEAT_FRAME = ": ping\n\n"  # SSE注释行，客户端会忽略，用于保持连接和探测断开
+
+_END = object()
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+async def coalesce_stream(
+    source: AsyncIterator[str],
+    flush_interval: float,
+    flush_bytes: int,
+    heartbeat_interval: float,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    queue_size: int = 64
+) -> AsyncIterator[Optional[str]]:
+    """
+    合并source产出的文本片段
+    - 第一个片段立即发出，之后每 flush_interval 秒或累计 flush_bytes 字节发出一次
+    - 客户端读取较慢时，排队中的片段会合并到同一帧中；队列满时暂停读取source
+    - 超过 heartbeat_interval 秒没有数据时产出None，由调用方写出心跳帧
+    - 每次发出前检查客户端是否已断开，断开后停止迭代并关闭source
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def pump():
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(_Failure(e))
+
+    task = asyncio.ensure_future(pump())
+    loop = asyncio.get_running_loop()
+
+    buffer = []
+    buffered_bytes = 0
+    flush_at = None
+    sent_any = False
+    next_heartbeat = loop.time() + heartbeat_interval
+
+    try:
+        while True:
+            wake_at = flush_at if flush_at is not None else next_heartbeat
+            try:
+                item = await asyncio.wait_for(queue.get(), max(0, wake_at - loop.time()))
+            except asyncio.TimeoutError:
+                item = None
+
+            terminal = None
+            if isinstance(item, str):
+                # 顺带取出已排队的片段，读取越慢合并越多
+                while isinstance(item, str):
+                    buffer.append(item)
+                    buffered_bytes += len(item.encode('utf-8'))
+                    try:
+                        item = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        item = None
+                if flush_at is None:
+                    flush_at = loop.time() + flush_interval
+            if item is _END or isinstance(item, _Failure):
+                terminal = item
+            finished = terminal is not None
+
+            now = loop.time()
+            flush = buffer and (finished or not sent_any or buffered_bytes >= flush_bytes or now >= flush_at)
+            heartbeat = not buffer and not finished and now >= next_heartbeat
+
+            if flush or heartbeat:
+                if is_disconnected is not None and await is_disconnected():
+                    return
+
+            if flush:
+                yield ''.join(buffer)
+                buffer = []
+                buffered_bytes = 0
+                flush_at = None
+                sent_any = True
+                next_heartbeat = loop.time() + heartbeat_interval
+            elif heartbeat:
+                yield None
+                next_heartbeat = loop.time() + heartbeat_interval
+
+            if isinstance(terminal, _Failure):
+                raise terminal.error
+            if finished:
+                return
+    finally:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        aclose = getattr(source, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+class StreamLease:
+    """一个已占用的流名额，release可重复调用"""
+
+    __slots__ = ('_limiter', '_user_id', '_released')
+
+    def __init__(self, limiter: "StreamLimiter", user_id: str):
+        self._limiter = limiter
+        self._user_id = user_id
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release(self._user_id)
+
+class StreamLimiter:
+    """限制每个用户同时打开的流数量"""
+
+    def __init__(self, max_per_user: int):
+        self.max_per_user = max_per_user
+        self._open: Dict[str, int] = {}
+        self.rejected = 0
+
+    def acquire(self, user_id: str) -> Optional[StreamLease]:
+        """占用一个名额，已达上限时返回None"""
+        count = self._open.get(user_id, 0)
+        if count >= self.max_per_user:
+            self.rejected += 1
+            return None
+        self._open[user_id] = count + 1
+        return StreamLease(self, user_id)
+
+    def _release(self, user_id: str):
+        count = self._open.get(user_id, 0) - 1
+        if count > 0:
+            self._open[user_id] = count
+        else:
+            self._open.pop(user_id, None)
+
+    def open_streams(self, user_id: str) -> int:
+        return self._open.get(user_id, 0)
+
+    def get_stats(self) -> dict:
+        return {
+            'open_streams': sum(self._open.values()),
+            'users': len(self._open),
+            'max_per_user': self.max_per_user,
+            'rejected': self.rejected
+        }
+
+# 全局实例：聊天流
+chat_stream_limiter = StreamLimiter(settings.CHAT_MAX_STREAMS_PER_USER)
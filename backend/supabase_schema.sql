@@ -33,15 +33,21 @@ CREATE TABLE IF NOT EXISTS notes (
     title TEXT NOT NULL,
     content TEXT,
     tags JSONB DEFAULT '[]'::jsonb,  -- PostgreSQL使用JSONB存储JSON
+    folder_id UUID,  -- 所属文件夹，NULL表示未分类
     user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
+-- 为已存在的notes表添加folder_id列
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS folder_id UUID;
+
 -- 笔记表索引
 CREATE INDEX IF NOT EXISTS idx_notes_user_id ON notes(user_id);
 CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_notes_updated_at ON notes(updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_notes_user_updated ON notes(user_id, updated_at DESC, id DESC);  -- 笔记列表/游标分页
+CREATE INDEX IF NOT EXISTS idx_notes_user_folder_updated ON notes(user_id, folder_id, updated_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_notes_tags ON notes USING GIN(tags);  -- JSONB索引
 
 -- 笔记全文搜索索引
@@ -61,6 +67,8 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
 );
 
 CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id);
+DROP INDEX IF EXISTS idx_chat_sessions_user_updated;
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated_id ON chat_sessions(user_id, updated_at DESC, id DESC);
 
 -- ========================================
 -- 4. 聊天消息表
@@ -74,6 +82,8 @@ CREATE TABLE IF NOT EXISTS chat_messages (
 );
 
 CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages(session_id);
+DROP INDEX IF EXISTS idx_chat_messages_session_created;
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created_id ON chat_messages(session_id, created_at, id);
 
 -- ========================================
 -- 5. 项目看板表
@@ -89,6 +99,7 @@ CREATE TABLE IF NOT EXISTS boards (
 );
 
 CREATE INDEX IF NOT EXISTS idx_boards_user_id ON boards(user_id);
+CREATE INDEX IF NOT EXISTS idx_boards_user_updated ON boards(user_id, updated_at DESC);
 
 -- ========================================
 -- 6. 看板列表表
@@ -103,6 +114,7 @@ CREATE TABLE IF NOT EXISTS lists (
 );
 
 CREATE INDEX IF NOT EXISTS idx_lists_board_id ON lists(board_id);
+CREATE INDEX IF NOT EXISTS idx_lists_board_position ON lists(board_id, position);
 
 -- ========================================
 -- 7. 任务卡片表
@@ -123,6 +135,7 @@ CREATE TABLE IF NOT EXISTS cards (
 );
 
 CREATE INDEX IF NOT EXISTS idx_cards_list_id ON cards(list_id);
+CREATE INDEX IF NOT EXISTS idx_cards_list_position ON cards(list_id, position);
 CREATE INDEX IF NOT EXISTS idx_cards_completed ON cards(completed);
 
 -- ========================================
@@ -137,6 +150,42 @@ CREATE TABLE IF NOT EXISTS card_comments (
 );
 
 CREATE INDEX IF NOT EXISTS idx_card_comments_card_id ON card_comments(card_id);
+CREATE INDEX IF NOT EXISTS idx_card_comments_card_created ON card_comments(card_id, created_at);
+
+-- ========================================
+-- 笔记分享表
+-- ========================================
+CREATE TABLE IF NOT EXISTS note_shares (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    note_id UUID NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    share_token VARCHAR(64) UNIQUE NOT NULL,  -- UNIQUE约束自带索引
+    permission VARCHAR(20) NOT NULL DEFAULT 'view_only' CHECK (permission IN ('view_only', 'can_comment')),
+    expires_at TIMESTAMPTZ,
+    password VARCHAR(255),  -- 访问密码哈希
+    view_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_note_shares_user_created ON note_shares(user_id, created_at DESC);
+
+-- ========================================
+-- 分享评论表
+-- ========================================
+CREATE TABLE IF NOT EXISTS share_comments (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    note_id UUID NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    share_token VARCHAR(64) NOT NULL REFERENCES note_shares(share_token) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    author_name VARCHAR(100) NOT NULL,
+    author_email VARCHAR(255),
+    user_id UUID REFERENCES users(id) ON DELETE SET NULL,  -- 登录用户评论时记录
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_share_comments_token_created ON share_comments(share_token, created_at, id);
 
 -- ========================================
 -- RBAC权限系统表
@@ -415,6 +464,214 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- ========================================
+-- 笔记分页函数（基于 updated_at, id 的游标分页）
+-- content_length 不为空时只返回内容前缀，用于列表摘要
+-- ========================================
+CREATE OR REPLACE FUNCTION get_notes_page(
+    user_uuid UUID,
+    page_limit INT DEFAULT NULL,
+    cursor_updated_at TIMESTAMPTZ DEFAULT NULL,
+    cursor_id UUID DEFAULT NULL,
+    folder UUID DEFAULT NULL,
+    only_uncategorized BOOLEAN DEFAULT FALSE,
+    content_length INT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    content TEXT,
+    tags JSONB,
+    folder_id UUID,
+    user_id UUID,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        n.id,
+        n.title,
+        CASE WHEN content_length IS NULL THEN n.content ELSE LEFT(n.content, content_length) END,
+        n.tags,
+        n.folder_id,
+        n.user_id,
+        n.created_at,
+        n.updated_at
+    FROM notes n
+    WHERE n.user_id = user_uuid
+    AND (NOT only_uncategorized OR n.folder_id IS NULL)
+    AND (folder IS NULL OR n.folder_id = folder)
+    AND (cursor_updated_at IS NULL OR (n.updated_at, n.id) < (cursor_updated_at, cursor_id))
+    ORDER BY n.updated_at DESC, n.id DESC
+    LIMIT page_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- ========================================
+-- 笔记标签索引表（notes.tags 的规范化副本，由触发器在同一事务内维护）
+-- ========================================
+CREATE TABLE IF NOT EXISTS note_tags (
+    note_id UUID NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL,
+    tag TEXT NOT NULL,
+    position INT NOT NULL DEFAULT 0,  -- 标签在notes.tags中的顺序
+    PRIMARY KEY (note_id, tag)
+);
+
+CREATE INDEX IF NOT EXISTS idx_note_tags_user_tag ON note_tags(user_id, tag, note_id);
+
+CREATE OR REPLACE FUNCTION sync_note_tags()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM note_tags WHERE note_id = NEW.id;
+    INSERT INTO note_tags (note_id, user_id, tag, position)
+    SELECT NEW.id, NEW.user_id, t.tag, MIN(t.ord)::INT - 1
+    FROM jsonb_array_elements_text(COALESCE(NEW.tags, '[]'::jsonb)) WITH ORDINALITY AS t(tag, ord)
+    WHERE t.tag <> ''
+    GROUP BY t.tag;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sync_note_tags_trigger ON notes;
+CREATE TRIGGER sync_note_tags_trigger AFTER INSERT OR UPDATE OF tags ON notes
+    FOR EACH ROW EXECUTE FUNCTION sync_note_tags();
+
+-- 回填已有笔记的标签
+INSERT INTO note_tags (note_id, user_id, tag, position)
+SELECT n.id, n.user_id, t.tag, MIN(t.ord)::INT - 1
+FROM notes n, jsonb_array_elements_text(COALESCE(n.tags, '[]'::jsonb)) WITH ORDINALITY AS t(tag, ord)
+WHERE t.tag <> ''
+GROUP BY n.id, n.user_id, t.tag
+ON CONFLICT (note_id, tag) DO NOTHING;
+
+ALTER TABLE note_tags ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY note_tags_user_policy ON note_tags
+    FOR ALL
+    USING (user_id = auth.uid()::uuid);
+
+-- ========================================
+-- 标签统计函数
+-- ========================================
+CREATE OR REPLACE FUNCTION get_tag_stats(user_uuid UUID)
+RETURNS TABLE (
+    tag TEXT,
+    notes_count BIGINT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT nt.tag, COUNT(*) AS notes_count
+    FROM note_tags nt
+    WHERE nt.user_id = user_uuid
+    GROUP BY nt.tag
+    ORDER BY notes_count DESC, nt.tag;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- ========================================
+-- 批量标签替换函数（重命名/合并/删除）
+-- 在一个事务内以集合操作重写受影响笔记的tags，note_tags由触发器同步
+-- target_tag 为 NULL 时删除 source_tags
+-- ========================================
+CREATE OR REPLACE FUNCTION replace_tags(
+    user_uuid UUID,
+    source_tags TEXT[],
+    target_tag TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    updated_notes BIGINT,
+    tag_usages BIGINT
+) AS $$
+DECLARE
+    usage_count BIGINT;
+    note_count BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO usage_count
+    FROM note_tags nt
+    WHERE nt.user_id = user_uuid AND nt.tag = ANY(source_tags);
+
+    UPDATE notes n SET tags = COALESCE((
+        SELECT jsonb_agg(r.new_tag ORDER BY r.pos)
+        FROM (
+            SELECT
+                CASE WHEN nt.tag = ANY(source_tags) THEN target_tag ELSE nt.tag END AS new_tag,
+                MIN(nt.position) AS pos
+            FROM note_tags nt
+            WHERE nt.note_id = n.id
+            GROUP BY 1
+        ) r
+        WHERE r.new_tag IS NOT NULL
+    ), '[]'::jsonb)
+    WHERE n.user_id = user_uuid
+    AND n.id IN (
+        SELECT nt.note_id FROM note_tags nt
+        WHERE nt.user_id = user_uuid AND nt.tag = ANY(source_tags)
+    );
+
+    GET DIAGNOSTICS note_count = ROW_COUNT;
+
+    RETURN QUERY SELECT note_count, usage_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ========================================
+-- 批量追加标签（AI批量分类结果写回）
+-- tags_by_note 形如 {"笔记ID": ["标签", ...]}；已有标签保持原顺序，新标签排在后面
+-- 在一个事务内更新所有笔记，note_tags由触发器同步；返回标签实际发生变化的笔记数
+-- ========================================
+CREATE OR REPLACE FUNCTION add_note_tags(
+    user_uuid UUID,
+    tags_by_note JSONB
+)
+RETURNS BIGINT AS $$
+DECLARE
+    note_count BIGINT;
+BEGIN
+    UPDATE notes n SET
+        tags = (
+            SELECT jsonb_agg(merged.tag ORDER BY merged.pos)
+            FROM (
+                SELECT all_tags.tag, MIN(all_tags.pos) AS pos
+                FROM (
+                    SELECT e.tag, e.ord AS pos
+                    FROM jsonb_array_elements_text(COALESCE(n.tags, '[]'::jsonb)) WITH ORDINALITY AS e(tag, ord)
+                    UNION ALL
+                    SELECT s.tag, 1000000 + s.ord
+                    FROM jsonb_array_elements_text(tags_by_note -> n.id::text) WITH ORDINALITY AS s(tag, ord)
+                ) all_tags
+                WHERE all_tags.tag <> ''
+                GROUP BY all_tags.tag
+            ) merged
+        ),
+        updated_at = NOW()
+    WHERE n.user_id = user_uuid
+    AND tags_by_note ? n.id::text
+    AND EXISTS (
+        SELECT 1 FROM jsonb_array_elements_text(tags_by_note -> n.id::text) AS s(tag)
+        WHERE s.tag <> '' AND NOT COALESCE(n.tags, '[]'::jsonb) ? s.tag
+    );
+
+    GET DIAGNOSTICS note_count = ROW_COUNT;
+
+    RETURN note_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ========================================
+-- 分享查看次数原子自增
+-- ========================================
+CREATE OR REPLACE FUNCTION increment_share_view_count(
+    token VARCHAR,
+    amount INT DEFAULT 1
+)
+RETURNS INT AS $$
+    UPDATE note_shares SET view_count = view_count + amount
+    WHERE share_token = token
+    RETURNING view_count;
+$$ LANGUAGE sql;
+
 -- ========================================
 -- 完成!
 -- ========================================
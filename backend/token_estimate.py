@@ -0,0 +1,15 @@
+"""
+token估算
+不依赖分词器的粗略估算，用于按token预算控制聊天上下文和批量请求的大小
+"""
+
+import re
+
+# 中日韩字符大约每字一个token，其余文本大约每4个字符一个token
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+_MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息（或每段拼接内容）的角色和分隔符开销
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4 + _MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,107 @@
+"""
+已认证用户缓存
+get_current_user 每个请求都要按邮箱加载用户，这里按邮箱缓存 User 模型（LRU + TTL），同时维护 用户ID -> 邮箱 的索引：
+- 资料修改、管理员修改或删除用户后按用户ID失效
+- 缓存是进程内的：多worker部署时，其他worker上的条目最多在TTL内过期（角色变更、删除用户同样如此）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import settings
+from models import User
+
+class UserCache:
+    """按邮箱缓存已认证用户（LRU + TTL）"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()
+        self._emails: Dict[str, str] = {}  # 用户ID -> 邮箱
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Optional[User]:
+        """获取未过期的用户"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry[0]
+
+            if entry:
+                self._remove(email)
+            self.misses += 1
+            return None
+
+    def get_by_id(self, user_id: str) -> Optional[User]:
+        """按用户ID获取未过期的用户"""
+        with self._lock:
+            email = self._emails.get(user_id)
+        return self.get(email) if email else None
+
+    def set(self, user: User):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            # 邮箱或ID变化时先清掉旧的对应关系
+            previous_email = self._emails.get(user.id)
+            if previous_email and previous_email != user.email:
+                self._remove(previous_email)
+            self._entries[user.email] = (user, time.monotonic())
+            self._entries.move_to_end(user.email)
+            self._emails[user.id] = user.email
+            while len(self._entries) > self.max_size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                if self._emails.get(evicted.id) == evicted.email:
+                    del self._emails[evicted.id]
+
+    def _remove(self, email: str):
+        """删除条目（调用方持有锁）"""
+        entry = self._entries.pop(email, None)
+        if entry and self._emails.get(entry[0].id) == email:
+            del self._emails[entry[0].id]
+
+    def invalidate(self, user_id: str):
+        """用户资料、角色变更或用户被删除后调用"""
+        with self._lock:
+            email = self._emails.get(user_id)
+            if email:
+                self._remove(email)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._emails.clear()
+
+    def get_stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+# 全局实例
+user_cache = UserCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    enabled=settings.USER_CACHE_ENABLED
+)
@@ -0,0 +1,44 @@
+"""
+流式ZIP写出
+边生成条目边产出字节，无需在内存或磁盘中保留整个压缩包
+zipfile在不可seek的输出上会为每个条目写入数据描述符，生成的文件可被常见解压工具正常读取
+"""
+
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+class _ChunkSink:
+    """只支持写入的文件对象，暂存zipfile写出的字节，由调用方及时取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(entries: Iterable[Tuple[str, bytes]],
+               compression: int = zipfile.ZIP_DEFLATED) -> Iterator[bytes]:
+    """
+    把 (文件名, 内容) 序列写成ZIP，每写完一个条目就产出对应的字节
+    内存中只保留当前条目；最后产出中央目录
+    """
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, 'w', compression) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+    # 关闭时写入的中央目录
+    yield sink.drain()
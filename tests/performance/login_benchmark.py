@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+登录洪峰基准测试
+在进程内（httpx ASGITransport）并发发起大量登录请求，同时用一个定时协程测量事件循环延迟：
+bcrypt在线程池中计算时，事件循环仍能按时调度其他请求
+--inline 模式直接在协程中同步校验密码（旧实现），用于对比
+事件循环最大延迟超过 --max-lag-ms 时以非0状态码退出，可直接用于CI
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend')
+
+EMAIL = 'login-benchmark@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def percentile(values, pct: float) -> float:
+    """简单百分位数（毫秒值列表）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def measure_lag(stop: asyncio.Event, interval: float, lags: list):
+    """每隔interval秒醒来一次，记录实际唤醒时间比预期晚了多少"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - expected) * 1000)
+
+
+async def run_storm(client, logins: int, concurrency: int):
+    """发起登录洪峰，返回 (每个请求耗时ms, 状态码计数, 事件循环延迟ms, 总耗时s)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def login_once():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post('/api/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_lag(stop, 0.01, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login_once() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    return latencies, statuses, lags, elapsed
+
+
+async def run_benchmark(args) -> int:
+    import httpx
+    import password_hashing
+    from main import app
+
+    if args.inline:
+        # 旧实现：在事件循环线程中直接计算
+        async def run_inline(func, *func_args):
+            return func(*func_args)
+        password_hashing._run = run_inline
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        response = await client.post('/api/auth/register', json={
+            'email': EMAIL, 'password': PASSWORD, 'full_name': 'Login Benchmark'
+        })
+        if response.status_code != 200:
+            print(f"注册测试用户失败: {response.status_code} {response.text}")
+            return 1
+
+        latencies, statuses, lags, elapsed = await run_storm(client, args.logins, args.concurrency)
+
+    print("=" * 60)
+    print(f"登录洪峰基准测试（{'同步校验' if args.inline else '线程池校验'}）")
+    print("=" * 60)
+    print(f"请求数: {args.logins}  并发: {args.concurrency}  bcrypt轮数: {os.environ['BCRYPT_ROUNDS']}")
+    print(f"状态码: {statuses}")
+    print(f"总耗时: {elapsed:.2f}s  吞吐量: {args.logins / elapsed:.1f} 次/秒")
+    print(f"请求耗时: p50 {percentile(latencies, 0.5):.0f}ms  p95 {percentile(latencies, 0.95):.0f}ms")
+    max_lag = max(lags) if lags else 0.0
+    print(f"事件循环延迟: 平均 {statistics.mean(lags) if lags else 0:.1f}ms  "
+          f"p99 {percentile(lags, 0.99):.1f}ms  最大 {max_lag:.1f}ms")
+    print(f"哈希线程池: {password_hashing.get_stats()}")
+
+    if max_lag > args.max_lag_ms:
+        print(f"\n✗ 事件循环最大延迟 {max_lag:.1f}ms 超过阈值 {args.max_lag_ms}ms")
+        return 1
+
+    print(f"\n✓ 事件循环最大延迟未超过 {args.max_lag_ms}ms")
+    return 0
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='登录洪峰基准测试')
+    parser.add_argument('--logins', type=int, default=100, help='登录请求总数')
+    parser.add_argument('--concurrency', type=int, default=50, help='同时进行的请求数')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt轮数')
+    parser.add_argument('--max-lag-ms', type=float, default=100, help='事件循环最大延迟阈值（毫秒）')
+    parser.add_argument('--inline', action='store_true', help='在事件循环中同步校验密码（对比旧实现）')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 必须在导入后端模块之前设置
+        os.environ['DATABASE_TYPE'] = 'sqlite'
+        os.environ['SQLITE_DATABASE_PATH'] = os.path.join(tmp_dir, 'login_benchmark.db')
+        os.environ['BCRYPT_ROUNDS'] = str(args.rounds)
+        os.environ['PASSWORD_HASH_MAX_PENDING'] = str(max(args.concurrency, 1))
+        os.environ['USER_CACHE_ENABLED'] = 'false'
+        sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+        # 洪峰期间每个请求都会触发慢请求警告
+        logging.getLogger('middleware').setLevel(logging.ERROR)
+
+        exit_code = asyncio.run(run_benchmark(args))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
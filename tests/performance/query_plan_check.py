@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+SQLite查询计划检查
+校验声明的索引已创建，并用 EXPLAIN QUERY PLAN 检查热点查询没有退化为全表扫描
+存在退化时以非0状态码退出，可直接用于CI
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend')
+
+
+def run_check(database_path: str) -> int:
+    """初始化数据库并检查查询计划，返回退出码"""
+    # 必须在导入后端模块之前设置数据库路径
+    os.environ['SQLITE_DATABASE_PATH'] = database_path
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+    from database_sqlite import init_database  # 建表和建索引在下面调用 init_database() 时完成
+    from database_optimized import db_pool, QueryOptimizer
+
+    init_database()
+
+    with db_pool.get_connection() as conn:
+        missing = QueryOptimizer.ensure_indexes(conn)
+        regressions = QueryOptimizer.find_plan_regressions(conn)
+
+        print("=" * 60)
+        print("查询计划检查")
+        print("=" * 60)
+        for name, sql, params in QueryOptimizer.HOT_QUERIES:
+            status = "✗" if name in regressions else "✓"
+            print(f"{status} {name}")
+            for detail in QueryOptimizer.explain(conn, sql, params):
+                print(f"    {detail}")
+
+    if missing:
+        print(f"\n缺失索引: {', '.join(missing)}")
+
+    if regressions:
+        print(f"\n{len(regressions)} 个热点查询退化为全表扫描或临时排序:")
+        for name, problems in regressions.items():
+            print(f"  {name}: {'; '.join(problems)}")
+
+    if missing or regressions:
+        return 1
+
+    print(f"\n全部 {len(QueryOptimizer.HOT_QUERIES)} 个热点查询均使用索引")
+    return 0
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='SQLite查询计划检查')
+    parser.add_argument('--db', help='要检查的数据库文件（默认使用临时数据库）')
+
+    args = parser.parse_args()
+
+    if args.db:
+        sys.exit(run_check(os.path.abspath(args.db)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exit_code = run_check(os.path.join(tmp_dir, 'query_plan_check.db'))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
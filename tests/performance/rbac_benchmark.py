@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+RBAC权限检查微基准
+在临时数据库中创建一个拥有角色和直接授权的用户，测量缓存命中时单次权限检查的耗时：
+- 位掩码检查（has_permission / has_all_permissions / has_any_permission，权限要求预先声明）
+- 对比：按权限名在集合中逐个查找（之前的实现方式），以及缓存查找和检查本身各自的耗时
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend')
+
+REQUIRED = ['notes.read', 'notes.update', 'todos.read']
+
+
+def create_user(database) -> str:
+    """创建测试用户：editor角色 + 一项直接授予的权限"""
+    from database_sqlite import get_connection
+
+    user = database.user_repo.create_user(
+        email=f'rbac-{uuid.uuid4().hex[:8]}@example.com', password_hash='x', full_name='RBAC Benchmark'
+    )
+    now = datetime.utcnow().isoformat() + 'Z'
+
+    conn = get_connection()
+    try:
+        role_id = conn.execute("SELECT id FROM roles WHERE name = 'editor'").fetchone()['id']
+        permission_id = conn.execute("SELECT id FROM permissions WHERE name = 'system.stats'").fetchone()['id']
+        conn.execute('INSERT INTO user_roles (user_id, role_id, assigned_at) VALUES (?, ?, ?)',
+                     (user['id'], role_id, now))
+        conn.execute('INSERT INTO user_permissions (user_id, permission_id, granted_at) VALUES (?, ?, ?)',
+                     (user['id'], permission_id, now))
+        conn.commit()
+    finally:
+        conn.close()
+    return user['id']
+
+
+def run_benchmark(number: int) -> int:
+    import database
+    from middleware import PermissionRequirement, rbac_checker
+
+    user_id = create_user(database)
+    rbac_checker.load_catalog()
+
+    requirement = PermissionRequirement(REQUIRED)
+    any_requirement = PermissionRequirement(['users.delete', 'system.stats'])
+    permissions = rbac_checker.get_user_permissions(user_id)
+    entry = rbac_checker._get_entry(user_id)
+    mask, _ = requirement.compile(entry.catalog)
+
+    # 结果必须与按名称查找一致
+    assert rbac_checker.has_permission(user_id, 'notes.read')
+    assert not rbac_checker.has_permission(user_id, 'users.delete')
+    assert rbac_checker.has_all_permissions(user_id, requirement) == all(p in permissions for p in REQUIRED)
+    assert rbac_checker.has_any_permission(user_id, any_requirement)
+    assert not rbac_checker.has_all_permissions(user_id, ['notes.read', 'no.such.permission'])
+
+    cases = [
+        ("has_permission（位运算）",
+         lambda: rbac_checker.has_permission(user_id, 'notes.read')),
+        ("has_all_permissions（预编译要求，3项）",
+         lambda: rbac_checker.has_all_permissions(user_id, requirement)),
+        ("has_any_permission（预编译要求，2项）",
+         lambda: rbac_checker.has_any_permission(user_id, any_requirement)),
+        ("has_all_permissions（每次传入列表，3项）",
+         lambda: rbac_checker.has_all_permissions(user_id, REQUIRED)),
+        ("对比：缓存查找 + 集合逐个查找（之前的实现，3项）",
+         lambda: all(p in rbac_checker.get_user_permissions(user_id) for p in REQUIRED)),
+        ("其中：缓存查找",
+         lambda: rbac_checker._get_entry(user_id)),
+        ("其中：位运算（3项）",
+         lambda: entry.mask & mask == mask),
+        ("其中：集合逐个查找（3项）",
+         lambda: all(p in permissions for p in REQUIRED)),
+    ]
+
+    print("=" * 60)
+    print(f"RBAC权限检查微基准（权限目录 {rbac_checker.get_stats()['permissions']} 项，每项 {number} 次）")
+    print("=" * 60)
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{best / number * 1e9:8.0f} ns/次  {name}")
+
+    print(f"\n缓存统计: {rbac_checker.get_stats()}")
+    return 0
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='RBAC权限检查微基准')
+    parser.add_argument('--number', type=int, default=200000, help='每项测量的调用次数')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 必须在导入后端模块之前设置
+        os.environ['DATABASE_TYPE'] = 'sqlite'
+        os.environ['SQLITE_DATABASE_PATH'] = os.path.join(tmp_dir, 'rbac_benchmark.db')
+        sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+        exit_code = run_benchmark(args.number)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()